@@ -7,10 +7,11 @@ import uuid
 import random
 import math
 import asyncio
-from typing import Any, Dict, List, Optional, TypedDict
+from typing import Annotated, Any, Awaitable, Callable, Dict, List, Optional, TypedDict
 
-import polyline as polyline_lib
+import numpy as np
 from fastapi import HTTPException
+from langgraph.config import get_stream_writer
 from langgraph.graph import END, StateGraph
 
 try:
@@ -70,11 +71,19 @@ from app.schemas import (
 )
 from app.services import (
     bq_writer,
+    deadline,
+    distance_calibration,
     fallback,
+    llm_speculation,
     maps_routes_client,
+    path_distance,
     places_client,
     polyline,
+    polyline_codec,
     ranker_client,
+    route_geometry,
+    simplify,
+    vertex_client,
     vertex_llm,
 )
 from app.services.feature_calc import Candidate, calc_features
@@ -95,13 +104,41 @@ def _set_span_route_attrs(span: Any, req: GenerateRouteRequest, state: AgentStat
             span.set_attribute("fallback.reason", str(fallback_reason))
 
 
+# 状態のリスト・辞書フィールドのリデューサー。ノードは追加分だけを返し、リデューサーがチャネルの値をその場で更新する。
+# チャネルの値はグラフ実行ごとに新しく作られ、更新はスーパーステップの終わりにまとめて適用されるので、
+# 実行中のノードが受け取った値が途中で書き換わることはない（ステップをまたいで参照を持ち続ける場合はコピーすること）。
+
+
+def _merge_dict(left: Optional[Dict[str, Any]], right: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """キー単位でマージする（並行に走るノードが latency_ms などの別キーを更新しても衝突しない）。"""
+    if left is None:
+        left = {}
+    if right:
+        left.update(right)
+    return left
+
+
+def _extend_unique(left: Optional[List[Any]], right: Optional[List[Any]]) -> List[Any]:
+    """未登録の要素だけを追加する（tools_used / fallback_reasons は同じ値を二重に持たない）。"""
+    if left is None:
+        left = []
+    for item in right or ():
+        if item not in left:
+            left.append(item)
+    return left
+
+
 class AgentState(TypedDict, total=False):
     request: GenerateRouteRequest
-    errors: List[str]
+    # グラフの実行ごとの ID（request_id はクライアント指定で重複しうるため、実行単位の登録にはこちらを使う）
+    run_id: str
+    # リクエスト全体の期限（各ノードはここから残り時間を見て、外部呼び出しのタイムアウトや任意処理の省略を決める）
+    deadline: deadline.Deadline
+    errors: Annotated[List[str], _extend_unique]
     plan_steps: List[str]
     start_time: float
-    tools_used: List[ToolName]
-    fallback_reasons: List[str]
+    tools_used: Annotated[List[ToolName], _extend_unique]
+    fallback_reasons: Annotated[List[str], _extend_unique]
     bq_request_logged: bool
     request_row_id: Optional[str]
     candidates: List[Dict[str, Any]]
@@ -123,9 +160,12 @@ class AgentState(TypedDict, total=False):
     shown_rank_map: Dict[str, int]
     sample_points: List[tuple[float, float]]
     decoded_points: List[tuple[float, float]]
+    route_index: Optional[path_distance.SegmentGridIndex]
+    route_indexes: Dict[str, path_distance.SegmentGridIndex]
     places: List[Dict[str, Any]]
     places_status: str
     places_error: Optional[str]
+    places_hidden_keyword: Optional[str]
     nav_waypoints: List[LatLng]
     simplify_meta: Dict[str, Any]
     description: str
@@ -139,7 +179,9 @@ class AgentState(TypedDict, total=False):
     is_fallback_route: bool
     quality_score: float
     total_latency_ms: int
-    latency_ms: Dict[str, int]
+    latency_ms: Annotated[Dict[str, int], _merge_dict]
+    # ノードごとの (開始, 終了) の start_time からの経過 ms（クリティカルパスの算出用）
+    node_spans: Annotated[Dict[str, List[int]], _merge_dict]
     fallback_details: List[FallbackDetail]
     title: str
     title_llm_status: str
@@ -147,7 +189,7 @@ class AgentState(TypedDict, total=False):
     response: GenerateRouteResponse
 
 
-def _init_state(req: GenerateRouteRequest) -> AgentState:
+def _init_state(req: GenerateRouteRequest, budget: Optional[deadline.Deadline] = None) -> AgentState:
     plan_steps = [
         "validate_request",
         "log_request_bq",
@@ -168,6 +210,8 @@ def _init_state(req: GenerateRouteRequest) -> AgentState:
     ]
     return {
         "request": req,
+        "run_id": uuid.uuid4().hex,
+        "deadline": budget if budget is not None else deadline.start(),
         "errors": [],
         "plan_steps": plan_steps,
         "start_time": time.time(),
@@ -195,6 +239,7 @@ def _init_state(req: GenerateRouteRequest) -> AgentState:
         "places": [],
         "places_status": "pending",
         "places_error": None,
+        "places_hidden_keyword": None,
         "nav_waypoints": [],
         "simplify_meta": {},
         "desc_llm_status": "pending",
@@ -208,16 +253,38 @@ def _init_state(req: GenerateRouteRequest) -> AgentState:
         "quality_score": 0.0,
         "total_latency_ms": 0,
         "latency_ms": {},
+        "node_spans": {},
         "fallback_details": [],
         "title_llm_status": "pending",
         "title_fallback_used": False,
     }
 
 
-def _merge_latency(state: AgentState, key: str, elapsed_ms: int) -> Dict[str, int]:
-    lat = dict(state.get("latency_ms", {}))
-    lat[key] = int(elapsed_ms)
-    return lat
+def _latency_entry(key: str, elapsed_ms: int) -> Dict[str, int]:
+    """latency_ms の更新分（リデューサーが既存の値にマージする）。"""
+    return {key: int(elapsed_ms)}
+
+
+def _emit_progress(event: str, data: Dict[str, Any]) -> None:
+    """
+    ストリーミング実行（run_generate_graph の on_event 指定時）なら途中経過を送る。
+    通常実行では LangGraph の writer が何もしない。グラフ外から直接呼ばれた場合も何もしない。
+    """
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        return
+    writer({"event": event, "data": data})
+
+
+def _route_progress_data(route: Dict[str, Any], req: GenerateRouteRequest) -> Dict[str, Any]:
+    """route イベントの内容（build_response の route と同じ変換）。"""
+    return {
+        "route_id": route.get("route_id"),
+        "polyline": route.get("polyline", "xxxx"),
+        "distance_km": float(route.get("distance_km", req.distance_km)),
+        "duration_min": int(route.get("duration_min") or 32),
+    }
 
 
 def _build_spots_from_places(places: List[Dict[str, Any]]) -> List[Spot]:
@@ -233,13 +300,6 @@ def _build_spots_from_places(places: List[Dict[str, Any]]) -> List[Spot]:
     ]
 
 
-def _ensure_tool_used(tools_used: List[ToolName], tool: ToolName) -> List[ToolName]:
-    updated = list(tools_used)
-    if tool not in updated:
-        updated.append(tool)
-    return updated
-
-
 def _select_unique_types(places: List[Dict[str, Any]], max_spots: int) -> List[Dict[str, Any]]:
     if not places:
         return []
@@ -296,22 +356,53 @@ def _spot_type_diversity(places: List[Dict[str, Any]]) -> float:
     return max(0.0, 1.0 - (max_count / len(types)))
 
 
+# polyline がない候補（フォールバック等）の形状特徴量。従来の固定値に合わせる
+_FALLBACK_GEOMETRY = route_geometry.RouteGeometry(
+    loop_closure_m=20.0,
+    bbox_area_km2=0.5,
+    path_length_m=0.0,
+    path_length_ratio=1.3,
+    turn_count=0,
+    backtrack_ratio=0.0,
+)
+
+
+def _build_route_index(points: Any) -> Optional[path_distance.SegmentGridIndex]:
+    """デコード済みの経路（タプルのリストまたは配列）から線分グリッドインデックスを作る。点がなければ None。"""
+    if points is None or len(points) == 0:
+        return None
+    return path_distance.SegmentGridIndex(points, cell_m=float(settings.ROUTE_INDEX_CELL_M))
+
+
+def _place_route_distances(
+    places: List[Dict[str, Any]],
+    engine: path_distance.PathDistanceEngine,
+    max_distance_m: Optional[float] = None,
+) -> Dict[int, float]:
+    """
+    スポットごとの経路までの最短距離（m）を一括計算する。キーは id(place)。座標のないスポットは含めない。
+    max_distance_m を指定すると、それより遠いスポットの距離は inf になる（インデックスは近傍セルだけを見る）。
+    """
+    located = [p for p in places if p.get("lat") is not None and p.get("lng") is not None]
+    if not located:
+        return {}
+    coords = [(float(p["lat"]), float(p["lng"])) for p in located]
+    dists = engine.distances_m(coords, max_distance_m)
+    return {id(p): float(d) for p, d in zip(located, dists.tolist())}
+
+
 def _filter_places_by_route_distance(
     places: List[Dict[str, Any]],
-    decoded_points: List[tuple[float, float]],
+    route_distances: Dict[int, float],
     max_distance_m: float,
     max_spots: int,
 ) -> List[Dict[str, Any]]:
-    if not places or not decoded_points:
-        return places[:max_spots]
-
+    """_place_route_distances の結果を使い、経路から max_distance_m 以内のスポットを近い順に返す。"""
     scored: List[tuple[float, Dict[str, Any]]] = []
     for p in places:
-        lat = p.get("lat")
-        lng = p.get("lng")
-        if lat is None or lng is None:
+        dist_m = route_distances.get(id(p))
+        if dist_m is None:
             continue
-        dist_m = polyline.distance_to_path_m(decoded_points, (float(lat), float(lng)))
         if dist_m <= max_distance_m:
             scored.append((dist_m, p))
 
@@ -361,17 +452,6 @@ def _ensure_polyline_start(
     return decoded_points, changed
 
 
-def _dedupe_nearby_points(points: List[LatLng], threshold_m: float = 10.0) -> List[LatLng]:
-    if not points:
-        return []
-    deduped = [points[0]]
-    for p in points[1:]:
-        if _haversine_m(deduped[-1], p) <= threshold_m:
-            continue
-        deduped.append(p)
-    return deduped
-
-
 async def _collect_places_two_phase(
     *,
     request_id: str,
@@ -380,10 +460,13 @@ async def _collect_places_two_phase(
     max_spots: int = 5,
     radius_m: int = 800,
     max_results: int = 3,
+    hidden_keyword: Optional[str] = None,
 ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     merged: List[Dict[str, Any]] = []
     seen_keys = set()
-    hidden_keyword = places_client.pick_hidden_keyword(theme)
+    # 穴場キーワードはリクエスト内で固定して渡す（候補間・fetch_places 間で Places キャッシュを共有するため）
+    if hidden_keyword is None:
+        hidden_keyword = places_client.pick_hidden_keyword(theme)
     classic_types = places_client.get_classic_place_types_for_theme(theme)
     if settings.PLACES_SAMPLE_POINTS_MAX > 0:
         sample_points = sample_points[: settings.PLACES_SAMPLE_POINTS_MAX]
@@ -405,6 +488,11 @@ async def _collect_places_two_phase(
     for phase in phases:
         if len(merged) >= max_spots:
             break
+        if phase["name"] == "classic" and not deadline.can_afford(float(settings.DEADLINE_PLACES_PHASE2_MIN_SEC)):
+            # 二段目（テーマ別タイプ）は任意。期限が近ければ一段目の結果だけで返す
+            deadline.record_skip("places_phase2")
+            logger.info("[Places Phase2 Skipped] request_id=%s found=%d (deadline)", request_id, len(merged))
+            break
         for (lat, lng) in sample_points:
             if len(merged) >= max_spots:
                 break
@@ -455,20 +543,20 @@ async def _collect_places_two_phase(
 
 async def validate_request(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
-    errors = list(state["errors"])
+    errors: List[str] = []
     t_start = time.perf_counter()
     if not req.round_trip and req.end_location is None:
         errors.append("end_location is required when round_trip is false")
         raise HTTPException(status_code=422, detail=errors[-1])
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
-    return {"errors": errors, "latency_ms": _merge_latency(state, "validate_request", elapsed_ms)}
+    return {"errors": errors, "latency_ms": _latency_entry("validate_request", elapsed_ms)}
 
 
 async def log_request_bq(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     t_start = time.perf_counter()
     try:
-        bq_writer.insert_rows(settings.BQ_TABLE_REQUEST, [{
+        bq_writer.insert_rows_nowait(settings.BQ_TABLE_REQUEST, [{
             "event_ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
             "request_id": req.request_id,
             "theme": req.theme,
@@ -485,7 +573,7 @@ async def log_request_bq(state: AgentState) -> Dict[str, Any]:
         return {
             "bq_request_logged": True,
             "request_row_id": None,
-            "latency_ms": _merge_latency(state, "log_request_bq", elapsed_ms),
+            "latency_ms": _latency_entry("log_request_bq", elapsed_ms),
         }
     except Exception as e:
         logger.warning("[BQ Request Log Failed] request_id=%s err=%r", req.request_id, e)
@@ -493,13 +581,75 @@ async def log_request_bq(state: AgentState) -> Dict[str, Any]:
         return {
             "bq_request_logged": False,
             "request_row_id": None,
-            "latency_ms": _merge_latency(state, "log_request_bq", elapsed_ms),
+            "latency_ms": _latency_entry("log_request_bq", elapsed_ms),
         }
 
 
+async def _prescreen_dests(
+    *,
+    req: GenerateRouteRequest,
+    dests: List[Any],
+    error_base_km: float,
+    max_error_ratio: float,
+    keep_min: int,
+    final_attempt: bool,
+    memo: Optional[Dict[str, float]] = None,
+) -> tuple[List[Any], Optional[float]]:
+    """
+    computeRouteMatrix の見積もり距離で、距離フィルタを通りそうな目的地（経由地セット）だけに絞る。
+
+    見積もりが取れなかったセットは残す（全経路を取得して判定する）。全セットが許容誤差外と見積もられた場合、
+    最終試行なら見積もりが目標に近い順に keep_min 件を残し、それ以外は空にして次の試行に回す。
+    memo は同じリクエストの試行間で迂回率を使い回すための入れ物（estimate_dest_distances_km 参照）。
+
+    Returns:
+        (残す目的地（元の順序）, 目標に最も近い見積もり距離 km)
+    """
+    t0 = time.perf_counter()
+    try:
+        estimates = await maps_routes_client.estimate_dest_distances_km(
+            request_id=req.request_id,
+            start_lat=float(req.start_location.lat),
+            start_lng=float(req.start_location.lng),
+            dests=dests,
+            round_trip=bool(req.round_trip),
+            memo=memo,
+        )
+    except Exception as e:
+        logger.warning("[Route Matrix Failed] request_id=%s err=%r", req.request_id, e)
+        return dests, None
+
+    tolerance = max_error_ratio + float(settings.ROUTE_MATRIX_TOLERANCE_SLACK)
+    kept: List[Any] = []
+    scored: List[tuple[float, float, int]] = []
+    for i, (dest, estimate_km) in enumerate(zip(dests, estimates)):
+        if estimate_km is None:
+            kept.append(dest)
+            continue
+        error_ratio = abs(estimate_km - error_base_km) / error_base_km
+        scored.append((error_ratio, estimate_km, i))
+        if error_ratio <= tolerance:
+            kept.append(dest)
+    closest = min(scored, key=lambda x: x[0]) if scored else None
+    if not kept and final_attempt:
+        kept = [dests[i] for _, _, i in sorted(scored, key=lambda x: x[0])[:keep_min]]
+    logger.info(
+        "[Route Matrix Prescreen] request_id=%s dests=%d kept=%d estimates_km=%s target=%.3f tolerance=%.3f elapsed_ms=%d",
+        req.request_id,
+        len(dests),
+        len(kept),
+        [round(e, 2) if e is not None else None for e in estimates],
+        error_base_km,
+        tolerance,
+        int((time.perf_counter() - t0) * 1000),
+    )
+    return kept, (closest[1] if closest else None)
+
+
 async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
-    tools_used = list(state["tools_used"])
+    budget = state["deadline"]
+    tools_used: List[ToolName] = []
     candidates: List[Dict[str, Any]] = []
     status = "error"
     error: Optional[str] = None
@@ -512,6 +662,9 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
             min_routes = max(1, int(settings.MIN_ROUTES))
             max_error_ratio = float(settings.ROUTE_DISTANCE_ERROR_RATIO_MAX)
             max_attempts = max(1, int(settings.ROUTE_DISTANCE_RETRY_MAX) + 1)
+            fanout_enabled = bool(settings.ROUTES_FANOUT_ENABLED)
+            fanout_concurrency = max(1, int(settings.ROUTES_FANOUT_CONCURRENCY))
+            prescreen_enabled = bool(settings.ROUTE_MATRIX_PRESCREEN_ENABLED)
             target_distance_km = float(req.distance_km)
             original_target_km = target_distance_km
             short_max_km = float(getattr(settings, "SHORT_DISTANCE_MAX_KM", 2.0))
@@ -530,12 +683,33 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
                     )
                     target_distance_km = adjusted
 
+            # 学習済みの形状は、短距離の一律補正ではなく地域ごとの比率で経由地の距離を割り戻す。
+            # 倍率は target_distance_km に対する相対値なので、再試行で目標を補正しても比率は保たれる
+            calibration_enabled = bool(settings.DISTANCE_CALIBRATION_ENABLED) and effective_end_location is None
+            label_scales: Dict[str, float] = {}
+            if calibration_enabled:
+                ratios = distance_calibration.get_calibrator().ratios_for(
+                    float(req.start_location.lat), float(req.start_location.lng)
+                )
+                label_scales = {
+                    label: original_target_km / (ratio * target_distance_km) for label, ratio in ratios.items()
+                }
+                if label_scales:
+                    logger.info(
+                        "[Routes Calibration] request_id=%s target=%.3f ratios=%s scales=%s",
+                        req.request_id,
+                        target_distance_km,
+                        {k: round(v, 3) for k, v in ratios.items()},
+                        {k: round(v, 3) for k, v in label_scales.items()},
+                    )
+
+            matrix_memo: Dict[str, float] = {}
             for attempt in range(1, max_attempts + 1):
-                attempt_candidates: List[Dict[str, Any]] = []
                 best_score: Optional[float] = None
                 filtered_out = 0
                 closest_distance_km: Optional[float] = None
                 closest_error_ratio: Optional[float] = None
+                prescreen_missed = False
 
                 dests = maps_routes_client.compute_route_dests(
                     request_id=req.request_id,
@@ -545,89 +719,175 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
                     end_lng=float(effective_end_location.lng) if effective_end_location else None,
                     distance_km=target_distance_km,
                     round_trip=bool(req.round_trip),
+                    label_scales=label_scales or None,
                 )
+                if prescreen_enabled and len(dests) > 1:
+                    # 全経路を取得する前に行列 API の見積もり距離で絞る。全セットが外れたら経路取得を省いて再試行へ
+                    dests, closest_distance_km = await _prescreen_dests(
+                        req=req,
+                        dests=dests,
+                        error_base_km=original_target_km if original_target_km > 0 else target_distance_km,
+                        max_error_ratio=max_error_ratio,
+                        keep_min=min_routes,
+                        final_attempt=attempt >= max_attempts,
+                        memo=matrix_memo,
+                    )
+                    prescreen_missed = not dests
                 dests = dests[:max_routes]
 
-                t0 = time.perf_counter()
-                with _tracer.start_as_current_span("step.call_maps_routes") as maps_span:
-                    _set_span_route_attrs(maps_span, req, state)
-                    for idx, dest in enumerate(dests, start=1):
-                        route = await maps_routes_client.compute_route_candidate(
-                            request_id=req.request_id,
-                            start_lat=float(req.start_location.lat),
-                            start_lng=float(req.start_location.lng),
-                            dest=dest,
-                            idx=idx,
-                            round_trip=bool(req.round_trip),
+                call_latencies_ms: List[int] = []
+                accepted: List[tuple[int, Dict[str, Any]]] = []
+
+                def _accept_route(idx: int, route: Optional[Dict[str, Any]]) -> bool:
+                    """1本分のルートを検証・距離フィルタし、早期終了条件を満たしたら True を返す。"""
+                    nonlocal best_score, filtered_out, closest_distance_km, closest_error_ratio
+                    if not route:
+                        return False
+
+                    # ルートの妥当性チェック
+                    route_distance_km = float(route.get("distance_km") or 0.0)
+                    route_polyline = route.get("polyline", "").strip()
+
+                    # 距離が0以下、または極端に小さい値（0.01km = 10m以下）の場合は無効
+                    if route_distance_km <= 0.01:
+                        filtered_out += 1
+                        logger.warning(
+                            "[Routes Invalid] request_id=%s idx=%d distance too small: %.3fkm",
+                            req.request_id,
+                            idx,
+                            route_distance_km,
                         )
-                        if not route:
-                            continue
-
-                        # ルートの妥当性チェック
-                        route_distance_km = float(route.get("distance_km") or 0.0)
-                        route_polyline = route.get("polyline", "").strip()
-
-                        # 距離が0以下、または極端に小さい値（0.01km = 10m以下）の場合は無効
-                        if route_distance_km <= 0.01:
+                        return False
+
+                    # polylineが空、または無効な値の場合は無効
+                    if not route_polyline or route_polyline in ("", "xxxx", "~oia@"):
+                        filtered_out += 1
+                        logger.warning(
+                            "[Routes Invalid] request_id=%s idx=%d invalid polyline: %s",
+                            req.request_id,
+                            idx,
+                            route_polyline[:20] if route_polyline else "empty",
+                        )
+                        return False
+
+                    if target_distance_km > 0 and max_error_ratio >= 0:
+                        error_base_km = original_target_km if original_target_km > 0 else target_distance_km
+                        distance_error_ratio = abs(route_distance_km - error_base_km) / error_base_km
+                        if closest_error_ratio is None or distance_error_ratio < closest_error_ratio:
+                            closest_error_ratio = distance_error_ratio
+                            closest_distance_km = route_distance_km
+                        if distance_error_ratio > max_error_ratio:
                             filtered_out += 1
-                            logger.warning(
-                                "[Routes Invalid] request_id=%s idx=%d distance too small: %.3fkm",
+                            logger.info(
+                                "[Routes Filtered] request_id=%s idx=%d error_ratio=%.3f target=%.3f actual=%.3f threshold=%.3f attempt=%d/%d",
                                 req.request_id,
                                 idx,
+                                distance_error_ratio,
+                                target_distance_km,
                                 route_distance_km,
+                                max_error_ratio,
+                                attempt,
+                                max_attempts,
                             )
-                            continue
+                            return False
+                    accepted.append((idx, route))
+                    score = _heuristic_score({"distance_km": route.get("distance_km")}, req)
+                    if best_score is None or score > best_score:
+                        best_score = score
+                    if len(accepted) >= min_routes and best_score >= float(settings.SCORE_THRESHOLD):
+                        logger.info(
+                            "[Routes Early Exit] request_id=%s candidates=%d best_score=%.3f threshold=%.3f",
+                            req.request_id,
+                            len(accepted),
+                            best_score,
+                            float(settings.SCORE_THRESHOLD),
+                        )
+                        return True
+                    return False
+
+                async def _call_route(idx: int, dest: Any) -> tuple[int, Optional[Dict[str, Any]]]:
+                    t_call = time.perf_counter()
+                    route = await maps_routes_client.compute_route_candidate(
+                        request_id=req.request_id,
+                        start_lat=float(req.start_location.lat),
+                        start_lng=float(req.start_location.lng),
+                        dest=dest,
+                        idx=idx,
+                        round_trip=bool(req.round_trip),
+                    )
+                    call_ms = int((time.perf_counter() - t_call) * 1000)
+                    call_latencies_ms.append(call_ms)
+                    if calibration_enabled and route and isinstance(dest, dict) and dest.get("label"):
+                        # 距離フィルタで落ちるルートも含め、全応答を比率の学習に使う
+                        label = str(dest["label"])
+                        distance_calibration.get_calibrator().observe(
+                            float(req.start_location.lat),
+                            float(req.start_location.lng),
+                            label,
+                            built_km=target_distance_km * label_scales.get(label, 1.0),
+                            observed_km=float(route.get("distance_km") or 0.0),
+                        )
+                    logger.info(
+                        "[Routes Call Latency] request_id=%s idx=%d elapsed_ms=%d ok=%s",
+                        req.request_id,
+                        idx,
+                        call_ms,
+                        route is not None,
+                    )
+                    return idx, route
 
-                        # polylineが空、または無効な値の場合は無効
-                        if not route_polyline or route_polyline in ("", "xxxx", "~oia@"):
-                            filtered_out += 1
-                            logger.warning(
-                                "[Routes Invalid] request_id=%s idx=%d invalid polyline: %s",
-                                req.request_id,
-                                idx,
-                                route_polyline[:20] if route_polyline else "empty",
-                            )
-                            continue
-
-                        if target_distance_km > 0 and max_error_ratio >= 0:
-                            error_base_km = original_target_km if original_target_km > 0 else target_distance_km
-                            distance_error_ratio = abs(route_distance_km - error_base_km) / error_base_km
-                            if closest_error_ratio is None or distance_error_ratio < closest_error_ratio:
-                                closest_error_ratio = distance_error_ratio
-                                closest_distance_km = route_distance_km
-                            if distance_error_ratio > max_error_ratio:
-                                filtered_out += 1
+                t0 = time.perf_counter()
+                with _tracer.start_as_current_span("step.call_maps_routes") as maps_span:
+                    _set_span_route_attrs(maps_span, req, state)
+                    if fanout_enabled and len(dests) > 1:
+                        # 全目的地を同時に投げ、返ってきた順に評価する（上限は ROUTES_FANOUT_CONCURRENCY）
+                        sem = asyncio.Semaphore(fanout_concurrency)
+
+                        async def _call_route_bounded(idx: int, dest: Any) -> tuple[int, Optional[Dict[str, Any]]]:
+                            async with sem:
+                                return await _call_route(idx, dest)
+
+                        tasks = [
+                            asyncio.create_task(_call_route_bounded(idx, dest))
+                            for idx, dest in enumerate(dests, start=1)
+                        ]
+                        try:
+                            for next_done in asyncio.as_completed(tasks):
+                                idx, route = await next_done
+                                if _accept_route(idx, route):
+                                    break
+                        finally:
+                            # 早期終了・例外時は残りの呼び出しをキャンセルする
+                            pending = [t for t in tasks if not t.done()]
+                            for t in pending:
+                                t.cancel()
+                            if pending:
+                                await asyncio.gather(*pending, return_exceptions=True)
                                 logger.info(
-                                    "[Routes Filtered] request_id=%s idx=%d error_ratio=%.3f target=%.3f actual=%.3f threshold=%.3f attempt=%d/%d",
+                                    "[Routes Fanout Cancelled] request_id=%s cancelled=%d attempt=%d/%d",
                                     req.request_id,
-                                    idx,
-                                    distance_error_ratio,
-                                    target_distance_km,
-                                    route_distance_km,
-                                    max_error_ratio,
+                                    len(pending),
                                     attempt,
                                     max_attempts,
                                 )
-                                continue
-                        attempt_candidates.append(route)
-                        score = _heuristic_score({"distance_km": route.get("distance_km")}, req)
-                        if best_score is None or score > best_score:
-                            best_score = score
-                        if len(attempt_candidates) >= min_routes and best_score >= float(settings.SCORE_THRESHOLD):
-                            logger.info(
-                                "[Routes Early Exit] request_id=%s candidates=%d best_score=%.3f threshold=%.3f",
-                                req.request_id,
-                                len(attempt_candidates),
-                                best_score,
-                                float(settings.SCORE_THRESHOLD),
-                            )
-                            break
+                        # 到着順ではなく目的地順に並べ直す（候補順位を安定させる）
+                        accepted.sort(key=lambda x: x[0])
+                    else:
+                        for idx, dest in enumerate(dests, start=1):
+                            _, route = await _call_route(idx, dest)
+                            if _accept_route(idx, route):
+                                break
+                attempt_candidates = [route for _, route in accepted]
                 elapsed_ms = int((time.perf_counter() - t0) * 1000)
                 logger.info(
-                    "[Routes Latency] request_id=%s candidates=%d elapsed_ms=%d attempt=%d/%d",
+                    "[Routes Latency] request_id=%s candidates=%d elapsed_ms=%d calls=%d max_call_ms=%d sum_call_ms=%d fanout=%s attempt=%d/%d",
                     req.request_id,
                     len(attempt_candidates),
                     elapsed_ms,
+                    len(call_latencies_ms),
+                    max(call_latencies_ms) if call_latencies_ms else 0,
+                    sum(call_latencies_ms),
+                    fanout_enabled,
                     attempt,
                     max_attempts,
                 )
@@ -636,21 +896,39 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
                     candidates = attempt_candidates
                     break
 
+                if attempt < max_attempts and not budget.can_afford(float(settings.DEADLINE_ROUTE_RETRY_MIN_SEC)):
+                    deadline.record_skip("route_retries")
+                    logger.warning(
+                        "[Routes Retry Skipped] request_id=%s remaining_ms=%d attempt=%d/%d (deadline)",
+                        req.request_id,
+                        int(budget.remaining() * 1000),
+                        attempt,
+                        max_attempts,
+                    )
+                    break
+
                 if attempt < max_attempts:
-                    if original_target_km <= short_max_km and closest_distance_km and closest_distance_km > 0:
+                    adjusted: Optional[float] = None
+                    if prescreen_missed and closest_distance_km and closest_distance_km > 0:
+                        # 行列 API で全セットが外れた。見積もりの最近傍距離と目標の比で経由地の距離を割り戻す
+                        # （距離によらず補正する。補正しないと同じ目標で行列 API を呼び直すだけになる）。1回の補正は 0.5〜2 倍まで
+                        adjusted = target_distance_km * original_target_km / closest_distance_km
+                        adjusted = max(0.5, target_distance_km * 0.5, min(target_distance_km * 2.0, adjusted))
+                    elif original_target_km <= short_max_km and closest_distance_km and closest_distance_km > 0:
                         adjusted = (target_distance_km * target_distance_km) / closest_distance_km
                         adjusted = max(0.5, min(original_target_km, adjusted))
-                        if adjusted != target_distance_km:
-                            logger.info(
-                                "[Routes Target Adjust] request_id=%s target=%.3f adjusted=%.3f observed=%.3f attempt=%d/%d",
-                                req.request_id,
-                                target_distance_km,
-                                adjusted,
-                                closest_distance_km,
-                                attempt,
-                                max_attempts,
-                            )
-                            target_distance_km = adjusted
+                    if adjusted is not None and adjusted != target_distance_km:
+                        logger.info(
+                            "[Routes Target Adjust] request_id=%s target=%.3f adjusted=%.3f observed=%.3f source=%s attempt=%d/%d",
+                            req.request_id,
+                            target_distance_km,
+                            adjusted,
+                            closest_distance_km,
+                            "matrix" if prescreen_missed else "routes",
+                            attempt,
+                            max_attempts,
+                        )
+                        target_distance_km = adjusted
                     logger.info(
                         "[Routes Retry] request_id=%s filtered_out=%d attempt=%d/%d",
                         req.request_id,
@@ -660,7 +938,7 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
                     )
 
             if candidates:
-                tools_used = _ensure_tool_used(tools_used, "maps_routes")
+                tools_used.append("maps_routes")
                 status = "ok"
             else:
                 status = "empty"
@@ -674,19 +952,44 @@ async def generate_candidates_routes(state: AgentState) -> Dict[str, Any]:
             if error:
                 span.set_attribute("fallback.reason", error)
 
+    if status == "ok" and settings.VERTEX_SPECULATIVE_ENABLED:
+        _start_speculative_text(state, candidates)
+
     elapsed_total_ms = int((time.perf_counter() - t_start) * 1000)
     return {
         "candidates": candidates,
         "routes_api_status": status,
         "routes_error": error,
         "tools_used": tools_used,
-        "latency_ms": _merge_latency(state, "generate_candidates_routes", elapsed_total_ms),
+        "latency_ms": _latency_entry("generate_candidates_routes", elapsed_total_ms),
     }
 
 
+def _start_speculative_text(state: AgentState, candidates: List[Dict[str, Any]]) -> None:
+    """Ranker を待たずに、距離のヒューリスティック上位の候補の距離・所要時間でタイトル・紹介文の生成を始める。"""
+    req = state["request"]
+    ranked = sorted(
+        candidates,
+        key=lambda c: _heuristic_score({"distance_km": float(c.get("distance_km") or req.distance_km)}, req),
+        reverse=True,
+    )
+    top_k = max(1, int(settings.VERTEX_SPECULATIVE_TOP_K))
+    started = 0
+    for c in ranked:
+        if started >= top_k:
+            break
+        started += llm_speculation.start(
+            state["run_id"],
+            theme=req.theme,
+            distance_km=float(c.get("distance_km") or req.distance_km),
+            duration_min=float(c.get("duration_min") or 30.0),
+        )
+    logger.info("[Vertex Speculative Start] request_id=%s started=%d", req.request_id, started)
+
+
 async def fallback_candidates(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
-    fallback_reasons = list(state["fallback_reasons"])
+    fallback_reasons: List[str] = []
     t_start = time.perf_counter()
     start_lat = float(req.start_location.lat)
     start_lng = float(req.start_location.lng)
@@ -705,11 +1008,11 @@ async def fallback_candidates(state: AgentState) -> Dict[str, Any]:
 
     safe_polyline = ""
     try:
-        safe_polyline = polyline_lib.encode(fallback_points)
+        safe_polyline = polyline_codec.encode_array(fallback_points)
     except Exception as e:
         logger.warning("[Fallback Polyline Error] request_id=%s err=%r", req.request_id, e)
         try:
-            safe_polyline = polyline_lib.encode([
+            safe_polyline = polyline_codec.encode_array([
                 (start_lat, start_lng),
                 (start_lat + 0.001, start_lng + 0.001),
             ])
@@ -734,10 +1037,47 @@ async def fallback_candidates(state: AgentState) -> Dict[str, Any]:
         "fallback_used": True,
         "fallback_reason": "maps_routes_failed",
         "fallback_reasons": fallback_reasons,
-        "latency_ms": _merge_latency(state, "fallback_candidates", elapsed_ms),
+        "latency_ms": _latency_entry("fallback_candidates", elapsed_ms),
     }
 
 
+async def _candidate_spot_features(
+    *,
+    req: GenerateRouteRequest,
+    cand: Candidate,
+    hidden_keyword: Optional[str],
+    detour_allowance_m: float,
+    route_index: Optional[path_distance.SegmentGridIndex] = None,
+) -> tuple[float, float]:
+    """1候補分のスポット系特徴量（spot_type_diversity, detour_over_ratio）を計算する。"""
+    spot_type_diversity = 0.0
+    detour_over_ratio = 0.0
+    decoded_points: List[tuple[float, float]] = []
+    if cand.polyline and cand.polyline.strip() not in ("", "xxxx"):
+        decoded_points = polyline.decode_polyline(cand.polyline)
+    sample_points = polyline.sample_points(decoded_points, [0.25, 0.5, 0.75]) if decoded_points else []
+    if not sample_points:
+        sample_points = [(float(req.start_location.lat), float(req.start_location.lng))]
+    merged_places, _ = await _collect_places_two_phase(
+        request_id=req.request_id,
+        theme=req.theme,
+        sample_points=sample_points,
+        max_spots=5,
+        radius_m=settings.PLACES_RADIUS_M,
+        max_results=settings.PLACES_MAX_RESULTS,
+        hidden_keyword=hidden_keyword,
+    )
+    spot_type_diversity = _spot_type_diversity(merged_places)
+    if decoded_points and merged_places and detour_allowance_m > 0:
+        engine = route_index if route_index is not None else path_distance.PathDistanceEngine(decoded_points)
+        route_distances = _place_route_distances(merged_places, engine)
+        if route_distances:
+            detours = np.fromiter(route_distances.values(), dtype=float, count=len(route_distances))
+            over_ratios = np.maximum(0.0, detours - detour_allowance_m) / detour_allowance_m
+            detour_over_ratio = float(over_ratios.mean())
+    return spot_type_diversity, detour_over_ratio
+
+
 async def compute_features(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     candidates = state["candidates"]
@@ -746,65 +1086,86 @@ async def compute_features(state: AgentState) -> Dict[str, Any]:
     candidate_features_list: List[Dict[str, Any]] = []
     candidate_index_map: Dict[str, int] = {}
     normalized_candidates: List[Dict[str, Any]] = []
+    hidden_keyword = state.get("places_hidden_keyword") or places_client.pick_hidden_keyword(req.theme)
+    detour_allowance_m = _detour_allowance_m(float(req.distance_km))
+    sem = asyncio.Semaphore(max(1, int(settings.FEATURES_CONCURRENCY)))
+    timeout_sec = state["deadline"].timeout(float(settings.FEATURES_CANDIDATE_TIMEOUT_SEC))
     t_start = time.perf_counter()
 
+    cands: List[Candidate] = []
+    # 候補ごとの線分インデックスは1回だけ作り、寄り道計算と（最良ルートの）スポット検索で使い回す
+    route_indexes: Dict[str, path_distance.SegmentGridIndex] = {}
     for i, c in enumerate(candidates, start=1):
         normalized = dict(c)
         normalized["route_id"] = str(uuid.uuid4())
         normalized.setdefault("is_fallback", False)
         normalized.setdefault("theme", req.theme)
-        cand = Candidate(
+        normalized_candidates.append(normalized)
+        encoded = normalized.get("polyline", "xxxx")
+        geometry = _FALLBACK_GEOMETRY
+        if encoded and encoded.strip() not in ("", "xxxx"):
+            try:
+                points = polyline_codec.decode_array(encoded)
+                if points.shape[0] > 0:
+                    geometry = route_geometry.compute_route_geometry(points)
+                route_index = _build_route_index(points)
+                if route_index is not None:
+                    route_indexes[normalized["route_id"]] = route_index
+            except Exception as e:
+                logger.warning(
+                    "[Route Geometry Failed] request_id=%s route_id=%s err=%r",
+                    req.request_id,
+                    normalized["route_id"],
+                    e,
+                )
+        cands.append(Candidate(
             route_id=normalized["route_id"],
-            polyline=normalized.get("polyline", "xxxx"),
+            polyline=encoded,
             distance_km=float(normalized.get("distance_km", req.distance_km)),
             duration_min=float(normalized.get("duration_min") or 30.0 + i),
-            loop_closure_m=20.0,
-            bbox_area=0.5,
-            path_length_ratio=1.3,
-            turn_count=10 + i,
+            loop_closure_m=geometry.loop_closure_m,
+            bbox_area=geometry.bbox_area_km2,
+            path_length_ratio=geometry.path_length_ratio,
+            turn_count=geometry.turn_count,
+            backtrack_ratio=geometry.backtrack_ratio,
             has_stairs=normalized.get("has_stairs", False),
             elevation_gain_m=float(normalized.get("elevation_gain_m", 0.0)),
-        )
-        spot_type_diversity = 0.0
-        detour_over_ratio = 0.0
-        detour_allowance_m = _detour_allowance_m(float(req.distance_km))
-        try:
-            decoded_points: List[tuple[float, float]] = []
-            if cand.polyline and cand.polyline.strip() not in ("", "xxxx"):
-                decoded_points = polyline.decode_polyline(cand.polyline)
-            sample_points = polyline.sample_points(decoded_points, [0.25, 0.5, 0.75]) if decoded_points else []
-            if not sample_points:
-                sample_points = [(float(req.start_location.lat), float(req.start_location.lng))]
-            merged_places, _ = await _collect_places_two_phase(
-                request_id=req.request_id,
-                theme=req.theme,
-                sample_points=sample_points,
-                max_spots=5,
-                radius_m=settings.PLACES_RADIUS_M,
-                max_results=settings.PLACES_MAX_RESULTS,
-            )
-            spot_type_diversity = _spot_type_diversity(merged_places)
-            if decoded_points and merged_places:
-                over_ratios: List[float] = []
-                for p in merged_places:
-                    lat = p.get("lat")
-                    lng = p.get("lng")
-                    if lat is None or lng is None:
-                        continue
-                    detour_m = polyline.distance_to_path_m(decoded_points, (float(lat), float(lng)))
-                    if detour_allowance_m <= 0:
-                        continue
-                    over = max(0.0, detour_m - detour_allowance_m)
-                    over_ratios.append(over / detour_allowance_m)
-                if over_ratios:
-                    detour_over_ratio = sum(over_ratios) / len(over_ratios)
-        except Exception as e:
-            logger.warning(
-                "[Places Diversity Failed] request_id=%s route_id=%s err=%r",
-                req.request_id,
-                cand.route_id,
-                e,
-            )
+        ))
+
+    async def _spot_features_bounded(cand: Candidate) -> tuple[float, float]:
+        # 候補ごとに Places 検索を並列実行。タイムアウト・失敗時は多様性 0 に縮退する
+        async with sem:
+            try:
+                return await asyncio.wait_for(
+                    _candidate_spot_features(
+                        req=req,
+                        cand=cand,
+                        hidden_keyword=hidden_keyword,
+                        detour_allowance_m=detour_allowance_m,
+                        route_index=route_indexes.get(cand.route_id),
+                    ),
+                    timeout=timeout_sec if timeout_sec > 0 else None,
+                )
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "[Places Diversity Timeout] request_id=%s route_id=%s timeout_sec=%.1f",
+                    req.request_id,
+                    cand.route_id,
+                    timeout_sec,
+                )
+            except Exception as e:
+                logger.warning(
+                    "[Places Diversity Failed] request_id=%s route_id=%s err=%r",
+                    req.request_id,
+                    cand.route_id,
+                    e,
+                )
+            return 0.0, 0.0
+
+    # gather は入力順で結果を返すため、candidate_rank_in_theme は候補順のまま安定する
+    spot_features = await asyncio.gather(*(_spot_features_bounded(cand) for cand in cands))
+
+    for i, (cand, (spot_type_diversity, detour_over_ratio)) in enumerate(zip(cands, spot_features), start=1):
         feats = calc_features(
             candidate=cand,
             theme=req.theme,
@@ -821,7 +1182,6 @@ async def compute_features(state: AgentState) -> Dict[str, Any]:
         candidate_features_list.append({"route_id": cand.route_id, "features": feats})
         if i <= 5:
             rep_routes_payload.append({"route_id": cand.route_id, "features": feats})
-        normalized_candidates.append(normalized)
 
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
     return {
@@ -830,14 +1190,16 @@ async def compute_features(state: AgentState) -> Dict[str, Any]:
         "candidate_features_map": candidate_features_map,
         "candidate_index_map": candidate_index_map,
         "candidates_features": candidate_features_list,
-        "latency_ms": _merge_latency(state, "compute_features", elapsed_ms),
+        "route_indexes": route_indexes,
+        "places_hidden_keyword": hidden_keyword,
+        "latency_ms": _latency_entry("compute_features", elapsed_ms),
     }
 
 
 async def score_by_ranker(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
-    tools_used = list(state["tools_used"])
-    fallback_reasons = list(state["fallback_reasons"])
+    tools_used: List[ToolName] = []
+    fallback_reasons: List[str] = []
     rep_routes_payload = state["rep_routes_payload"]
     scores: List[Dict[str, Any]] = []
     status = "error"
@@ -862,7 +1224,7 @@ async def score_by_ranker(state: AgentState) -> Dict[str, Any]:
                     score_map[item["route_id"]] = float(item["score"])
             scores = [{"route_id": rid, "score": score} for rid, score in score_map.items()]
             if score_map:
-                tools_used = _ensure_tool_used(tools_used, "ranker")
+                tools_used.append("ranker")
                 status = "ok"
             else:
                 status = "empty"
@@ -887,7 +1249,7 @@ async def score_by_ranker(state: AgentState) -> Dict[str, Any]:
         "ranker_error": error,
         "tools_used": tools_used,
         "fallback_reasons": fallback_reasons,
-        "latency_ms": _merge_latency(state, "score_by_ranker", elapsed_total_ms),
+        "latency_ms": _latency_entry("score_by_ranker", elapsed_total_ms),
     }
 
 
@@ -907,7 +1269,7 @@ def _heuristic_score(features: Dict[str, Any], req: GenerateRouteRequest) -> flo
 
 async def fallback_ranking(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
-    fallback_reasons = list(state["fallback_reasons"])
+    fallback_reasons: List[str] = []
     scores: List[Dict[str, Any]] = []
     score_map: Dict[str, float] = {}
     t_start = time.perf_counter()
@@ -919,8 +1281,7 @@ async def fallback_ranking(state: AgentState) -> Dict[str, Any]:
         score_map[route_id] = float(score)
         scores.append({"route_id": route_id, "score": float(score)})
 
-    if "ranker_failed" not in fallback_reasons:
-        fallback_reasons.append("ranker_failed")
+    fallback_reasons.append("ranker_failed")
 
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
     return {
@@ -929,7 +1290,7 @@ async def fallback_ranking(state: AgentState) -> Dict[str, Any]:
         "ranker_status": "fallback",
         "ranker_fallback_used": True,
         "fallback_reasons": fallback_reasons,
-        "latency_ms": _merge_latency(state, "fallback_ranking", elapsed_ms),
+        "latency_ms": _latency_entry("fallback_ranking", elapsed_ms),
     }
 
 
@@ -937,7 +1298,7 @@ async def select_best_route(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     candidates = state["candidates"]
     score_map = state["score_map"]
-    fallback_reasons = list(state.get("fallback_reasons", []))
+    fallback_reasons: List[str] = []
     t_start = time.perf_counter()
     best_route = fallback.choose_best_route(candidates, score_map, req.theme)
     if best_route is None:
@@ -973,7 +1334,7 @@ async def select_best_route(state: AgentState) -> Dict[str, Any]:
         
         safe_polyline = ""
         try:
-            safe_polyline = polyline_lib.encode(fallback_points)
+            safe_polyline = polyline_codec.encode_array(fallback_points)
         except Exception:
             safe_polyline = "~oia@"
         
@@ -1017,7 +1378,7 @@ async def select_best_route(state: AgentState) -> Dict[str, Any]:
         
         safe_polyline = ""
         try:
-            safe_polyline = polyline_lib.encode(fallback_points)
+            safe_polyline = polyline_codec.encode_array(fallback_points)
         except Exception:
             safe_polyline = "~oia@"
         
@@ -1044,6 +1405,8 @@ async def select_best_route(state: AgentState) -> Dict[str, Any]:
             shown_rank_map[route_id] = rank
 
     best_score = score_map.get(best_route.get("route_id"))
+    # 地図表示に必要な経路はここで確定するので、スポット・文章を待たずに送る
+    _emit_progress("route", _route_progress_data(best_route, req))
 
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
     return {
@@ -1051,7 +1414,7 @@ async def select_best_route(state: AgentState) -> Dict[str, Any]:
         "best_score": best_score,
         "shown_rank_map": shown_rank_map,
         "fallback_reasons": fallback_reasons,
-        "latency_ms": _merge_latency(state, "select_best_route", elapsed_ms),
+        "latency_ms": _latency_entry("select_best_route", elapsed_ms),
     }
 
 
@@ -1061,6 +1424,7 @@ async def sample_points_from_polyline(state: AgentState) -> Dict[str, Any]:
     encoded = (best_route.get("polyline") or "").strip()
     decoded_points: List[tuple[float, float]] = []
     sample_points: List[tuple[float, float]] = []
+    route_index: Optional[path_distance.SegmentGridIndex] = None
     updated_route = dict(best_route)
     t_start = time.perf_counter()
 
@@ -1074,8 +1438,12 @@ async def sample_points_from_polyline(state: AgentState) -> Dict[str, Any]:
                 round_trip=bool(req.round_trip),
             )
             if changed:
-                updated_route["polyline"] = polyline_lib.encode(decoded_points)
+                updated_route["polyline"] = polyline_codec.encode_array(decoded_points)
             sample_points = polyline.sample_points(decoded_points, [0.25, 0.5, 0.75])
+            # compute_features で作った候補のインデックスを再利用する（始点補正で経路が変わった場合は作り直す）
+            route_index = (state.get("route_indexes") or {}).get(best_route.get("route_id"))
+            if changed or route_index is None or route_index.n_points != len(decoded_points):
+                route_index = _build_route_index(decoded_points)
     except Exception as e:
         logger.warning("[Polyline Decode Failed] request_id=%s err=%r", req.request_id, e)
 
@@ -1086,14 +1454,15 @@ async def sample_points_from_polyline(state: AgentState) -> Dict[str, Any]:
     return {
         "sample_points": sample_points,
         "decoded_points": decoded_points,
+        "route_index": route_index,
         "best_route": updated_route,
-        "latency_ms": _merge_latency(state, "sample_points_from_polyline", elapsed_ms),
+        "latency_ms": _latency_entry("sample_points_from_polyline", elapsed_ms),
     }
 
 
 async def fetch_places(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
-    tools_used = list(state["tools_used"])
+    tools_used: List[ToolName] = []
     sample_points = state["sample_points"]
     decoded_points = state.get("decoded_points") or []
     status = "error"
@@ -1112,36 +1481,51 @@ async def fetch_places(state: AgentState) -> Dict[str, Any]:
                 max_spots=5,
                 radius_m=settings.PLACES_RADIUS_M,
                 max_results=settings.PLACES_MAX_RESULTS,
+                hidden_keyword=state.get("places_hidden_keyword"),
             )
             places = selected
-            if decoded_points:
+            if decoded_points and (places or merged):
+                # 距離は1回だけ計算し、strict → relaxed → fallback の各半径で使い回す。
+                # 最も広い半径より遠いスポットはどの段階でも採用しないため、インデックスで近傍だけを調べる
+                route_index = state.get("route_index") or _build_route_index(decoded_points)
+                merged_ids = {id(p) for p in merged}
+                route_distances = _place_route_distances(
+                    merged + [p for p in places if id(p) not in merged_ids],
+                    route_index,
+                    max_distance_m=max(
+                        float(settings.SPOT_MAX_DISTANCE_M),
+                        float(settings.SPOT_MAX_DISTANCE_M_RELAXED),
+                        float(settings.SPOT_MAX_DISTANCE_M_FALLBACK),
+                    ),
+                )
                 filtered = _filter_places_by_route_distance(
                     places=places,
-                    decoded_points=decoded_points,
+                    route_distances=route_distances,
                     max_distance_m=float(settings.SPOT_MAX_DISTANCE_M),
                     max_spots=5,
                 )
                 if len(filtered) < 3:
                     filtered = _filter_places_by_route_distance(
                         places=merged,
-                        decoded_points=decoded_points,
+                        route_distances=route_distances,
                         max_distance_m=float(settings.SPOT_MAX_DISTANCE_M_RELAXED),
                         max_spots=5,
                     )
                 if len(filtered) < 3:
                     filtered = _filter_places_by_route_distance(
                         places=merged,
-                        decoded_points=decoded_points,
+                        route_distances=route_distances,
                         max_distance_m=float(settings.SPOT_MAX_DISTANCE_M_FALLBACK),
                         max_spots=5,
                     )
                 places = filtered
             if places:
-                tools_used = _ensure_tool_used(tools_used, "places")
+                tools_used.append("places")
                 status = "ok"
             else:
                 status = "empty"
             elapsed_ms = int((time.perf_counter() - t0) * 1000)
+            # キャッシュのヒット数はプロセス全体のカウンタで、並行するリクエストの分が混ざるため /metrics で見る
             logger.info(
                 "[Places Latency] request_id=%s spots=%d elapsed_ms=%d",
                 req.request_id,
@@ -1164,27 +1548,35 @@ async def fetch_places(state: AgentState) -> Dict[str, Any]:
         "places_status": status,
         "places_error": error,
         "tools_used": tools_used,
-        "latency_ms": _merge_latency(state, "fetch_places", elapsed_total_ms),
+        "latency_ms": _latency_entry("fetch_places", elapsed_total_ms),
     }
 
 
 async def parallel_postprocess(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
-    tools_used = list(state["tools_used"])
-    fallback_reasons = list(state["fallback_reasons"])
     sem = asyncio.Semaphore(int(settings.CONCURRENCY))
 
     async def _run_with_sem(coro):
         async with sem:
             return await coro
 
-    state_for_vertex = dict(state)
-    state_for_vertex["places"] = []
+    async def _places_then_emit() -> Dict[str, Any]:
+        result = await _run_with_sem(fetch_places(state))
+        spots = _build_spots_from_places(result.get("places") or [])
+        _emit_progress("spots", {"spots": [s.model_dump(mode="json") for s in spots]})
+        return result
+
+    async def _text_then_emit() -> Dict[str, Any]:
+        # 文章生成はスポット検索と並行に走るので、スポットなしで生成する
+        result = await _run_with_sem(generate_title_description_vertex(state, places=[]))
+        _emit_progress("text", {"title": result.get("title"), "summary": result.get("description")})
+        return result
 
     t0 = time.perf_counter()
+    # スポットと文章はそれぞれ完了した時点でストリームに送る（失敗時は最終レスポンスで補う）
     tasks = {
-        "places": asyncio.create_task(_run_with_sem(fetch_places(state))),
-        "text": asyncio.create_task(_run_with_sem(generate_title_description_vertex(state_for_vertex))),
+        "places": asyncio.create_task(_places_then_emit()),
+        "text": asyncio.create_task(_text_then_emit()),
     }
     results = await asyncio.gather(*tasks.values(), return_exceptions=True)
     elapsed_ms = int((time.perf_counter() - t0) * 1000)
@@ -1200,7 +1592,6 @@ async def parallel_postprocess(state: AgentState) -> Dict[str, Any]:
             "places": [],
             "places_status": "error",
             "places_error": repr(result_map["places"]),
-            "tools_used": tools_used,
         }
     else:
         places_result = result_map.get("places") or {}
@@ -1225,20 +1616,15 @@ async def parallel_postprocess(state: AgentState) -> Dict[str, Any]:
             "summary_type": "template",
             "title_llm_status": "error",
             "title_fallback_used": True,
-            "tools_used": tools_used,
-            "fallback_reasons": fallback_reasons + ["vertex_llm_failed"],
+            "fallback_reasons": ["vertex_llm_failed"],
         }
     else:
         text_result = result_map.get("text") or {}
 
-    if places_result.get("tools_used"):
-        tools_used = places_result["tools_used"]
-    if text_result.get("tools_used"):
-        tools_used = text_result["tools_used"]
-    if text_result.get("fallback_reasons"):
-        fallback_reasons = text_result["fallback_reasons"]
+    tools_used = [*places_result.get("tools_used", []), *text_result.get("tools_used", [])]
+    fallback_reasons = text_result.get("fallback_reasons", [])
 
-    latency_ms = _merge_latency(state, "parallel_postprocess", elapsed_ms)
+    latency_ms = _latency_entry("parallel_postprocess", elapsed_ms)
     if places_result.get("latency_ms"):
         latency_ms.update(places_result["latency_ms"])
     if text_result.get("latency_ms"):
@@ -1269,81 +1655,54 @@ async def simplify_polyline_to_waypoints(state: AgentState) -> Dict[str, Any]:
     simplify_meta: Dict[str, Any] = {}
     t_start = time.perf_counter()
 
+    max_points = 10
+    # 簡略化から waypoint 選択までは配列のまま行い、LatLng は最後に1回だけ作る
     if decoded_points:
-        simplified = polyline.simplify_douglas_peucker(decoded_points, epsilon_m=20.0)
-        waypoint_points = polyline.pick_waypoints(simplified, max_points=10)
+        points = np.asarray(decoded_points, dtype=np.float64)
+        mode = settings.SIMPLIFY_MODE
+        keep = simplify.simplify_mask(
+            points,
+            mode=mode,
+            epsilon_m=float(settings.SIMPLIFY_EPSILON_M),
+            target_count=int(settings.SIMPLIFY_TARGET_POINTS),
+        )
+        simplified = points[keep]
+        waypoint_points = simplified[simplify.pick_waypoint_indices(simplified.shape[0], max_points=max_points)]
         simplify_meta = {
+            "mode": mode,
             "points_before": len(decoded_points),
-            "points_after": len(simplified),
-            "reduction_ratio": (len(simplified) / len(decoded_points)) if decoded_points else 0.0,
+            "points_after": int(simplified.shape[0]),
+            "reduction_ratio": (simplified.shape[0] / len(decoded_points)) if decoded_points else 0.0,
         }
     else:
-        waypoint_points = sample_points[:10] if sample_points else []
+        waypoint_points = np.asarray(sample_points[:max_points], dtype=np.float64).reshape(-1, 2)
         simplify_meta = {
             "points_before": 0,
-            "points_after": len(waypoint_points),
+            "points_after": int(waypoint_points.shape[0]),
             "reduction_ratio": 0.0,
         }
 
-    nav_waypoints = [LatLng(lat=float(lat), lng=float(lng)) for (lat, lng) in waypoint_points]
-    combined = nav_waypoints
-    seen = set()
-    deduped: List[LatLng] = []
-    for wp in combined:
-        key = (round(wp.lat, 6), round(wp.lng, 6))
-        if key in seen:
-            continue
-        seen.add(key)
-        deduped.append(wp)
-
-    max_points = 10
-    if len(deduped) > max_points:
-        trimmed: List[LatLng] = []
-        # ルートの始点・終点を優先的に入れる
-        if len(nav_waypoints) >= 2:
-            for candidate in (nav_waypoints[0], nav_waypoints[-1]):
-                if len(trimmed) >= max_points:
-                    break
-                if candidate in trimmed:
-                    continue
-                trimmed.append(candidate)
-        for wp in deduped:
-            if len(trimmed) >= max_points:
-                break
-            if wp in trimmed:
-                continue
-            trimmed.append(wp)
-        deduped = trimmed[:max_points]
-
-    nav_waypoints = deduped
-    start_wp = LatLng(lat=float(req.start_location.lat), lng=float(req.start_location.lng))
-    start_key = (round(start_wp.lat, 6), round(start_wp.lng, 6))
-    nav_waypoints = [wp for wp in nav_waypoints if (round(wp.lat, 6), round(wp.lng, 6)) != start_key]
-    nav_waypoints.insert(0, start_wp)
-    if len(nav_waypoints) > max_points:
-        nav_waypoints = nav_waypoints[:max_points]
-    nav_waypoints = _dedupe_nearby_points(nav_waypoints, threshold_m=10.0)
-    if req.round_trip and nav_waypoints:
-        first = nav_waypoints[0]
-        last = nav_waypoints[-1]
-        if _haversine_m(first, last) > 10.0:
-            if len(nav_waypoints) < max_points:
-                nav_waypoints.append(first)
-            else:
-                nav_waypoints[-1] = first
+    nav_points = simplify.build_nav_waypoints(
+        waypoint_points,
+        start=(float(req.start_location.lat), float(req.start_location.lng)),
+        round_trip=bool(req.round_trip),
+        max_points=max_points,
+        dedupe_m=10.0,
+    )
+    nav_waypoints = [LatLng(lat=lat, lng=lng) for lat, lng in nav_points.tolist()]
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
     return {
         "nav_waypoints": nav_waypoints,
         "simplify_meta": simplify_meta,
-        "latency_ms": _merge_latency(state, "simplify_polyline_to_waypoints", elapsed_ms),
+        "latency_ms": _latency_entry("simplify_polyline_to_waypoints", elapsed_ms),
     }
 
 
 async def generate_description_vertex(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     best_route = state["best_route"]
-    tools_used = list(state["tools_used"])
-    fallback_reasons = list(state["fallback_reasons"])
+    tools_used: List[ToolName] = []
+    fallback_reasons: List[str] = []
     spots = _build_spots_from_places(state["places"])
 
     spots_names = [s.name for s in spots] if spots else []
@@ -1377,7 +1736,7 @@ async def generate_description_vertex(state: AgentState) -> Dict[str, Any]:
             status = "ok"
             fallback_used = False
             summary_type = "vertex_llm"
-            tools_used = _ensure_tool_used(tools_used, "vertex_llm")
+            tools_used.append("vertex_llm")
         else:
             status = "empty"
             fallback_reasons.append("vertex_llm_failed")
@@ -1397,12 +1756,17 @@ async def generate_description_vertex(state: AgentState) -> Dict[str, Any]:
     }
 
 
-async def generate_title_description_vertex(state: AgentState) -> Dict[str, Any]:
+async def generate_title_description_vertex(
+    state: AgentState,
+    *,
+    places: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """places を渡すと state["places"] の代わりにそれを見どころとして使う。"""
     req = state["request"]
     best_route = state["best_route"]
-    tools_used = list(state["tools_used"])
-    fallback_reasons = list(state["fallback_reasons"])
-    spots = _build_spots_from_places(state["places"])
+    tools_used: List[ToolName] = []
+    fallback_reasons: List[str] = []
+    spots = _build_spots_from_places(state["places"] if places is None else places)
 
     spots_names = [s.name for s in spots] if spots else []
     spots_text = f"（見どころ: {', '.join(spots_names)}）" if spots_names else ""
@@ -1424,40 +1788,80 @@ async def generate_title_description_vertex(state: AgentState) -> Dict[str, Any]
     title_fallback_used = True
     summary_type = "template"
 
-    elapsed_ms = 0
-    try:
-        t0 = time.perf_counter()
-        result = await vertex_llm.generate_title_and_description(
-            theme=req.theme,
-            distance_km=float(best_route.get("distance_km", req.distance_km)),
-            duration_min=float(best_route.get("duration_min") or 30.0),
-            spots=spots,
-        )
-        elapsed_ms = int((time.perf_counter() - t0) * 1000)
-        logger.info(
-            "[Vertex Title+Summary Latency] request_id=%s elapsed_ms=%d",
-            req.request_id,
-            elapsed_ms,
+    distance_km = float(best_route.get("distance_km", req.distance_km))
+    duration_min = float(best_route.get("duration_min") or 30.0)
+    # 投機的に始めた生成は、スポットなしのプロンプトで距離・所要時間が一致するときだけ使う
+    speculative = None
+    if spots:
+        llm_speculation.discard(state.get("run_id", ""))
+    else:
+        speculative = llm_speculation.take(
+            state.get("run_id", ""), theme=req.theme, distance_km=distance_km, duration_min=duration_min
         )
-        if result:
-            title = result.get("title") or title
-            description = result.get("description") or description
-            desc_status = "ok"
-            title_status = "ok"
-            desc_fallback_used = False
-            title_fallback_used = False
-            summary_type = "vertex_llm"
-            tools_used = _ensure_tool_used(tools_used, "vertex_llm")
+
+    # 期限が近ければ生成を諦めてテンプレートにする（投機の結果を待つだけなら続ける）
+    budget = state["deadline"]
+    skip_llm = speculative is None and not budget.can_afford(float(settings.DEADLINE_LLM_MIN_SEC))
+
+    elapsed_ms = 0
+    # キュー待ち（同時実行数の空き待ち）とモデルの応答時間は分けて latency_ms に残す
+    with vertex_client.collect_timings() as vertex_timings:
+        if skip_llm:
+            desc_status = "skipped"
+            title_status = "skipped"
+            fallback_reasons.append("deadline_llm_skipped")
+            deadline.record_skip("llm")
+            logger.warning(
+                "[Vertex LLM Skipped] request_id=%s remaining_ms=%d (deadline)",
+                req.request_id,
+                int(budget.remaining() * 1000),
+            )
         else:
-            desc_status = "empty"
-            title_status = "empty"
-            fallback_reasons.append("vertex_llm_failed")
-            logger.warning("[Vertex LLM Empty] request_id=%s (returned empty)", req.request_id)
-    except Exception as e:
-        desc_status = "error"
-        title_status = "error"
-        fallback_reasons.append("vertex_llm_failed")
-        logger.error("[Vertex LLM Error] request_id=%s err=%r", req.request_id, e)
+            try:
+                t0 = time.perf_counter()
+                if speculative is not None:
+                    # 投機の残りは期限までしか待たない
+                    result, spec_timings = await asyncio.wait_for(
+                        speculative, timeout=budget.timeout(0) if budget.bounded else None
+                    )
+                    for k, v in spec_timings.items():
+                        vertex_timings[k] += v
+                else:
+                    result = await vertex_llm.generate_title_and_description(
+                        theme=req.theme,
+                        distance_km=distance_km,
+                        duration_min=duration_min,
+                        spots=spots,
+                    )
+                elapsed_ms = int((time.perf_counter() - t0) * 1000)
+                logger.info(
+                    "[Vertex Title+Summary Latency] request_id=%s elapsed_ms=%d queue_wait_ms=%d model_ms=%d calls=%d speculative=%s",
+                    req.request_id,
+                    elapsed_ms,
+                    vertex_timings["queue_wait_ms"],
+                    vertex_timings["model_ms"],
+                    vertex_timings["calls"],
+                    str(speculative is not None).lower(),
+                )
+                if result:
+                    title = result.get("title") or title
+                    description = result.get("description") or description
+                    desc_status = "ok"
+                    title_status = "ok"
+                    desc_fallback_used = False
+                    title_fallback_used = False
+                    summary_type = "vertex_llm"
+                    tools_used.append("vertex_llm")
+                else:
+                    desc_status = "empty"
+                    title_status = "empty"
+                    fallback_reasons.append("vertex_llm_failed")
+                    logger.warning("[Vertex LLM Empty] request_id=%s (returned empty)", req.request_id)
+            except Exception as e:
+                desc_status = "error"
+                title_status = "error"
+                fallback_reasons.append("vertex_llm_failed")
+                logger.error("[Vertex LLM Error] request_id=%s err=%r", req.request_id, e)
 
     return {
         "title": title,
@@ -1469,14 +1873,18 @@ async def generate_title_description_vertex(state: AgentState) -> Dict[str, Any]
         "title_fallback_used": title_fallback_used,
         "tools_used": tools_used,
         "fallback_reasons": fallback_reasons,
-        "latency_ms": _merge_latency(state, "vertex_title_description", elapsed_ms),
+        "latency_ms": {
+            **_latency_entry("vertex_title_description", elapsed_ms),
+            "vertex_queue_wait": int(vertex_timings["queue_wait_ms"]),
+            "vertex_model": int(vertex_timings["model_ms"]),
+        },
     }
 
 
 async def generate_title_vertex(state: AgentState) -> Dict[str, Any]:
     req = state["request"]
     best_route = state["best_route"]
-    tools_used = list(state["tools_used"])
+    tools_used: List[ToolName] = []
     spots = _build_spots_from_places(state["places"])
 
     title = vertex_llm.fallback_title(
@@ -1506,7 +1914,7 @@ async def generate_title_vertex(state: AgentState) -> Dict[str, Any]:
             title = vertex_title
             status = "ok"
             fallback_used = False
-            tools_used = _ensure_tool_used(tools_used, "vertex_llm")
+            tools_used.append("vertex_llm")
         else:
             status = "empty"
     except Exception as e:
@@ -1560,12 +1968,12 @@ async def compute_quality(state: AgentState) -> Dict[str, Any]:
     )
 
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
-    latency_ms = _merge_latency(state, "compute_quality", elapsed_ms)
+    latency_ms = _latency_entry("compute_quality", elapsed_ms)
     logger.info(
         "[Latency Breakdown] request_id=%s total_ms=%d steps=%s",
         req.request_id,
         total_latency_ms,
-        latency_ms,
+        {**state["latency_ms"], **latency_ms},
     )
 
     return {
@@ -1599,6 +2007,11 @@ async def build_fallback_details(state: AgentState) -> Dict[str, Any]:
             description="ルート紹介文の生成に失敗しました",
             impact="テンプレートベースの紹介文が使用されています。ルート自体は正常に生成されています。",
         ),
+        "deadline_llm_skipped": FallbackDetail(
+            reason="deadline_llm_skipped",
+            description="応答時間の上限に近づいたため、ルート紹介文を生成しませんでした",
+            impact="テンプレートベースの紹介文が使用されています。ルート自体は正常に生成されています。",
+        ),
         "invalid_route_detected": FallbackDetail(
             reason="invalid_route_detected",
             description="生成されたルートが無効でした",
@@ -1613,7 +2026,7 @@ async def build_fallback_details(state: AgentState) -> Dict[str, Any]:
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
     return {
         "fallback_details": fallback_details,
-        "latency_ms": _merge_latency(state, "build_fallback_details", elapsed_ms),
+        "latency_ms": _latency_entry("build_fallback_details", elapsed_ms),
     }
 
 
@@ -1645,6 +2058,7 @@ async def store_candidates_bq(state: AgentState) -> Dict[str, Any]:
             "path_length_ratio": feats.get("path_length_ratio"),
             "turn_count": feats.get("turn_count"),
             "turn_density": feats.get("turn_density"),
+            "backtrack_ratio": feats.get("backtrack_ratio"),
             "theme_exercise": feats.get("theme_exercise"),
             "theme_think": feats.get("theme_think"),
             "theme_refresh": feats.get("theme_refresh"),
@@ -1660,29 +2074,29 @@ async def store_candidates_bq(state: AgentState) -> Dict[str, Any]:
             "poi_density": feats.get("poi_density"),
             "park_poi_ratio": feats.get("park_poi_ratio"),
         })
-    bq_writer.insert_rows(settings.BQ_TABLE_CANDIDATE, candidate_rows)
+    bq_writer.insert_rows_nowait(settings.BQ_TABLE_CANDIDATE, candidate_rows)
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
-    return {"latency_ms": _merge_latency(state, "store_candidates_bq", elapsed_ms)}
+    return {"latency_ms": _latency_entry("store_candidates_bq", elapsed_ms)}
 
 
 async def store_proposal_bq(state: AgentState) -> Dict[str, Any]:
     t_start = time.perf_counter()
     req = state["request"]
     best_route = state["best_route"]
-    bq_writer.insert_rows(settings.BQ_TABLE_PROPOSAL, [{
+    bq_writer.insert_rows_nowait(settings.BQ_TABLE_PROPOSAL, [{
         "event_ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "request_id": req.request_id,
         "chosen_route_id": best_route["route_id"],
         "fallback_used": state["is_fallback_used"],
         "fallback_reason": state["fallback_reason_str"],
-        "tools_used": state["tools_used"],
+        "tools_used": list(state["tools_used"]),  # 行はキューに積まれて後で送られるので、状態の値をそのまま持たない
         "summary_type": state["summary_type"],
         "total_latency_ms": state["total_latency_ms"],
         "features_version": settings.FEATURES_VERSION,
         "ranker_version": settings.RANKER_VERSION,
     }])
     elapsed_ms = int((time.perf_counter() - t_start) * 1000)
-    return {"latency_ms": _merge_latency(state, "store_proposal_bq", elapsed_ms)}
+    return {"latency_ms": _latency_entry("store_proposal_bq", elapsed_ms)}
 
 
 async def build_response(state: AgentState) -> Dict[str, Any]:
@@ -1758,12 +2172,19 @@ async def build_response(state: AgentState) -> Dict[str, Any]:
             meta=meta,
         )
         total_latency_ms = int((time.time() - state["start_time"]) * 1000)
-        latency_ms = _merge_latency(state, "build_response", int((time.perf_counter() - t_start) * 1000))
+        latency_ms = _latency_entry("build_response", int((time.perf_counter() - t_start) * 1000))
+        # build_response 自身の区間は「開始〜現在」で見積もる
+        build_started_ms = total_latency_ms - int((time.perf_counter() - t_start) * 1000)
+        attribution = latency_attribution(
+            {**(state.get("node_spans") or {}), "build_response": [build_started_ms, total_latency_ms]}
+        )
         logger.info(
-            "[Latency Summary] request_id=%s total_ms=%d steps=%s",
+            "[Latency Summary] request_id=%s total_ms=%d critical_path_ms=%d critical_path=%s steps=%s",
             req.request_id,
             total_latency_ms,
-            latency_ms,
+            attribution["critical_path_ms"],
+            "->".join(attribution["critical_path"]),
+            {**state["latency_ms"], **latency_ms},
         )
         summary = {
             "message": "route_generate_summary",
@@ -1777,6 +2198,8 @@ async def build_response(state: AgentState) -> Dict[str, Any]:
             "ranker_status": state.get("ranker_status"),
             "candidates_count": len(state.get("candidates") or []),
             "total_latency_ms": total_latency_ms,
+            "critical_path_ms": attribution["critical_path_ms"],
+            "off_critical_path_ms": attribution["off_critical_path_ms"],
             "debug": bool(getattr(req, "debug", False)),
         }
         ctx = _get_current_span().get_span_context()
@@ -1788,65 +2211,186 @@ async def build_response(state: AgentState) -> Dict[str, Any]:
         return {"response": response, "latency_ms": latency_ms}
 
 
+NodeFn = Callable[[AgentState], Awaitable[Dict[str, Any]]]
+
+
+def _timed_node(name: str, fn: NodeFn) -> NodeFn:
+    """ノードの実行区間（start_time からの経過 ms）を node_spans に記録するラッパー。"""
+
+    async def run(state: AgentState) -> Dict[str, Any]:
+        started = time.time()
+        update = await fn(state)
+        base = state["start_time"]
+        span = [int((started - base) * 1000), int((time.time() - base) * 1000)]
+        update["node_spans"] = {name: span}
+        return update
+
+    run.__name__ = name
+    return run
+
+
+# 各ノードの直前のノード（クリティカルパスを遡るため。_build_graph の辺と同じ）
+_NODE_PREDECESSORS: Dict[str, List[str]] = {}
+
+
+def latency_attribution(
+    node_spans: Dict[str, List[int]],
+    end_node: str = "build_response",
+    predecessors: Optional[Dict[str, List[str]]] = None,
+) -> Dict[str, Any]:
+    """
+    ノードの実行区間からレイテンシの内訳を求める。
+
+    end_node から、実行された直前ノード（predecessors、省略時はこのグラフの辺）のうち
+    最後に終わったものを辿ってクリティカルパスとする。
+    クリティカルパス外のノード時間は、並行実行で応答時間に乗らなかった分。
+
+    Returns:
+        critical_path（実行順のノード名）/ critical_path_ms / node_ms_total（全ノードの所要時間の和）/
+        off_critical_path_ms（クリティカルパス外のノードの所要時間）
+    """
+    predecessors = _NODE_PREDECESSORS if predecessors is None else predecessors
+    durations = {name: max(0, end - start) for name, (start, end) in node_spans.items()}
+    path: List[str] = []
+    node: Optional[str] = end_node if end_node in node_spans else None
+    while node is not None:
+        path.append(node)
+        preds = [p for p in predecessors.get(node, []) if p in node_spans and p not in path]
+        node = max(preds, key=lambda p: node_spans[p][1]) if preds else None
+    path.reverse()
+    on_path = set(path)
+    return {
+        "critical_path": path,
+        "critical_path_ms": sum(durations[n] for n in path),
+        "node_ms_total": sum(durations.values()),
+        "off_critical_path_ms": {n: d for n, d in durations.items() if n not in on_path},
+    }
+
+
 def _build_graph() -> StateGraph:
+    """
+    ルート生成グラフ（DAG）。
+
+    応答に必要な経路の選択・スポット・文章は直列に並べ、応答を待たせない処理は並行の枝にする。
+    - log_request_bq: 候補生成と並行（BigQuery へはキューに積むだけ）
+    - store_candidates_bq: 最良ルートの確定後、後続の処理と並行
+    - simplify_polyline_to_waypoints: 経路の座標だけで計算できるので、スポット検索・文章生成と並行
+    - compute_quality と build_fallback_details: 互いに独立なので並行し、build_response で合流
+    - store_proposal_bq: 品質計算の後、build_response と並行
+    """
     graph = StateGraph(AgentState)
-    graph.add_node("validate_request", validate_request)
-    graph.add_node("log_request_bq", log_request_bq)
-    graph.add_node("generate_candidates_routes", generate_candidates_routes)
-    graph.add_node("fallback_candidates", fallback_candidates)
-    graph.add_node("compute_features", compute_features)
-    graph.add_node("score_by_ranker", score_by_ranker)
-    graph.add_node("fallback_ranking", fallback_ranking)
-    graph.add_node("select_best_route", select_best_route)
-    graph.add_node("sample_points_from_polyline", sample_points_from_polyline)
-    graph.add_node("fetch_places", fetch_places)
-    graph.add_node("parallel_postprocess", parallel_postprocess)
-    graph.add_node("simplify_polyline_to_waypoints", simplify_polyline_to_waypoints)
-    graph.add_node("generate_description_vertex", generate_description_vertex)
-    graph.add_node("generate_title_vertex", generate_title_vertex)
-    graph.add_node("compute_quality", compute_quality)
-    graph.add_node("build_fallback_details", build_fallback_details)
-    graph.add_node("store_candidates_bq", store_candidates_bq)
-    graph.add_node("store_proposal_bq", store_proposal_bq)
-    graph.add_node("build_response", build_response)
+    nodes: Dict[str, NodeFn] = {
+        "validate_request": validate_request,
+        "log_request_bq": log_request_bq,
+        "generate_candidates_routes": generate_candidates_routes,
+        "fallback_candidates": fallback_candidates,
+        "compute_features": compute_features,
+        "score_by_ranker": score_by_ranker,
+        "fallback_ranking": fallback_ranking,
+        "select_best_route": select_best_route,
+        "sample_points_from_polyline": sample_points_from_polyline,
+        "fetch_places": fetch_places,
+        "parallel_postprocess": parallel_postprocess,
+        "simplify_polyline_to_waypoints": simplify_polyline_to_waypoints,
+        "generate_description_vertex": generate_description_vertex,
+        "generate_title_vertex": generate_title_vertex,
+        "compute_quality": compute_quality,
+        "build_fallback_details": build_fallback_details,
+        "store_candidates_bq": store_candidates_bq,
+        "store_proposal_bq": store_proposal_bq,
+        "build_response": build_response,
+    }
+    for name, fn in nodes.items():
+        graph.add_node(name, _timed_node(name, fn))
+
+    edges = [
+        ("validate_request", "log_request_bq"),
+        ("validate_request", "generate_candidates_routes"),
+        ("fallback_candidates", "compute_features"),
+        ("compute_features", "score_by_ranker"),
+        ("fallback_ranking", "select_best_route"),
+        ("select_best_route", "sample_points_from_polyline"),
+        ("select_best_route", "store_candidates_bq"),
+        ("sample_points_from_polyline", "parallel_postprocess"),
+        ("sample_points_from_polyline", "simplify_polyline_to_waypoints"),
+        ("compute_quality", "store_proposal_bq"),
+    ]
+    # 条件分岐の遷移先（クリティカルパスを遡るときに使う）
+    conditional_edges = [
+        ("generate_candidates_routes", "fallback_candidates"),
+        ("generate_candidates_routes", "compute_features"),
+        ("score_by_ranker", "fallback_ranking"),
+        ("score_by_ranker", "select_best_route"),
+    ]
+    joins = [
+        (["parallel_postprocess", "simplify_polyline_to_waypoints"], "compute_quality"),
+        (["parallel_postprocess", "simplify_polyline_to_waypoints"], "build_fallback_details"),
+        (["compute_quality", "build_fallback_details"], "build_response"),
+    ]
+    _NODE_PREDECESSORS.clear()
+    for src, dst in edges + conditional_edges:
+        _NODE_PREDECESSORS.setdefault(dst, []).append(src)
+    for srcs, dst in joins:
+        _NODE_PREDECESSORS.setdefault(dst, []).extend(srcs)
 
     graph.set_entry_point("validate_request")
-    graph.add_edge("validate_request", "log_request_bq")
-    graph.add_edge("log_request_bq", "generate_candidates_routes")
+    for src, dst in edges:
+        graph.add_edge(src, dst)
+    for srcs, dst in joins:
+        graph.add_edge(srcs, dst)
     graph.add_conditional_edges(
         "generate_candidates_routes",
         lambda state: "fallback_candidates"
         if state.get("routes_api_status") != "ok"
         else "compute_features",
+        ["fallback_candidates", "compute_features"],
     )
-    graph.add_edge("fallback_candidates", "compute_features")
-    graph.add_edge("compute_features", "score_by_ranker")
     graph.add_conditional_edges(
         "score_by_ranker",
         lambda state: "fallback_ranking"
         if state.get("ranker_status") != "ok"
         else "select_best_route",
+        ["fallback_ranking", "select_best_route"],
     )
-    graph.add_edge("fallback_ranking", "select_best_route")
-    graph.add_edge("select_best_route", "sample_points_from_polyline")
-    graph.add_edge("sample_points_from_polyline", "parallel_postprocess")
-    graph.add_edge("parallel_postprocess", "simplify_polyline_to_waypoints")
-    graph.add_edge("simplify_polyline_to_waypoints", "compute_quality")
-    graph.add_edge("compute_quality", "build_fallback_details")
-    graph.add_edge("build_fallback_details", "store_candidates_bq")
-    graph.add_edge("store_candidates_bq", "store_proposal_bq")
-    graph.add_edge("store_proposal_bq", "build_response")
-    graph.add_edge("build_response", END)
+    for leaf in ("log_request_bq", "store_candidates_bq", "store_proposal_bq", "build_response"):
+        graph.add_edge(leaf, END)
     return graph
 
 
 _route_graph = _build_graph().compile()
 
 
-async def run_generate_graph(req: GenerateRouteRequest) -> GenerateRouteResponse:
-    state = _init_state(req)
-    result = await _route_graph.ainvoke(state)
-    return result["response"]
+async def run_generate_graph(
+    req: GenerateRouteRequest,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    budget: Optional[deadline.Deadline] = None,
+) -> GenerateRouteResponse:
+    """
+    グラフを実行してレスポンスを返す。
+
+    on_event を渡すと、途中経過（{"event": "route" | "spots" | "text", "data": {...}}）を
+    ノードの進行に合わせて呼び出す（/route/generate/stream 用）。
+    budget はリクエスト受付時に作った期限（省略時はここで REQUEST_DEADLINE_SEC の期限を作る）。
+    """
+    state = _init_state(req, budget)
+    with deadline.use(state["deadline"]):
+        try:
+            if on_event is None:
+                result = await _route_graph.ainvoke(state)
+                return result["response"]
+
+            response: Optional[GenerateRouteResponse] = None
+            async for mode, chunk in _route_graph.astream(state, stream_mode=["custom", "updates"]):
+                if mode == "custom":
+                    on_event(chunk)
+                elif "build_response" in chunk:
+                    response = chunk["build_response"]["response"]
+            if response is None:
+                raise RuntimeError("route graph finished without response")
+            return response
+        finally:
+            # 文章生成まで進まなかった（例外・キャンセル）実行の投機を捨てる
+            llm_speculation.discard(state["run_id"])
 
 
 def get_route_graph_mermaid() -> str:
@@ -1,14 +1,15 @@
 from __future__ import annotations
+import asyncio
 import json
 import os
 import time
+import uuid
 import logging
-from typing import Dict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
 from contextlib import asynccontextmanager
-import httpx
 
-from fastapi import FastAPI
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from app.schemas import (
     GenerateRouteRequest,
     GenerateRouteResponse,
@@ -18,12 +19,23 @@ from app.schemas import (
 from app.settings import settings
 from app.services import http_client
 from app.services import bq_writer
+from app.services import deadline
+from app.services import distance_calibration
+from app.services import llm_cache
+from app.services import llm_speculation
+from app.services import places_cache
+from app.services import ttl_cache
+from app.services import vertex_client
 from app.services.ttl_cache import (
+    acquire_lease,
     build_cache_key,
     cache_get,
+    cache_lookup,
     cache_key_prefix,
     cache_set,
-    _get_key_lock,
+    release_lease,
+    generate_flight,
+    wait_for_peer,
 )
 from app.graph import get_route_graph_mermaid, run_generate_graph
 
@@ -98,13 +110,18 @@ def _configure_logging() -> None:
 _configure_logging()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    timeout = httpx.Timeout(settings.REQUEST_TIMEOUT_SEC)
-    limits = httpx.Limits(max_connections=50, max_keepalive_connections=10)
-    client = httpx.AsyncClient(timeout=timeout, limits=limits)
-    http_client.set_client(client)
+    http_client.start()
+    distance_calibration.load_snapshot()
+    await bq_writer.start_writer()
+    await http_client.warm_up()
     yield
-    await client.aclose()
-    http_client.set_client(None)
+    # Cloud Run は SIGTERM から約10秒で停止するため、その間にキューを書き切る
+    await bq_writer.stop_writer()
+    await asyncio.to_thread(distance_calibration.save_snapshot)
+    await ttl_cache.close_backend()
+    await llm_cache.close()
+    await http_client.close()
+    vertex_client.shutdown()
 
 
 app = FastAPI(title="firstdown Agent API", version="1.0.0", lifespan=lifespan)
@@ -118,6 +135,23 @@ def health() -> Dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def get_metrics() -> Dict[str, Any]:
+    """インスタンス内のキャッシュ等のカウンタを返す（運用・負荷試験用）。"""
+    return {
+        "places_cache": places_cache.stats(),
+        "bq_writer": bq_writer.stats(),
+        "distance_calibration": distance_calibration.stats(),
+        "generate_cache": ttl_cache.cache_stats(),
+        "generate_singleflight": generate_flight.stats(),
+        "vertex_client": vertex_client.stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm_speculation": llm_speculation.stats(),
+        "deadline": deadline.stats(),
+        "http_client": http_client.stats(),
+    }
+
+
 @app.get("/route/graph", response_class=PlainTextResponse)
 def get_route_graph() -> str:
     return get_route_graph_mermaid()
@@ -136,41 +170,195 @@ def post_feedback(req: FeedbackRequest) -> FeedbackResponse:
     return FeedbackResponse(request_id=req.request_id)
 
 
-@app.post("/route/generate", response_model=GenerateRouteResponse)
-async def generate(req: GenerateRouteRequest) -> GenerateRouteResponse:
+# stale-while-revalidate の再生成タスク（GC で途中終了しないよう参照を保持する）
+_refresh_tasks: Set[asyncio.Task] = set()
+
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+def _degraded_by_deadline(response: GenerateRouteResponse, budget: deadline.Deadline) -> bool:
+    """
+    期限のために縮めた結果か。処理を省いた（LLM・距離の再試行・Places の二段目）場合と、期限を使い切って
+    フォールバックした（残り時間で打ち切った Routes / Ranker の呼び出しがタイムアウトした）場合。
+    期限に余裕のある後続リクエストにまで使い回さないよう、キャッシュしない。
+    """
+    return budget.skipped or (response.meta.fallback_used and not budget.can_afford(0))
+
+
+async def _generate_and_cache(
+    key: str,
+    req: GenerateRouteRequest,
+    on_event: Optional[ProgressCallback] = None,
+    budget: Optional[deadline.Deadline] = None,
+) -> GenerateRouteResponse:
+    """
+    キャッシュを再確認し、なければ生成してキャッシュに保存する（single-flight の中で呼ぶ）。
+    期限のために縮めた結果（_degraded_by_deadline）はキャッシュしない。
+    """
+    key_pre = cache_key_prefix(key)
+    if budget is None:
+        budget = deadline.start()
+    # 二重チェック（集約待ちの間に他リクエストがキャッシュした可能性）
+    cached = await cache_get(key)
+    if cached is not None:
+        logger.info("cache_hit generate key=%s req=%s (after lock)", key_pre, req.request_id)
+        return GenerateRouteResponse(**cached)
+
+    # インスタンス間の集約（redis バックエンド時）。他インスタンスが生成中なら結果を待つ
+    lease = await acquire_lease(key)
+    if lease is None:
+        cached = await wait_for_peer(key, budget)
+        if cached is not None:
+            logger.info("cache_hit generate key=%s req=%s (peer)", key_pre, req.request_id)
+            return GenerateRouteResponse(**cached)
+        logger.info("cache_peer_timeout generate key=%s req=%s", key_pre, req.request_id)
+
+    # 生成実行（エラー時はキャッシュせず例外はそのまま伝播）
+    try:
+        response = await run_generate_graph(req, on_event=on_event, budget=budget)
+        if _degraded_by_deadline(response, budget):
+            logger.info(
+                "cache_skip_degraded generate key=%s req=%s fallback=%s",
+                key_pre,
+                req.request_id,
+                response.meta.fallback_reason,
+            )
+        else:
+            await cache_set(key, response.model_dump(mode="json"), req)
+        return response
+    finally:
+        if lease is not None:
+            await release_lease(key, lease)
+
+
+def _schedule_refresh(key: str, req: GenerateRouteRequest) -> None:
+    """stale を返したキーを裏で再生成する。同一キーの再生成・通常生成とは single-flight で1本にまとめる。"""
+    # 返却済みの request_id と BigQuery のログが重複しないよう、再生成は別の request_id で行う
+    refresh_req = req.model_copy(update={"request_id": str(uuid.uuid4())})
+
+    async def _refresh() -> None:
+        try:
+            await generate_flight.do(key, lambda: _generate_and_cache(key, refresh_req))
+        except Exception:
+            logger.exception("cache_refresh_failed generate key=%s", cache_key_prefix(key))
+
+    task = asyncio.create_task(_refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _generate_response(
+    req: GenerateRouteRequest,
+    on_event: Optional[ProgressCallback] = None,
+    budget: Optional[deadline.Deadline] = None,
+) -> GenerateRouteResponse:
+    """
+    キャッシュ参照・single-flight を含めてレスポンスを得る（/route/generate と /route/generate/stream で共通）。
+    on_event は自分でグラフを実行した場合だけ呼ばれる（キャッシュ・集約で得た結果では呼ばれない）。
+    budget はリクエスト受付時に作った期限。集約された後続リクエストは先行リクエストの期限で生成された結果を共有する。
+    """
     # debug 時はキャッシュを使わず毎回生成（レスポンスメタに影響しうるため）
     if req.debug:
         logger.info("cache_bypass debug=true request_id=%s", req.request_id)
-        return await run_generate_graph(req)
+        return await run_generate_graph(req, on_event=on_event, budget=budget)
 
     if not settings.GENERATE_CACHE_ENABLED:
-        return await run_generate_graph(req)
+        return await run_generate_graph(req, on_event=on_event, budget=budget)
 
     key = build_cache_key(req)
     key_pre = cache_key_prefix(key)
 
-    # 1) キャッシュ参照
-    cached = cache_get(key)
-    if cached is not None:
-        resp = GenerateRouteResponse(**cached)
+    # 1) キャッシュ参照（完全一致 → stale → 近傍）
+    found = await cache_lookup(req, key)
+    if found is not None:
+        resp = GenerateRouteResponse(**found.response)
         resp.request_id = req.request_id
-        logger.info("cache_hit generate key=%s req=%s", key_pre, req.request_id)
+        logger.info(
+            "cache_%s generate key=%s req=%s age_sec=%.1f%s",
+            found.kind,
+            key_pre,
+            req.request_id,
+            found.age_sec,
+            f" near_key={cache_key_prefix(found.key)}" if found.kind == "near_hit" else "",
+        )
+        if found.kind == "stale":
+            _schedule_refresh(key, req)
         return resp
 
     logger.info("cache_miss generate key=%s req=%s", key_pre, req.request_id)
 
-    # 2) 同一キーの並行リクエストを1本に集約（スタンピード防止）
-    key_lock = await _get_key_lock(key)
-    async with key_lock:
-        # 二重チェック（ロック取得中に他リクエストがキャッシュした可能性）
-        cached = cache_get(key)
-        if cached is not None:
-            resp = GenerateRouteResponse(**cached)
-            resp.request_id = req.request_id
-            logger.info("cache_hit generate key=%s req=%s (after lock)", key_pre, req.request_id)
-            return resp
-
-        # 3) 生成実行（エラー時はキャッシュせず例外はそのまま伝播）
-        response = await run_generate_graph(req)
-        cache_set(key, response.model_dump())
-        return response
+    # 2) 同一キーの並行リクエストを1本に集約（スタンピード防止）。後続は先行の結果を共有する
+    response, shared = await generate_flight.do(key, lambda: _generate_and_cache(key, req, on_event=on_event, budget=budget))
+    if shared or response.request_id != req.request_id:
+        response = response.model_copy(deep=True)
+        response.request_id = req.request_id
+        if shared:
+            logger.info("cache_hit generate key=%s req=%s (coalesced)", key_pre, req.request_id)
+    return response
+
+
+@app.post("/route/generate", response_model=GenerateRouteResponse)
+async def generate(req: GenerateRouteRequest) -> GenerateRouteResponse:
+    # 期限は受付時点から数える（キャッシュ参照・集約待ちの時間も含む）
+    return await _generate_response(req, budget=deadline.start())
+
+
+def _ndjson_line(event: str, request_id: str, data: Dict[str, Any]) -> bytes:
+    return (json.dumps({"event": event, "request_id": request_id, "data": data}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _progress_from_response(response: GenerateRouteResponse) -> List[Dict[str, Any]]:
+    """レスポンスから途中経過イベントを組み立てる（キャッシュ・集約で得た結果、途中で送れなかったイベントの補完用）。"""
+    route = response.route
+    return [
+        {
+            "event": "route",
+            "data": {
+                "route_id": route.route_id,
+                "polyline": route.polyline,
+                "distance_km": route.distance_km,
+                "duration_min": route.duration_min,
+            },
+        },
+        {"event": "spots", "data": {"spots": [s.model_dump(mode="json") for s in route.spots]}},
+        {"event": "text", "data": {"title": route.title, "summary": route.summary}},
+    ]
+
+
+async def _stream_generate(req: GenerateRouteRequest) -> AsyncIterator[bytes]:
+    queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
+    task = asyncio.create_task(_generate_response(req, on_event=queue.put_nowait, budget=deadline.start()))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    sent: Set[str] = set()
+    try:
+        while (item := await queue.get()) is not None:
+            sent.add(item["event"])
+            yield _ndjson_line(item["event"], req.request_id, item["data"])
+        try:
+            response = task.result()
+        except HTTPException as e:
+            yield _ndjson_line("error", req.request_id, {"status_code": e.status_code, "detail": e.detail})
+            return
+        except Exception:
+            # 例外の中身（上流の URL・応答など）はクライアントに返さず、ログにだけ残す
+            logger.exception("stream_generate_failed request_id=%s", req.request_id)
+            yield _ndjson_line("error", req.request_id, {"status_code": 500, "detail": "Internal Server Error"})
+            return
+        for item in _progress_from_response(response):
+            if item["event"] not in sent:
+                yield _ndjson_line(item["event"], req.request_id, item["data"])
+        yield _ndjson_line("done", req.request_id, response.model_dump(mode="json"))
+    finally:
+        # クライアント切断時は生成を止める（single-flight の待ち手は改めて生成する）
+        if not task.done():
+            task.cancel()
+
+
+@app.post("/route/generate/stream")
+async def generate_stream(req: GenerateRouteRequest) -> StreamingResponse:
+    """
+    /route/generate と同じ処理を NDJSON で段階的に返す。
+    route（経路確定時）→ spots / text（それぞれ完了時）→ done（レスポンス全体）の順に1行ずつ送る。
+    """
+    return StreamingResponse(_stream_generate(req), media_type="application/x-ndjson")
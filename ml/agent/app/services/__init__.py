@@ -1,2 +1,2 @@
-from . import bq_writer, fallback, feature_calc, ranker_client, maps_routes_client, places_client, vertex_llm, ttl_cache  # noqa: F401
+from . import bq_writer, deadline, distance_calibration, fallback, feature_calc, llm_cache, llm_speculation, ranker_client, maps_routes_client, route_geometry, places_client, places_cache, polyline_codec, simplify, vertex_client, vertex_llm, ttl_cache  # noqa: F401
 
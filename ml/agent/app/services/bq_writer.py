@@ -1,17 +1,29 @@
 from __future__ import annotations
-from typing import Any, Dict, Iterable, Optional
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
 from google.cloud import bigquery
 
 from app.settings import settings
 
+logger = logging.getLogger(__name__)
 
 _client: Optional[bigquery.Client] = None  # BigQueryクライアントのシングルトン
 
+_OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "sync")
+
 
 def _bq() -> bigquery.Client:
     """
     BigQueryクライアントを取得（シングルトンパターン）
-    
+
     Returns:
         BigQueryクライアントインスタンス
     """
@@ -21,12 +33,285 @@ def _bq() -> bigquery.Client:
     return _client
 
 
+def insert_rows_sync(
+    table: str,
+    rows: Sequence[Dict[str, Any]],
+    row_ids: Optional[Sequence[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    BigQueryに同期的にデータを挿入する（insert_rows_json を直接呼ぶ）
+
+    Args:
+        table: テーブル名（データセット名は除く、例: "route_request"）
+        rows: 挿入する行のリスト
+        row_ids: 行ごとの insertId（再送時の重複排除用）。None なら BigQuery 側で採番
+
+    Returns:
+        insert_rows_json が返す行エラーのリスト（成功時は空）
+    """
+    if not rows:
+        return []
+    # テーブルIDを構築: project.dataset.table
+    table_id = f"{_bq().project}.{settings.BQ_DATASET}.{table}"
+    if row_ids is not None:
+        return _bq().insert_rows_json(table_id, list(rows), row_ids=list(row_ids))
+    return _bq().insert_rows_json(table_id, list(rows))
+
+
+class BufferedBQWriter:
+    """
+    テーブルごとのインメモリキューに行を溜め、バックグラウンドタスクでまとめて書き込む。
+
+    - `BQ_WRITER_BATCH_MAX_ROWS` 行たまるか `BQ_WRITER_FLUSH_INTERVAL_SEC` 経過でフラッシュ
+    - キューはテーブルごとに `BQ_WRITER_MAX_QUEUE_ROWS` 行まで。超過時は overflow_policy に従う
+      （drop_oldest: 古い行を捨てる / drop_newest: 新しい行を捨てる / sync: 呼び出し元で同期書き込み）
+    - 書き込み（insert_rows_json）はスレッドで実行し、イベントループを塞がない
+    - 例外時は指数バックオフで再送。insertId は enqueue 時に採番し、再送での重複を防ぐ
+    - enqueue はスレッドセーフ（同期エンドポイントのスレッドプールからも呼べる）
+    """
+
+    def __init__(
+        self,
+        *,
+        batch_max_rows: int,
+        flush_interval_sec: float,
+        max_queue_rows: int,
+        overflow_policy: str = "drop_oldest",
+        max_retries: int = 3,
+        retry_backoff_sec: float = 0.5,
+    ) -> None:
+        if overflow_policy not in _OVERFLOW_POLICIES:
+            raise ValueError(f"unsupported overflow_policy: {overflow_policy}")
+        self._batch_max_rows = max(1, int(batch_max_rows))
+        self._flush_interval_sec = max(0.01, float(flush_interval_sec))
+        self._max_queue_rows = max(1, int(max_queue_rows))
+        self._overflow_policy = overflow_policy
+        self._max_retries = max(0, int(max_retries))
+        self._retry_backoff_sec = max(0.0, float(retry_backoff_sec))
+
+        self._buffers: Dict[str, Deque[Tuple[str, Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self._counters: Dict[str, int] = {
+            "enqueued_rows": 0,
+            "dropped_rows": 0,
+            "sync_rows": 0,
+            "flushed_rows": 0,
+            "failed_rows": 0,
+            "retries": 0,
+            "flushes": 0,
+        }
+        self._flush_latency_ms_total = 0
+        self._flush_latency_ms_last = 0
+        self._flush_latency_ms_max = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def enqueue(self, table: str, rows: Iterable[Dict[str, Any]]) -> None:
+        """行をキューに積む。キュー満杯時は overflow_policy に従う。"""
+        items = [(str(uuid.uuid4()), row) for row in rows]
+        if not items:
+            return
+        overflow: List[Tuple[str, Dict[str, Any]]] = []
+        with self._lock:
+            buf = self._buffers.setdefault(table, deque())
+            for item in items:
+                if len(buf) >= self._max_queue_rows:
+                    if self._overflow_policy == "drop_oldest":
+                        buf.popleft()
+                        self._counters["dropped_rows"] += 1
+                    elif self._overflow_policy == "drop_newest":
+                        self._counters["dropped_rows"] += 1
+                        continue
+                    else:
+                        overflow.append(item)
+                        continue
+                buf.append(item)
+                self._counters["enqueued_rows"] += 1
+            depth = len(buf)
+
+        if overflow:
+            # sync ポリシー: キューが空くまで呼び出し元に書き込みを負担させる（バックプレッシャー）
+            self._counters["sync_rows"] += len(overflow)
+            try:
+                errors = insert_rows_sync(table, [r for _, r in overflow], [i for i, _ in overflow])
+                if errors:
+                    self._counters["failed_rows"] += len(errors)
+            except Exception as e:
+                self._counters["failed_rows"] += len(overflow)
+                logger.warning("[BQ Writer Sync Insert Failed] table=%s rows=%d err=%r", table, len(overflow), e)
+
+        if depth >= self._batch_max_rows:
+            self._wake()
+
+    def _wake(self) -> None:
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout_sec: float = 10.0) -> None:
+        """新規のフラッシュ待ちを止め、キューに残った行を書き切ってから停止する（graceful drain）。"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout_sec)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logger.warning(
+                "[BQ Writer Drain Timeout] timeout_sec=%.1f pending_rows=%d",
+                timeout_sec,
+                self._total_depth(),
+            )
+        finally:
+            self._task = None
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval_sec)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:  # noqa: BLE001
+                logger.exception("[BQ Writer Flush Error] err=%r", e)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """全テーブルのキューを BATCH_MAX_ROWS 行ずつ書き込む。"""
+        for table in list(self._buffers.keys()):
+            while True:
+                with self._lock:
+                    buf = self._buffers.get(table)
+                    if not buf:
+                        break
+                    batch = [buf.popleft() for _ in range(min(len(buf), self._batch_max_rows))]
+                await self._write_batch(table, batch)
+
+    async def _write_batch(self, table: str, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        row_ids = [i for i, _ in batch]
+        rows = [r for _, r in batch]
+        t_start = time.perf_counter()
+        for attempt in range(self._max_retries + 1):
+            try:
+                errors = await asyncio.to_thread(insert_rows_sync, table, rows, row_ids)
+            except Exception as e:
+                if attempt < self._max_retries:
+                    self._counters["retries"] += 1
+                    backoff = self._retry_backoff_sec * (2 ** attempt) * (0.5 + random.random())
+                    logger.info(
+                        "[BQ Writer Retry] table=%s rows=%d attempt=%d/%d backoff=%.2fs err=%r",
+                        table,
+                        len(rows),
+                        attempt + 1,
+                        self._max_retries,
+                        backoff,
+                        e,
+                    )
+                    await asyncio.sleep(backoff)
+                    continue
+                self._counters["failed_rows"] += len(rows)
+                logger.warning("[BQ Writer Insert Failed] table=%s rows=%d err=%r", table, len(rows), e)
+                break
+            # 行単位のエラー（スキーマ不一致など）は再送しても直らないため記録のみ
+            if errors:
+                self._counters["failed_rows"] += len(errors)
+                logger.warning(
+                    "[BQ Writer Row Errors] table=%s rows=%d errors=%d first=%s",
+                    table,
+                    len(rows),
+                    len(errors),
+                    str(errors[0])[:300],
+                )
+            self._counters["flushed_rows"] += len(rows) - len(errors or [])
+            break
+
+        elapsed_ms = int((time.perf_counter() - t_start) * 1000)
+        self._counters["flushes"] += 1
+        self._flush_latency_ms_total += elapsed_ms
+        self._flush_latency_ms_last = elapsed_ms
+        self._flush_latency_ms_max = max(self._flush_latency_ms_max, elapsed_ms)
+
+    def _total_depth(self) -> int:
+        with self._lock:
+            return sum(len(b) for b in self._buffers.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depth = {table: len(buf) for table, buf in self._buffers.items()}
+        flushes = self._counters["flushes"]
+        return {
+            **self._counters,
+            "running": self.running,
+            "queue_depth": depth,
+            "flush_latency_ms_last": self._flush_latency_ms_last,
+            "flush_latency_ms_max": self._flush_latency_ms_max,
+            "flush_latency_ms_avg": (self._flush_latency_ms_total / flushes) if flushes else 0.0,
+        }
+
+
+_writer: Optional[BufferedBQWriter] = None
+
+
+def _build_writer() -> BufferedBQWriter:
+    return BufferedBQWriter(
+        batch_max_rows=settings.BQ_WRITER_BATCH_MAX_ROWS,
+        flush_interval_sec=settings.BQ_WRITER_FLUSH_INTERVAL_SEC,
+        max_queue_rows=settings.BQ_WRITER_MAX_QUEUE_ROWS,
+        overflow_policy=settings.BQ_WRITER_OVERFLOW_POLICY,
+        max_retries=settings.BQ_WRITER_MAX_RETRIES,
+        retry_backoff_sec=settings.BQ_WRITER_RETRY_BACKOFF_SEC,
+    )
+
+
+async def start_writer() -> None:
+    """バックグラウンド書き込みを開始する（FastAPI lifespan から呼ぶ）。"""
+    global _writer
+    if not settings.BQ_WRITER_ENABLED:
+        return
+    if _writer is None:
+        _writer = _build_writer()
+    await _writer.start()
+
+
+async def stop_writer() -> None:
+    """
+    キューを書き切ってバックグラウンド書き込みを停止する（FastAPI lifespan の終了時に呼ぶ）。
+    スレッドに逃がした書き込みとキューの書き切りで BQ_WRITER_DRAIN_TIMEOUT_SEC を分け合う（合計でこれを超えない）。
+    """
+    expires_at = time.monotonic() + float(settings.BQ_WRITER_DRAIN_TIMEOUT_SEC)
+    if _background_inserts:
+        await asyncio.wait(set(_background_inserts), timeout=settings.BQ_WRITER_DRAIN_TIMEOUT_SEC)
+    if _writer is None:
+        return
+    await _writer.stop(timeout_sec=max(0.0, expires_at - time.monotonic()))
+
+
 def insert_rows(table: str, rows: Iterable[Dict[str, Any]]) -> None:
     """
     BigQueryにデータを挿入する（ベストエフォート方式）
-    
-    失敗してもユーザーフローを中断しない。MVPではエラーを無視する。
-    
+
+    失敗してもユーザーフローを中断しない。バックグラウンド書き込みが動いていればキューに積むだけで返り、
+    動いていない場合（スクリプト実行時など）は同期的に書き込む。
+
     Args:
         table: テーブル名（データセット名は除く、例: "route_request"）
         rows: 挿入する行のイテレータ（辞書のリスト）
@@ -34,10 +319,49 @@ def insert_rows(table: str, rows: Iterable[Dict[str, Any]]) -> None:
     rows = list(rows)
     if not rows:
         return
-    # テーブルIDを構築: project.dataset.table
-    table_id = f"{_bq().project}.{settings.BQ_DATASET}.{table}"
-    errors = _bq().insert_rows_json(table_id, rows)
-    # ベストエフォート: MVPではエラーを無視（必要に応じてログ出力可能）
+    if _writer is not None and _writer.running:
+        _writer.enqueue(table, rows)
+        return
+    errors = insert_rows_sync(table, rows)
     if errors:
-        # ここで構造化ログを出力可能
-        pass
+        logger.warning("[BQ Insert Row Errors] table=%s errors=%d first=%s", table, len(errors), str(errors[0])[:300])
+
+
+# insert_rows_nowait が同期書き込みをスレッドに逃がしたタスク（GC で途中終了しないよう参照を保持する）
+_background_inserts: Set[asyncio.Task] = set()
+
+
+def _on_background_insert_done(task: asyncio.Task) -> None:
+    _background_inserts.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("[BQ Insert Failed] (background) err=%r", task.exception())
+
+
+def insert_rows_nowait(table: str, rows: Iterable[Dict[str, Any]]) -> None:
+    """
+    insert_rows と同じだが、呼び出し元（リクエストの処理）を待たせない。
+
+    バックグラウンド書き込みが動いていればキューに積むだけ。動いていない場合は同期書き込みをスレッドで実行し、
+    完了を待たずに返る（失敗はログのみ）。イベントループ外から呼ばれた場合は insert_rows と同じく同期的に書き込む。
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    if _writer is not None and _writer.running:
+        _writer.enqueue(table, rows)
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        insert_rows(table, rows)
+        return
+    task = loop.create_task(asyncio.to_thread(insert_rows, table, rows))
+    _background_inserts.add(task)
+    task.add_done_callback(_on_background_insert_done)
+
+
+def stats() -> Dict[str, Any]:
+    """キュー深さ・フラッシュレイテンシ等のメトリクスを返す（/metrics 用）。"""
+    if _writer is None:
+        return {"running": False}
+    return _writer.stats()
@@ -0,0 +1,126 @@
+"""
+リクエスト全体の期限（deadline）。
+
+/route/generate の受付時に REQUEST_DEADLINE_SEC の期限を作り、AgentState の deadline に載せてグラフ全体で共有する。
+外部呼び出し（Routes / Places / Ranker / Vertex）は timeout() で「残り時間」と各サービスの上限の短い方を
+タイムアウトに使い、ノードは remaining() を見て任意の処理（Places の二段目、LLM、距離の再試行）を省く。
+
+クライアントまで引数で引き回さなくて済むよう、グラフの実行中は use() で ContextVar にも入れておく
+（ノードから create_task したタスクにも引き継がれる）。期限が設定されていなければ各サービスの上限をそのまま使う。
+"""
+from __future__ import annotations
+
+import contextlib
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from app.settings import settings
+
+# タイムアウトの下限（秒）。0 にすると httpx は「タイムアウトなし」と区別できないため、ごく短い値で打ち切る
+_MIN_TIMEOUT_SEC = 0.05
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("request_deadline", default=None)
+
+_stats: Dict[str, int] = {
+    "requests": 0,
+    "met": 0,
+    "missed": 0,
+    "clamped_calls": 0,
+    "skipped_places_phase2": 0,
+    "skipped_llm": 0,
+    "skipped_route_retries": 0,
+}
+
+
+class Deadline:
+    """
+    time.monotonic() 基準の期限。budget_sec が 0 以下なら期限なし。
+    skipped は、この期限のために省いた処理があったか（結果をキャッシュするかの判断用）。
+    """
+
+    __slots__ = ("budget_sec", "started_at", "expires_at", "skipped")
+
+    def __init__(self, budget_sec: float) -> None:
+        self.budget_sec = float(budget_sec)
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + self.budget_sec if self.budget_sec > 0 else float("inf")
+        self.skipped = False
+
+    @property
+    def bounded(self) -> bool:
+        return self.budget_sec > 0
+
+    def remaining(self) -> float:
+        """残り時間（秒、0 未満にはしない）。期限なしなら inf。"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed_ms(self) -> int:
+        return int((time.monotonic() - self.started_at) * 1000)
+
+    def timeout(self, cap_sec: float) -> float:
+        """
+        外部呼び出し1回のタイムアウト（秒）。残り時間から DEADLINE_RESERVE_SEC（応答の組み立て分）を引いた値と
+        cap_sec の短い方。cap_sec が 0 以下なら上限なし（残り時間だけで決める）。
+        """
+        if not self.bounded:
+            return cap_sec
+        left = self.remaining() - float(settings.DEADLINE_RESERVE_SEC)
+        if 0 < cap_sec <= left:
+            return cap_sec
+        _stats["clamped_calls"] += 1
+        return max(_MIN_TIMEOUT_SEC, left)
+
+    def can_afford(self, sec: float) -> bool:
+        """残り時間が sec（＋DEADLINE_RESERVE_SEC）以上あるか。"""
+        return self.remaining() >= float(sec) + float(settings.DEADLINE_RESERVE_SEC)
+
+    def to_header_ms(self) -> str:
+        """下流サービスに渡す残り時間（ms）。"""
+        return str(int(self.remaining() * 1000)) if self.bounded else ""
+
+
+def start() -> Deadline:
+    """REQUEST_DEADLINE_SEC の期限を作る（リクエストの受付時に呼ぶ）。"""
+    _stats["requests"] += 1
+    return Deadline(float(settings.REQUEST_DEADLINE_SEC))
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def use(deadline: Deadline) -> Iterator[Deadline]:
+    """この中（と、ここから作ったタスク）の外部呼び出しに deadline を効かせる。抜けるときに期限内だったかを数える。"""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+        if deadline.bounded:
+            _stats["met" if deadline.remaining() > 0 else "missed"] += 1
+
+
+def timeout(cap_sec: float) -> float:
+    """現在の期限に合わせたタイムアウト（秒）。期限がなければ cap_sec。"""
+    deadline = _current.get()
+    return cap_sec if deadline is None else deadline.timeout(cap_sec)
+
+
+def can_afford(sec: float) -> bool:
+    deadline = _current.get()
+    return True if deadline is None else deadline.can_afford(sec)
+
+
+def record_skip(kind: str) -> None:
+    """期限が近いため省いた処理を数える（kind: places_phase2 / llm / route_retries）。"""
+    _stats[f"skipped_{kind}"] += 1
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.skipped = True
+
+
+def stats() -> Dict[str, Any]:
+    """期限の達成状況と、期限のために縮めた・省いた処理のカウンタ（/metrics 用）。"""
+    return {**_stats, "budget_sec": float(settings.REQUEST_DEADLINE_SEC)}
@@ -0,0 +1,244 @@
+"""
+ルート形状ごとの距離補正（地域別の学習）。
+
+compute_route_dests は経由地を幾何的な半径で置くが、実際の徒歩経路長との比率は街路網（碁盤目・河川・線路など）で大きく変わる。
+過去の Routes API 応答から「実際の経路長 / 経由地を置いた距離」の比率を、開始地点の geohash セルと形状ラベル
+（circle_like / triangle / out_and_back / serpentine / one_way）ごとに指数移動平均（EWMA）で学習し、
+次のリクエストで経由地の距離を比率で割り戻す。
+
+- セルの標本数が DISTANCE_CALIBRATION_MIN_SAMPLES 未満の間は、全セット共通（geohash="*"）の比率を使う
+- 比率はスナップショット（JSON）に保存・読み込みする。BigQuery から NEWLINE_DELIMITED_JSON で
+  エクスポートした行（geohash, label, ratio, samples）もそのまま読み込める
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SHAPE_LABELS = ("circle_like", "triangle", "out_and_back", "serpentine")
+ONE_WAY_LABEL = "one_way"  # 終了地点なしの片道（方位ごとのオフセット）
+CALIBRATED_LABELS = (*SHAPE_LABELS, ONE_WAY_LABEL)
+ANY_CELL = "*"  # 全セル共通の比率（セルの標本が少ない間の事前値）
+
+# 比率の取りうる範囲。外れ値（経由地に到達できず大回りした経路など）で補正が振り切れないようにする
+RATIO_MIN = 0.5
+RATIO_MAX = 3.0
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+CalibrationKey = Tuple[str, str]  # (geohash, label)
+
+
+def geohash_encode(lat: float, lng: float, precision: int = 5) -> str:
+    """緯度・経度を geohash 文字列にする（precision=5 で約 4.9km × 4.9km のセル）。"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars: List[str] = []
+    bits = 0
+    n_bits = 0
+    even = True  # 偶数ビットは経度、奇数ビットは緯度
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2.0
+            bit = lng >= mid
+            lng_lo, lng_hi = (mid, lng_hi) if bit else (lng_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2.0
+            bit = lat >= mid
+            lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+        bits = (bits << 1) | int(bit)
+        n_bits += 1
+        even = not even
+        if n_bits == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            n_bits = 0
+    return "".join(chars)
+
+
+class DistanceCalibrator:
+    """(geohash, 形状ラベル) ごとの距離比率の EWMA。"""
+
+    def __init__(
+        self,
+        *,
+        precision: int = 5,
+        alpha: float = 0.2,
+        min_samples: int = 3,
+        maxsize: int = 20000,
+    ) -> None:
+        self.precision = max(1, int(precision))
+        self.alpha = min(1.0, max(0.0, float(alpha)))
+        self.min_samples = max(1, int(min_samples))
+        self.maxsize = max(1, int(maxsize))
+        # 更新が古い順に並べ、maxsize を超えたら古いセルから捨てる（"*" は捨てない）
+        self._entries: "OrderedDict[CalibrationKey, Dict[str, float]]" = OrderedDict()
+        self._stats: Dict[str, int] = {"observations": 0, "rejected": 0, "cell_hits": 0, "prior_hits": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def cell_of(self, lat: float, lng: float) -> str:
+        return geohash_encode(float(lat), float(lng), self.precision)
+
+    def _update(self, key: CalibrationKey, ratio: float, now: float) -> None:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {"ratio": ratio, "samples": 0.0, "updated_at": now}
+            self._entries[key] = entry
+        else:
+            entry["ratio"] += self.alpha * (ratio - entry["ratio"])
+            self._entries.move_to_end(key)
+        entry["samples"] += 1.0
+        entry["updated_at"] = now
+        while len(self._entries) > self.maxsize:
+            oldest = next(k for k in self._entries if k[0] != ANY_CELL)
+            del self._entries[oldest]
+
+    def observe(self, lat: float, lng: float, label: str, built_km: float, observed_km: float) -> bool:
+        """
+        1本分の観測（経由地を置いた距離 built_km に対して実際の経路長 observed_km）を取り込む。
+
+        Returns:
+            取り込んだら True（ラベル対象外・値が不正・比率が範囲外なら False）
+        """
+        if label not in CALIBRATED_LABELS or built_km <= 0.0 or observed_km <= 0.0:
+            return False
+        ratio = observed_km / built_km
+        if not (RATIO_MIN <= ratio <= RATIO_MAX):
+            self._stats["rejected"] += 1
+            return False
+        now = time.time()
+        self._update((self.cell_of(lat, lng), label), ratio, now)
+        self._update((ANY_CELL, label), ratio, now)
+        self._stats["observations"] += 1
+        return True
+
+    def ratio_for(self, lat: float, lng: float, label: str) -> Optional[float]:
+        """セルの比率（標本が足りなければ全セル共通の比率）。どちらも足りなければ None。"""
+        for cell, stat in ((self.cell_of(lat, lng), "cell_hits"), (ANY_CELL, "prior_hits")):
+            entry = self._entries.get((cell, label))
+            if entry is not None and entry["samples"] >= self.min_samples:
+                self._stats[stat] += 1
+                return float(entry["ratio"])
+        self._stats["misses"] += 1
+        return None
+
+    def ratios_for(self, lat: float, lng: float, labels: Iterable[str] = CALIBRATED_LABELS) -> Dict[str, float]:
+        """ラベルごとの比率（学習済みのものだけ）。"""
+        out: Dict[str, float] = {}
+        for label in labels:
+            ratio = self.ratio_for(lat, lng, label)
+            if ratio is not None:
+                out[label] = ratio
+        return out
+
+    def to_rows(self) -> List[Dict[str, Any]]:
+        return [
+            {"geohash": cell, "label": label, "ratio": e["ratio"], "samples": int(e["samples"]), "updated_at": e["updated_at"]}
+            for (cell, label), e in self._entries.items()
+        ]
+
+    def load_rows(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """スナップショットの行を取り込む（既存の同じキーは上書き）。取り込んだ行数を返す。"""
+        loaded = 0
+        for row in sorted(rows, key=lambda r: float(r.get("updated_at") or 0.0)):
+            try:
+                cell = str(row["geohash"])
+                label = str(row["label"])
+                ratio = float(row["ratio"])
+                samples = float(row.get("samples") or 0)
+            except (KeyError, TypeError, ValueError):
+                continue
+            # セル幅（精度）が違うスナップショットのセルは使えない。全セル共通の比率だけ取り込む
+            if label not in CALIBRATED_LABELS or (cell != ANY_CELL and len(cell) != self.precision):
+                continue
+            if not (RATIO_MIN <= ratio <= RATIO_MAX):
+                continue
+            self._entries[(cell, label)] = {
+                "ratio": ratio,
+                "samples": samples,
+                "updated_at": float(row.get("updated_at") or 0.0),
+            }
+            self._entries.move_to_end((cell, label))
+            loaded += 1
+        while len(self._entries) > self.maxsize:
+            oldest = next(k for k in self._entries if k[0] != ANY_CELL)
+            del self._entries[oldest]
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "entries": len(self._entries)}
+
+
+_calibrator: Optional[DistanceCalibrator] = None
+
+
+def get_calibrator() -> DistanceCalibrator:
+    global _calibrator
+    if _calibrator is None:
+        _calibrator = DistanceCalibrator(
+            precision=settings.DISTANCE_CALIBRATION_GEOHASH_PRECISION,
+            alpha=settings.DISTANCE_CALIBRATION_ALPHA,
+            min_samples=settings.DISTANCE_CALIBRATION_MIN_SAMPLES,
+            maxsize=settings.DISTANCE_CALIBRATION_MAXSIZE,
+        )
+    return _calibrator
+
+
+def load_snapshot(path: Optional[str] = None) -> int:
+    """
+    スナップショットを読み込む。JSON（{"entries": [...]}）と NDJSON（1行1エントリ）のどちらも受け付ける。
+    ファイルがなければ何もしない。読み込んだ行数を返す。
+    """
+    path = path if path is not None else settings.DISTANCE_CALIBRATION_PATH
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        try:
+            doc = json.loads(text)
+            rows = doc.get("entries", []) if isinstance(doc, dict) else doc
+        except json.JSONDecodeError:
+            rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        loaded = get_calibrator().load_rows(rows)
+    except Exception as e:
+        logger.warning("[Distance Calibration] load failed path=%s err=%r", path, e)
+        return 0
+    logger.info("[Distance Calibration] loaded path=%s entries=%d", path, loaded)
+    return loaded
+
+
+def save_snapshot(path: Optional[str] = None) -> bool:
+    """スナップショットを書き出す（一時ファイルに書いてから置き換える）。"""
+    path = path if path is not None else settings.DISTANCE_CALIBRATION_PATH
+    if not path:
+        return False
+    calibrator = get_calibrator()
+    doc = {"version": 1, "geohash_precision": calibrator.precision, "entries": calibrator.to_rows()}
+    try:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".calibration-", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning("[Distance Calibration] save failed path=%s err=%r", path, e)
+        return False
+    logger.info("[Distance Calibration] saved path=%s entries=%d", path, len(doc["entries"]))
+    return True
+
+
+def stats() -> Dict[str, Any]:
+    return get_calibrator().stats() if _calibrator is not None else {"entries": 0}
@@ -10,11 +10,12 @@ class Candidate:
     polyline: str  # エンコードされたpolyline文字列
     distance_km: float  # 距離（km）
     duration_min: float  # 所要時間（分）
-    # MVP: 最小限の特徴量を保持（後で拡張可能）
+    # 形状特徴量（route_geometry.compute_route_geometry でデコード済み座標から計算）
     loop_closure_m: float  # ループ閉鎖距離（m）- 往復ルートの場合の開始地点との距離
-    bbox_area: float  # バウンディングボックスの面積
+    bbox_area: float  # バウンディングボックスの面積（km²）
     path_length_ratio: float  # パス長比率（実際の距離/直線距離）
     turn_count: int  # 曲がり角の数
+    backtrack_ratio: float = 0.0  # 既に通った場所を再び通る区間の割合（0〜1）
     # 運動関連の特徴量
     has_stairs: bool = False  # 階段を含むかどうか
     elevation_gain_m: float = 0.0  # 累積標高差（m、上り方向のみ）
@@ -76,6 +77,7 @@ def calc_features(
         "path_length_ratio": float(candidate.path_length_ratio),  # パス長比率
         "turn_count": int(candidate.turn_count),  # 曲がり角の数
         "turn_density": float(turn_density),  # 曲がり角密度（回/km）
+        "backtrack_ratio": float(candidate.backtrack_ratio),  # 往復・重複区間の割合
 
         # テーマ特徴量（ワンホットエンコーディング）
         "theme_exercise": theme_exercise,  # 運動テーマ
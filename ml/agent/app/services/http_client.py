@@ -1,18 +1,258 @@
+"""
+上流サービスごとの httpx.AsyncClient。
+
+Routes（Routes / Route Matrix / Elevation）・Places・Ranker で接続プールを分け、Places の呼び出しが集中しても
+Routes の接続が空かない、ということがないようにする。各クライアントは
+
+- HTTP_{ROUTES,PLACES,RANKER}_MAX_CONNECTIONS / _MAX_KEEPALIVE でプールの大きさを決める
+- HTTP2_ENABLED かつ h2 がインストールされていれば HTTP/2 で接続する（TLS の ALPN で合意できた相手のみ。
+  http:// の Ranker などは HTTP/1.1 のまま）
+- アイドル接続は HTTP_KEEPALIVE_EXPIRY_SEC まで残し、負荷の波のたびに TLS を張り直さない
+- 起動時に HTTP_WARMUP_CONNECTIONS 本の接続を張っておく（warm_up）
+
+プールの使用状況（接続数・使用中の接続・空き待ちのリクエスト）と、接続を得るまでの待ち時間・新規接続の数は
+トランスポートで計測し、stats() で取り出せる。テスト・ベンチマークでは set_client() で全上流に同じクライアントを使う。
+"""
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+import importlib.util
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional
+from urllib.parse import urlsplit
+
 import httpx
 
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
 
+UPSTREAMS = ("routes", "places", "ranker")
+
+# 接続を得た（プールの空き待ちが終わった）ことを示す httpcore の trace イベント。
+# 新規接続なら TCP 接続の開始、既存の接続を使うならヘッダー送信の開始
+_ACQUIRED_EVENTS = frozenset(
+    {
+        "connection.connect_tcp.started",
+        "http11.send_request_headers.started",
+        "http2.send_request_headers.started",
+    }
+)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_transports: Dict[str, "InstrumentedTransport"] = {}
+# set_client() で差し替えたクライアント（全上流で共有）
 _http_client: Optional[httpx.AsyncClient] = None
 
 
+def _new_counters() -> Dict[str, float]:
+    return {
+        "requests": 0,
+        "errors": 0,
+        "in_flight": 0,
+        "max_in_flight": 0,
+        "new_connections": 0,
+        "pool_wait_ms_last": 0.0,
+        "pool_wait_ms_max": 0.0,
+        "pool_wait_ms_total": 0.0,
+        "connect_ms_total": 0.0,
+    }
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """AsyncHTTPTransport を包み、リクエスト数・プールの空き待ち時間・新規接続数を数える。"""
+
+    def __init__(self, upstream: str, transport: httpx.AsyncHTTPTransport, limits: httpx.Limits) -> None:
+        self.upstream = upstream
+        self.limits = limits
+        self._transport = transport
+        self.counters = _new_counters()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        c = self.counters
+        t_start = time.perf_counter()
+        marks: Dict[str, float] = {}
+        parent = request.extensions.get("trace")
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            now = time.perf_counter()
+            if event in _ACQUIRED_EVENTS:
+                marks.setdefault("acquired", now)
+            if event == "connection.connect_tcp.started":
+                marks["connect"] = now
+            elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete") and "connect" in marks:
+                marks["connected"] = now
+            if parent is not None:
+                await parent(event, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        c["requests"] += 1
+        c["in_flight"] += 1
+        c["max_in_flight"] = max(c["max_in_flight"], c["in_flight"])
+        try:
+            return await self._transport.handle_async_request(request)
+        except Exception:
+            c["errors"] += 1
+            raise
+        finally:
+            c["in_flight"] -= 1
+            wait_ms = (marks.get("acquired", time.perf_counter()) - t_start) * 1000.0
+            c["pool_wait_ms_last"] = wait_ms
+            c["pool_wait_ms_max"] = max(c["pool_wait_ms_max"], wait_ms)
+            c["pool_wait_ms_total"] += wait_ms
+            if "connect" in marks:
+                c["new_connections"] += 1
+                c["connect_ms_total"] += (marks.get("connected", marks["connect"]) - marks["connect"]) * 1000.0
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """プール内の接続の内訳。httpcore の内部状態を読むので、取れなければ 0 を返す。"""
+        pool = getattr(self._transport, "_pool", None)
+        connections: List[Any] = list(getattr(pool, "connections", None) or [])
+        queued = sum(1 for r in getattr(pool, "_requests", None) or [] if r.is_queued())
+        active = sum(1 for conn in connections if not conn.is_idle())
+        max_connections = self.limits.max_connections or 0
+        return {
+            "connections": len(connections),
+            "connections_active": active,
+            "connections_idle": len(connections) - active,
+            "connections_http2": sum(1 for conn in connections if "HTTP/2" in conn.info()),
+            "queued": queued,
+            "utilization": (active / max_connections) if max_connections else 0.0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        c = self.counters
+        n = int(c["requests"])
+        new = int(c["new_connections"])
+        return {
+            "requests": n,
+            "errors": int(c["errors"]),
+            "in_flight": int(c["in_flight"]),
+            "max_in_flight": int(c["max_in_flight"]),
+            "new_connections": new,
+            "reused_ratio": ((n - new) / n) if n else 0.0,
+            "pool_wait_ms_last": c["pool_wait_ms_last"],
+            "pool_wait_ms_max": c["pool_wait_ms_max"],
+            "pool_wait_ms_avg": (c["pool_wait_ms_total"] / n) if n else 0.0,
+            "connect_ms_avg": (c["connect_ms_total"] / new) if new else 0.0,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            **self.pool_stats(),
+        }
+
+
+def http2_available() -> bool:
+    """HTTP2_ENABLED かつ h2（httpx[http2]）がインストールされているか。"""
+    return bool(settings.HTTP2_ENABLED) and importlib.util.find_spec("h2") is not None
+
+
+def _limits(upstream: str) -> httpx.Limits:
+    prefix = f"HTTP_{upstream.upper()}"
+    max_connections = max(1, int(getattr(settings, f"{prefix}_MAX_CONNECTIONS")))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(max_connections, max(0, int(getattr(settings, f"{prefix}_MAX_KEEPALIVE")))),
+        keepalive_expiry=float(settings.HTTP_KEEPALIVE_EXPIRY_SEC),
+    )
+
+
+def _build_client(upstream: str, http2: bool) -> httpx.AsyncClient:
+    limits = _limits(upstream)
+    transport = InstrumentedTransport(upstream, httpx.AsyncHTTPTransport(http2=http2, limits=limits), limits)
+    _transports[upstream] = transport
+    return httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(settings.REQUEST_TIMEOUT_SEC))
+
+
+def start() -> None:
+    """上流ごとのクライアントを作る（FastAPI lifespan の開始時に呼ぶ）。"""
+    http2 = http2_available()
+    if settings.HTTP2_ENABLED and not http2:
+        logger.warning("HTTP2_ENABLED is set but h2 is not installed; using HTTP/1.1")
+    for upstream in UPSTREAMS:
+        _clients[upstream] = _build_client(upstream, http2)
+
+
+def _warmup_urls() -> Dict[str, str]:
+    def origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}/" if parts.scheme and parts.netloc else ""
+
+    return {
+        "routes": origin(settings.MAPS_ROUTES_BASE),
+        "places": origin(settings.MAPS_PLACES_BASE),
+        "ranker": f"{settings.RANKER_URL.rstrip('/')}/health" if settings.RANKER_URL else "",
+    }
+
+
+async def warm_up() -> Dict[str, int]:
+    """
+    各上流に HTTP_WARMUP_CONNECTIONS 本の HEAD を同時に投げ、接続（TCP・TLS）を張っておく。
+    応答のステータスは見ない（404 や 403 でも接続はプールに残る）。失敗しても起動は止めない。
+
+    Returns:
+        上流ごとの接続できた数
+    """
+    count = max(0, int(settings.HTTP_WARMUP_CONNECTIONS))
+    timeout = float(settings.HTTP_WARMUP_TIMEOUT_SEC)
+    if count == 0 or not _clients:
+        return {}
+
+    async def head(client: httpx.AsyncClient, url: str) -> bool:
+        try:
+            await client.head(url, timeout=timeout)
+            return True
+        except httpx.HTTPError:
+            return False
+
+    warmed: Dict[str, int] = {}
+    jobs: List[Awaitable[List[bool]]] = []
+    names: List[str] = []
+    for upstream, url in _warmup_urls().items():
+        client = _clients.get(upstream)
+        if client is None or not url:
+            continue
+        names.append(upstream)
+        jobs.append(asyncio.gather(*(head(client, url) for _ in range(count))))
+    t0 = time.perf_counter()
+    for upstream, results in zip(names, await asyncio.gather(*jobs)):
+        warmed[upstream] = sum(results)
+    logger.info("[HTTP Warmup] connections=%s elapsed_ms=%d", warmed, int((time.perf_counter() - t0) * 1000))
+    return warmed
+
+
+async def close() -> None:
+    """上流ごとのクライアントを閉じる（FastAPI lifespan の終了時に呼ぶ）。"""
+    clients = list(_clients.values())
+    _clients.clear()
+    _transports.clear()
+    for client in clients:
+        await client.aclose()
+
+
 def set_client(client: Optional[httpx.AsyncClient]) -> None:
+    """全上流で使うクライアントを差し替える（テスト・ベンチマーク用。None で上流ごとのクライアントに戻す）。"""
     global _http_client
     _http_client = client
 
 
-def get_client() -> httpx.AsyncClient:
-    if _http_client is None:
-        raise RuntimeError("HTTP client is not initialized")
-    return _http_client
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """upstream（routes / places / ranker）用のクライアント。"""
+    if _http_client is not None:
+        return _http_client
+    client = _clients.get(upstream)
+    if client is None:
+        raise RuntimeError(f"HTTP client is not initialized: {upstream}")
+    return client
+
+
+def stats() -> Dict[str, Any]:
+    """上流ごとのプールの使用状況と空き待ち時間（/metrics 用）。"""
+    return {
+        "http2": http2_available(),
+        "keepalive_expiry_sec": float(settings.HTTP_KEEPALIVE_EXPIRY_SEC),
+        **{upstream: transport.stats() for upstream, transport in _transports.items()},
+    }
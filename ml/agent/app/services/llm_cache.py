@@ -0,0 +1,217 @@
+"""
+Vertex AI のタイトル・紹介文生成の応答キャッシュ。
+
+プロンプト（title_description.jinja の描画結果）はテーマ・丸めた距離と所要時間・スポット名（最大4件）だけで決まり、
+人気の開始地点では同じプロンプトが繰り返し来る。描画済みプロンプトとモデル名・生成パラメータの sha256 をキーに、
+モデルの応答（JSON から取り出した title / description、正規化前）を保存する。
+
+- ローカル: TTLCache（LLM_CACHE_TTL_SEC、満杯時は最も古く使われたキーから追い出す）
+- LLM_CACHE_REDIS_URL を設定すると Redis にも保存し、インスタンス間で共有する（キーごとの list、TTL 付き）
+- 1キーにつき LLM_CACHE_VARIANTS 件の応答がたまるまではモデルを呼び、たまった後はその中からランダムに返す
+  （同じ条件でも毎回同じ文面にならないように）
+- 同一キーの並行呼び出しは SingleFlight で1本に集約する
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+from app.services.singleflight import SingleFlight
+from app.settings import settings
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # redis は LLM_CACHE_REDIS_URL を設定したときのみ必要
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+# (title, description)
+Variant = Tuple[str, str]
+
+_KEY_PREFIX = "llm:v1:"
+_REDIS_KEY_PREFIX = "firstdown:"
+
+llm_flight: SingleFlight[Optional[Variant]] = SingleFlight("llm")
+
+_local: Optional[TTLCache[str, List[Variant]]] = None
+_redis: Any = None
+_redis_disabled = False
+_stats: Dict[str, int] = {
+    "hits": 0,
+    "remote_hits": 0,
+    "misses": 0,
+    "fills": 0,
+    "coalesced": 0,
+    "stores": 0,
+    "errors": 0,
+}
+
+
+def _variants() -> int:
+    return max(1, int(settings.LLM_CACHE_VARIANTS))
+
+
+def _get_local() -> TTLCache[str, List[Variant]]:
+    global _local
+    if _local is None:
+        _local = TTLCache(maxsize=max(1, settings.LLM_CACHE_MAXSIZE), ttl=settings.LLM_CACHE_TTL_SEC)
+    return _local
+
+
+def _get_redis() -> Any:
+    """Redis クライアント（遅延初期化）。URL 未設定・redis 未インストールなら None。"""
+    global _redis, _redis_disabled
+    if _redis is not None or _redis_disabled:
+        return _redis
+    if not settings.LLM_CACHE_REDIS_URL:
+        _redis_disabled = True
+        return None
+    if redis_asyncio is None:
+        logger.warning("LLM_CACHE_REDIS_URL is set but redis is not installed; using local cache only")
+        _redis_disabled = True
+        return None
+    _redis = redis_asyncio.from_url(
+        settings.LLM_CACHE_REDIS_URL,
+        socket_timeout=settings.LLM_CACHE_REDIS_TIMEOUT_SEC,
+        socket_connect_timeout=settings.LLM_CACHE_REDIS_TIMEOUT_SEC,
+    )
+    return _redis
+
+
+def build_key(
+    prompt: str,
+    *,
+    model: str,
+    temperature: float,
+    max_output_tokens: int,
+    top_p: float,
+    top_k: int,
+) -> str:
+    """描画済みプロンプトとモデル・生成パラメータからキャッシュキーを作る。"""
+    payload = {
+        "prompt": prompt,
+        "model": model,
+        "temperature": round(float(temperature), 3),
+        "max_output_tokens": int(max_output_tokens),
+        "top_p": round(float(top_p), 3),
+        "top_k": int(top_k),
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return _KEY_PREFIX + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _log_key(key: str) -> str:
+    return key[len(_KEY_PREFIX) : len(_KEY_PREFIX) + 8]
+
+
+async def _get_pool(key: str) -> List[Variant]:
+    local = _get_local().get(key)
+    if local is not None and len(local) >= _variants():
+        return local
+    client = _get_redis()
+    if client is None:
+        return local or []
+    try:
+        raw = await client.lrange(_REDIS_KEY_PREFIX + key, 0, -1)
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.warning("llm cache redis get error key=%s err=%s", _log_key(key), e)
+        return local or []
+    if len(raw) <= len(local or []):
+        return local or []
+    pool: List[Variant] = [tuple(json.loads(item)) for item in raw[-_variants() :]]  # type: ignore[misc]
+    _stats["remote_hits"] += 1
+    _get_local()[key] = pool
+    return pool
+
+
+async def _add_variant(key: str, variant: Variant) -> None:
+    local = _get_local()
+    # 同じ文面が返ってきても1件と数える（重複を除くと、文面が揺れないプロンプトで呼び続けてしまう）
+    pool = [*(local.get(key) or []), variant]
+    local[key] = pool[-_variants() :]
+    _stats["stores"] += 1
+    client = _get_redis()
+    if client is None:
+        return
+    redis_key = _REDIS_KEY_PREFIX + key
+    try:
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.rpush(redis_key, json.dumps(list(variant), ensure_ascii=False))
+            pipe.ltrim(redis_key, -_variants(), -1)
+            pipe.pexpire(redis_key, max(1, int(settings.LLM_CACHE_TTL_SEC * 1000)))
+            await pipe.execute()
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.warning("llm cache redis set error key=%s err=%s", _log_key(key), e)
+
+
+async def get_or_generate(
+    key: str,
+    generate: Callable[[], Awaitable[Optional[Variant]]],
+) -> Tuple[Optional[Variant], bool]:
+    """
+    キャッシュの応答を返すか、generate() でモデルを呼んで保存する。
+    generate() が None（失敗・空応答・JSON 不正）を返した場合は保存しない。
+
+    Returns:
+        (variant, cached): cached はモデルを呼ばずに返した場合 True（他の呼び出しの結果を共有した場合も含む）
+    """
+    if not getattr(settings, "LLM_CACHE_ENABLED", True):
+        return await generate(), False
+
+    pool = await _get_pool(key)
+    if len(pool) >= _variants():
+        _stats["hits"] += 1
+        return random.choice(pool), True
+
+    async def fill() -> Optional[Variant]:
+        variant = await generate()
+        if variant is not None:
+            await _add_variant(key, variant)
+        return variant
+
+    variant, shared = await llm_flight.do(key, fill)
+    if shared:
+        _stats["coalesced"] += 1
+    else:
+        _stats["fills" if pool else "misses"] += 1
+    if variant is None and pool:
+        # 文面を増やす呼び出しに失敗しただけなら、たまっている応答を返す
+        return random.choice(pool), True
+    return variant, shared
+
+
+def stats() -> Dict[str, Any]:
+    """ヒット率などのカウンタを返す（/metrics 用）。fills は応答の種類を増やすためにモデルを呼んだ回数。"""
+    lookups = _stats["hits"] + _stats["misses"] + _stats["fills"] + _stats["coalesced"]
+    return {
+        **_stats,
+        "redis": _redis is not None,
+        "variants": _variants(),
+        "size": len(_local) if _local is not None else 0,
+        "hit_ratio": ((_stats["hits"] + _stats["coalesced"]) / lookups) if lookups else 0.0,
+    }
+
+
+def clear() -> None:
+    """ローカルのキャッシュとカウンタを初期化する（テスト・ベンチマーク用）。"""
+    global _local
+    _local = None
+    for k in _stats:
+        _stats[k] = 0
+
+
+async def close() -> None:
+    """Redis の接続を閉じる（FastAPI lifespan の終了時に呼ぶ）。"""
+    global _redis, _redis_disabled
+    if _redis is not None:
+        await _redis.aclose()
+    _redis = None
+    _redis_disabled = False
@@ -0,0 +1,108 @@
+"""
+タイトル・紹介文の投機的生成。
+
+文章生成のプロンプトはテーマ・距離（0.1km 単位）・所要時間（分単位）だけで決まる（スポットは並行検索のため渡さない）。
+候補ルートが出そろった時点で、ヒューリスティック上位の候補の距離・所要時間で生成を始めておき、
+Ranker が選んだルートと (テーマ, 距離, 所要時間) が一致すればその結果を採用する。一致しなければ捨てる
+（実行中ならキャンセルする）。
+
+投機はグラフの実行ごと（AgentState の run_id）に登録し、採用・破棄のどちらでも登録を消す。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from app.services import vertex_client, vertex_llm
+
+logger = logging.getLogger(__name__)
+
+# (テーマ, 距離, 所要時間)。プロンプトと同じ書式で丸める
+TextKey = Tuple[str, str, str]
+SpeculativeResult = Tuple[Dict[str, str], Dict[str, float]]
+
+_runs: Dict[str, Dict[TextKey, "asyncio.Task[SpeculativeResult]"]] = {}
+_stats: Dict[str, int] = {
+    "runs": 0,
+    "started": 0,
+    "hits": 0,
+    "misses": 0,
+    "wasted": 0,
+    "cancelled": 0,
+    "wasted_tokens": 0,
+}
+
+
+def text_key(theme: str, distance_km: float, duration_min: float) -> TextKey:
+    return (theme, f"{distance_km:.1f}", f"{duration_min:.0f}")
+
+
+async def _generate(theme: str, distance_km: float, duration_min: float) -> SpeculativeResult:
+    with vertex_client.collect_timings() as timings:
+        result = await vertex_llm.generate_title_and_description(
+            theme=theme,
+            distance_km=distance_km,
+            duration_min=duration_min,
+            spots=[],
+        )
+    return result, timings
+
+
+def start(run_id: str, *, theme: str, distance_km: float, duration_min: float) -> bool:
+    """生成を始める。同じ実行で同じキーの生成が既にあれば何もせず False。"""
+    key = text_key(theme, distance_km, duration_min)
+    entry = _runs.get(run_id)
+    if entry is None:
+        entry = _runs[run_id] = {}
+        _stats["runs"] += 1
+    if key in entry:
+        return False
+    entry[key] = asyncio.create_task(_generate(theme, distance_km, duration_min))
+    _stats["started"] += 1
+    return True
+
+
+def _discard(task: "asyncio.Task[SpeculativeResult]") -> None:
+    if not task.done():
+        task.cancel()
+        _stats["cancelled"] += 1
+        return
+    if task.cancelled() or task.exception() is not None:
+        return
+    _stats["wasted"] += 1
+    _stats["wasted_tokens"] += int(task.result()[1]["tokens"])
+
+
+def take(
+    run_id: str, *, theme: str, distance_km: float, duration_min: float
+) -> Optional["asyncio.Task[SpeculativeResult]"]:
+    """
+    選ばれたルートに一致する生成を取り出し、残りは捨てる。
+    投機していない実行なら None（ヒット率には数えない）。一致しなければ None。
+    """
+    entry = _runs.pop(run_id, None)
+    if not entry:
+        return None
+    task = entry.pop(text_key(theme, distance_km, duration_min), None)
+    for other in entry.values():
+        _discard(other)
+    _stats["hits" if task is not None else "misses"] += 1
+    return task
+
+
+def discard(run_id: str) -> None:
+    """実行の投機をすべて捨てる（文章生成まで進まなかった実行の後始末）。"""
+    entry = _runs.pop(run_id, None)
+    for task in (entry or {}).values():
+        _discard(task)
+
+
+def stats() -> Dict[str, Any]:
+    """ヒット率と無駄になった生成のカウンタ（/metrics 用）。cancelled は実行中に捨てた数（トークン数は不明）。"""
+    decided = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "pending_runs": len(_runs),
+        "hit_ratio": (_stats["hits"] / decided) if decided else 0.0,
+    }
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import math
 import logging
 import random
@@ -8,6 +9,7 @@ from typing import Any, Dict, List, Optional
 import httpx
 
 from app.settings import settings
+from app.services import deadline
 from app.services.http_client import get_client
 
 logger = logging.getLogger(__name__)
@@ -29,12 +31,12 @@ async def _calculate_elevation_gain(encoded_polyline: str, api_key: str) -> floa
         # Elevation APIのエンドポイント
         elevation_url = "https://maps.googleapis.com/maps/api/elevation/json"
         
-        client = get_client()
+        client = get_client("routes")
         params = {
             "locations": f"enc:{encoded_polyline}",
             "key": api_key,
         }
-        resp = await client.get(elevation_url, params=params, timeout=settings.REQUEST_TIMEOUT_SEC)
+        resp = await client.get(elevation_url, params=params, timeout=deadline.timeout(settings.REQUEST_TIMEOUT_SEC))
 
         if resp.status_code != 200:
             logger.warning(f"[Elevation API] HTTP error: status={resp.status_code}")
@@ -122,7 +124,18 @@ def compute_route_dests(
     end_lng: float | None = None,
     distance_km: float,
     round_trip: bool,
+    label_scales: Optional[Dict[str, float]] = None,
 ) -> List[Any]:
+    """
+    Routes API に渡す目的地（経由地セット）を幾何的に作る。
+
+    label_scales を渡すと、形状ラベルごとに経由地を置く距離をその倍率で伸縮する
+    （distance_calibration で学習した「実際の経路長 / 経由地の距離」の補正。未指定のラベルは 1.0）。
+    """
+
+    def _scale(label: str) -> float:
+        return float(label_scales.get(label, 1.0)) if label_scales else 1.0
+
     def _min_km_for_short_distance(target_km: float) -> float:
         # 短距離（<=2km）は下限をさらに小さくして距離誤差を抑える
         if target_km <= 1.0:
@@ -202,11 +215,12 @@ def compute_route_dests(
 
             # 1) 円に近いループ（四角）を最優先
             if len(dests) < max_candidates:
+                circle_scale = _scale("circle_like")
                 for h in headings:
                     angles = [h, h + 90.0, h + 180.0, h + 270.0]
                     waypoints = []
                     for a in angles:
-                        r = radius_km * random.uniform(0.9, 1.1)
+                        r = radius_km * circle_scale * random.uniform(0.9, 1.1)
                         waypoints.append(_offset_latlng(start_lat, start_lng, r, a))
                     add_waypoints("circle_like", waypoints)
                     if len(dests) >= max_candidates:
@@ -221,7 +235,7 @@ def compute_route_dests(
                         dist_scale = random.uniform(0.7, 1.0)
                     else:
                         dist_scale = random.uniform(0.85, 1.15)
-                    distance_km_jitter = waypoint_distance_km * dist_scale
+                    distance_km_jitter = waypoint_distance_km * dist_scale * _scale("triangle")
                     angle_shift = random.uniform(35.0, 75.0)
                     p1 = _offset_latlng(start_lat, start_lng, distance_km_jitter, h)
                     p2 = _offset_latlng(start_lat, start_lng, distance_km_jitter, h + angle_shift)
@@ -237,8 +251,9 @@ def compute_route_dests(
                     else:
                         far_km = waypoint_distance_km * random.uniform(1.4, 1.9)
                         near_km = waypoint_distance_km * random.uniform(0.6, 0.9)
-                    p_far = _offset_latlng(start_lat, start_lng, far_km, h)
-                    p_near = _offset_latlng(start_lat, start_lng, near_km, h)
+                    out_and_back_scale = _scale("out_and_back")
+                    p_far = _offset_latlng(start_lat, start_lng, far_km * out_and_back_scale, h)
+                    p_near = _offset_latlng(start_lat, start_lng, near_km * out_and_back_scale, h)
                     add_waypoints("out_and_back", [p_far, p_near])
                     if len(dests) >= max_candidates:
                         break
@@ -252,6 +267,8 @@ def compute_route_dests(
                     else:
                         base_step_km = max(distance_km / 6.0, 0.4)
                         lateral_km = base_step_km * 0.45
+                    base_step_km *= _scale("serpentine")
+                    lateral_km *= _scale("serpentine")
                     waypoints = []
                     for i in range(4):
                         forward_km = base_step_km * (1.0 + i * 0.35)
@@ -263,14 +280,17 @@ def compute_route_dests(
                     if len(dests) >= max_candidates:
                         break
         else:
-            waypoint_distance_km = max(distance_km, _min_km_for_short_distance(distance_km))
+            waypoint_distance_km = max(distance_km, _min_km_for_short_distance(distance_km)) * _scale("one_way")
             dests = [
-                _offset_latlng(
-                    start_lat,
-                    start_lng,
-                    waypoint_distance_km * random.uniform(0.9, 1.1),
-                    h,
-                )
+                {
+                    **_offset_latlng(
+                        start_lat,
+                        start_lng,
+                        waypoint_distance_km * random.uniform(0.9, 1.1),
+                        h,
+                    ),
+                    "label": "one_way",
+                }
                 for h in headings
             ]
     return dests
@@ -437,7 +457,7 @@ async def compute_route_candidates(
         "X-Goog-FieldMask": "routes.distanceMeters,routes.duration,routes.polyline.encodedPolyline",
     }
 
-    client = get_client()
+    client = get_client("routes")
     results: List[Dict[str, Any]] = []
     for idx, dest in enumerate(dests, start=1):
         travel_mode = "WALK"
@@ -503,7 +523,7 @@ async def compute_route_candidates(
                 round_trip,
             )
 
-        resp = await client.post(settings.MAPS_ROUTES_BASE, json=body, headers=headers)
+        resp = await client.post(settings.MAPS_ROUTES_BASE, json=body, headers=headers, timeout=deadline.timeout(settings.REQUEST_TIMEOUT_SEC))
 
         # 200以外のstatus / response bodyを必ずログ出力
         if resp.status_code != 200:
@@ -607,7 +627,7 @@ async def compute_route_candidate(
         "X-Goog-FieldMask": "routes.distanceMeters,routes.duration,routes.polyline.encodedPolyline",
     }
 
-    client = get_client()
+    client = get_client("routes")
     travel_mode = "WALK"
     body = {
         "origin": {"location": {"latLng": {"latitude": start_lat, "longitude": start_lng}}},
@@ -671,7 +691,12 @@ async def compute_route_candidate(
                 round_trip,
             )
 
-    resp = await client.post(settings.MAPS_ROUTES_BASE, json=body, headers=headers)
+    try:
+        resp = await client.post(settings.MAPS_ROUTES_BASE, json=body, headers=headers, timeout=deadline.timeout(settings.REQUEST_TIMEOUT_SEC))
+    except httpx.TimeoutException as e:
+        # 期限で打ち切った1本はルートなしとして扱う（他の目的地の結果は生かす）
+        logger.warning("[Routes API Timeout] request_id=%s idx=%d err=%r", request_id, idx, e)
+        return None
 
     # 200以外のstatus / response bodyを必ずログ出力
     if resp.status_code != 200:
@@ -754,3 +779,168 @@ async def compute_route_candidate(
             "elevation_gain_m": 0.0,
         }
     return None
+
+
+def _dest_chain(
+    *,
+    start_lat: float,
+    start_lng: float,
+    dest: Any,
+    round_trip: bool,
+) -> List[tuple[float, float]]:
+    """
+    compute_route_candidate が Routes API に渡す経路の地点列（出発地 → 経由地 → 目的地）を返す。
+    """
+    chain = [(float(start_lat), float(start_lng))]
+    if round_trip:
+        waypoints = dest.get("waypoints") if isinstance(dest, dict) else dest
+        chain.extend((float(wp["lat"]), float(wp["lng"])) for wp in (waypoints or []))
+        chain.append((float(start_lat), float(start_lng)))
+    else:
+        if isinstance(dest, dict) and dest.get("waypoints"):
+            chain.extend((float(wp["lat"]), float(wp["lng"])) for wp in dest["waypoints"])
+        chain.append((float(dest["lat"]), float(dest["lng"])))
+    return chain
+
+
+def _matrix_waypoint(point: tuple[float, float]) -> Dict[str, Any]:
+    return {"waypoint": {"location": {"latLng": {"latitude": point[0], "longitude": point[1]}}}}
+
+
+async def _call_route_matrix(
+    *,
+    request_id: str,
+    origins: List[tuple[float, float]],
+    destinations: List[tuple[float, float]],
+) -> Dict[tuple[tuple[float, float], tuple[float, float]], float]:
+    """computeRouteMatrix を1回呼び、(始点, 終点) → 距離（m）を返す。経路なしの要素は含めない。"""
+    headers = {
+        "X-Goog-Api-Key": settings.MAPS_API_KEY,
+        "X-Goog-FieldMask": "originIndex,destinationIndex,distanceMeters,status,condition",
+    }
+    body = {
+        "origins": [_matrix_waypoint(p) for p in origins],
+        "destinations": [_matrix_waypoint(p) for p in destinations],
+        "travelMode": "WALK",
+    }
+    resp = await get_client("routes").post(
+        settings.MAPS_ROUTE_MATRIX_BASE, json=body, headers=headers, timeout=deadline.timeout(settings.REQUEST_TIMEOUT_SEC)
+    )
+    if resp.status_code != 200:
+        logger.warning(
+            "[Route Matrix Error] request_id=%s status=%d body=%s",
+            request_id,
+            resp.status_code,
+            resp.text[:500],
+        )
+        return {}
+    try:
+        elements = resp.json()
+    except Exception as e:
+        logger.error("[Route Matrix Error] JSON Parse Failed. request_id=%s err=%r", request_id, e)
+        return {}
+
+    out: Dict[tuple[tuple[float, float], tuple[float, float]], float] = {}
+    for el in elements if isinstance(elements, list) else []:
+        # status は成功時に空オブジェクト（gRPC Status）。経路がない組は condition=ROUTE_NOT_FOUND
+        if (el.get("status") or {}).get("code") or el.get("condition") not in (None, "ROUTE_EXISTS"):
+            continue
+        if el.get("distanceMeters") is None:
+            continue
+        oi, di = int(el.get("originIndex", 0)), int(el.get("destinationIndex", 0))
+        if 0 <= oi < len(origins) and 0 <= di < len(destinations):
+            out[(origins[oi], destinations[di])] = float(el["distanceMeters"])
+    return out
+
+
+def _group_legs(
+    legs: List[tuple[tuple[float, float], tuple[float, float]]],
+    max_elements: int,
+) -> List[tuple[List[tuple[float, float]], List[tuple[float, float]]]]:
+    """
+    区間を行列呼び出し（origins, destinations）に分ける。行列 API は origins × destinations の全要素が課金されるため、
+    1呼び出しは「始点が同じ区間（1 × m）」か「終点が同じ区間（m × 1）」にまとめ、使わない要素を要求しない。
+    始点でまとまらなかった区間を終点でまとめる（周回の最後の区間 経由地→出発地 など）。
+    """
+    by_origin: Dict[tuple[float, float], List[tuple[float, float]]] = {}
+    for a, b in legs:
+        by_origin.setdefault(a, []).append(b)
+    groups: List[tuple[List[tuple[float, float]], List[tuple[float, float]]]] = []
+    by_destination: Dict[tuple[float, float], List[tuple[float, float]]] = {}
+    for a, bs in by_origin.items():
+        if len(bs) > 1:
+            groups.extend(([a], bs[i : i + max_elements]) for i in range(0, len(bs), max_elements))
+        else:
+            by_destination.setdefault(bs[0], []).append(a)
+    for b, origins in by_destination.items():
+        groups.extend((origins[i : i + max_elements], [b]) for i in range(0, len(origins), max_elements))
+    return groups
+
+
+async def estimate_dest_distances_km(
+    *,
+    request_id: str,
+    start_lat: float,
+    start_lng: float,
+    dests: List[Any],
+    round_trip: bool,
+    memo: Optional[Dict[str, float]] = None,
+) -> List[Optional[float]]:
+    """
+    compute_route_dests の各目的地（経由地セット）について、徒歩の経路長を computeRouteMatrix で見積もる。
+
+    行列 API は origins × destinations の要素数で課金され、1要素が computeRoutes 1回と同程度の単価なので、
+    セットの全区間を取ると省ける Routes 呼び出しより高くつく。そこで出発地から出る区間（出発地 → 最初の地点）を
+    ROUTE_MATRIX_SAMPLE_LEGS 本だけ 1 × k の行列で取得し、その「徒歩距離 / 直線距離」の比（開始地点まわりの
+    迂回率）を各セットの直線距離（出発地 → 経由地 → … → 目的地）に掛けて見積もる。
+    迂回率は出発地で決まるので、memo を渡すと取得した値を入れ、次の試行では行列 API を呼ばずに使う。
+
+    Returns:
+        dests と同じ順の見積もり距離（km）。迂回率が取れなかった場合は全セット None
+    """
+    if not settings.MAPS_API_KEY:
+        raise RuntimeError("MAPS_API_KEY is not configured")
+
+    Leg = tuple[tuple[float, float], tuple[float, float]]
+
+    def straight_m(leg: Leg) -> float:
+        return _haversine_km(leg[0][0], leg[0][1], leg[1][0], leg[1][1]) * 1000.0
+
+    straight_km: List[float] = []
+    samples: Dict[Leg, None] = {}
+    sample_max = max(1, int(settings.ROUTE_MATRIX_SAMPLE_LEGS))
+    for d in dests:
+        chain = [
+            (round(p[0], 6), round(p[1], 6))
+            for p in _dest_chain(start_lat=start_lat, start_lng=start_lng, dest=d, round_trip=round_trip)
+        ]
+        legs = [(a, b) for a, b in zip(chain, chain[1:]) if a != b]
+        straight_km.append(sum(straight_m(leg) for leg in legs) / 1000.0)
+        if legs and len(samples) < sample_max:
+            samples.setdefault(legs[0], None)
+    if memo is not None and "detour" in memo:
+        return [km * memo["detour"] if km > 0 else None for km in straight_km]
+    if not samples:
+        return [None for _ in dests]
+
+    groups = _group_legs(list(samples), max(1, int(settings.ROUTE_MATRIX_MAX_ELEMENTS)))
+    results = await asyncio.gather(*(
+        _call_route_matrix(request_id=request_id, origins=origins, destinations=destinations)
+        for origins, destinations in groups
+    ))
+    walked = {leg: m for r in results for leg, m in r.items()}
+    straight = sum(straight_m(leg) for leg in walked)
+    detour = (sum(walked.values()) / straight) if straight > 0 else None
+    logger.info(
+        "[Route Matrix] request_id=%s sets=%d elements=%d sampled=%d detour=%s",
+        request_id,
+        len(dests),
+        sum(len(o) * len(d) for o, d in groups),
+        len(walked),
+        f"{detour:.3f}" if detour is not None else None,
+    )
+    if detour is None:
+        return [None for _ in dests]
+    if memo is not None:
+        memo["detour"] = detour
+    return [km * detour if km > 0 else None for km in straight_km]
@@ -0,0 +1,129 @@
+"""
+Places API（searchNearby）結果のインプロセスTTLキャッシュ。
+候補ごとの特徴量計算（compute_features）と採用ルートのスポット検索（fetch_places）は
+同じ開始地点付近の円を何度も検索するため、量子化した検索条件をキーに結果を共有する。
+同一キーの並行検索は1本に集約する（in-flight coalescing）。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+PlacesKey = Tuple[Any, ...]
+
+# キャッシュ本体（遅延初期化）。TTLCache は満杯時に最も古く使われたエントリから追い出す（LRU）。
+_places_cache: Optional[TTLCache[PlacesKey, List[Dict[str, Any]]]] = None
+# 実行中の検索（同一キーの並行リクエストはこの Future の結果を待つ）
+_inflight: Dict[PlacesKey, asyncio.Future] = {}
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0}
+
+
+def _get_cache() -> TTLCache[PlacesKey, List[Dict[str, Any]]]:
+    global _places_cache
+    if _places_cache is None:
+        _places_cache = TTLCache(
+            maxsize=max(1, settings.PLACES_CACHE_MAXSIZE),
+            ttl=settings.PLACES_CACHE_TTL_SEC,
+        )
+    return _places_cache
+
+
+def build_places_key(
+    *,
+    lat: float,
+    lng: float,
+    radius_m: int,
+    included_types: Optional[List[str]],
+    keyword: Optional[str],
+    max_results: int,
+    allow_unfiltered_fallback: bool,
+) -> PlacesKey:
+    """
+    検索条件からキャッシュキーを作る。
+    lat/lng は PLACES_CACHE_ROUND_LATLNG_DECIMALS 桁に丸め、近接した検索円を同じキーに寄せる。
+    """
+    dec = int(getattr(settings, "PLACES_CACHE_ROUND_LATLNG_DECIMALS", 3))
+    types_key = tuple(sorted(included_types)) if included_types else ()
+    return (
+        round(float(lat), dec),
+        round(float(lng), dec),
+        int(radius_m),
+        types_key,
+        keyword or "",
+        int(max_results),
+        bool(allow_unfiltered_fallback),
+    )
+
+
+def _copy_places(places: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # 呼び出し元での変更がキャッシュ内の値に波及しないよう浅いコピーを返す
+    return [dict(p) for p in places]
+
+
+async def get_or_fetch(
+    key: PlacesKey,
+    fetch: Callable[[], Awaitable[List[Dict[str, Any]]]],
+) -> List[Dict[str, Any]]:
+    """
+    キャッシュにあればそれを返し、なければ fetch() を実行して保存する。
+    空の結果（API エラー時も空になる）はキャッシュしない。
+    """
+    if not getattr(settings, "PLACES_CACHE_ENABLED", True):
+        return await fetch()
+
+    cache = _get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        _stats["hits"] += 1
+        return _copy_places(cached)
+
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        _stats["coalesced"] += 1
+        result = await asyncio.shield(inflight)
+        if result is not None:
+            return _copy_places(result)
+        # 先行リクエストが失敗・キャンセルされた場合は自分で取得し直す
+        return await get_or_fetch(key, fetch)
+
+    _stats["misses"] += 1
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    result: Optional[List[Dict[str, Any]]] = None
+    try:
+        result = await fetch()
+        if result:
+            cache[key] = _copy_places(result)
+            _stats["stores"] += 1
+        return _copy_places(result)
+    finally:
+        _inflight.pop(key, None)
+        if not future.done():
+            future.set_result(result)
+
+
+def stats() -> Dict[str, Any]:
+    """ヒット率などのカウンタを返す（/metrics 用）。"""
+    lookups = _stats["hits"] + _stats["misses"] + _stats["coalesced"]
+    return {
+        **_stats,
+        "size": len(_places_cache) if _places_cache is not None else 0,
+        "inflight": len(_inflight),
+        "hit_ratio": ((_stats["hits"] + _stats["coalesced"]) / lookups) if lookups else 0.0,
+    }
+
+
+def clear() -> None:
+    """キャッシュとカウンタを初期化する（テスト・ベンチマーク用）。"""
+    global _places_cache
+    _places_cache = None
+    _inflight.clear()
+    for k in _stats:
+        _stats[k] = 0
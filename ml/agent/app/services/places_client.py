@@ -7,6 +7,7 @@ import random
 import httpx
 
 from app.settings import settings
+from app.services import deadline, places_cache
 from app.services.http_client import get_client
 
 logger = logging.getLogger(__name__)
@@ -149,6 +150,46 @@ async def search_spots(
     Returns:
         場所のリスト（name, type, place_idを含む）
     """
+    if not included_types and theme:
+        effective_types: Optional[List[str]] = _get_place_types_for_theme(theme)
+    else:
+        effective_types = included_types
+    key = places_cache.build_places_key(
+        lat=lat,
+        lng=lng,
+        radius_m=radius_m,
+        included_types=effective_types,
+        keyword=keyword,
+        max_results=max_results,
+        allow_unfiltered_fallback=allow_unfiltered_fallback,
+    )
+    return await places_cache.get_or_fetch(
+        key,
+        lambda: _search_spots_uncached(
+            lat=lat,
+            lng=lng,
+            theme=theme,
+            radius_m=radius_m,
+            max_results=max_results,
+            included_types=included_types,
+            keyword=keyword,
+            allow_unfiltered_fallback=allow_unfiltered_fallback,
+        ),
+    )
+
+
+async def _search_spots_uncached(
+    *,
+    lat: float,
+    lng: float,
+    theme: Optional[str] = None,
+    radius_m: int = 1500,
+    max_results: int = 5,
+    included_types: Optional[List[str]] = None,
+    keyword: Optional[str] = None,
+    allow_unfiltered_fallback: bool = True,
+) -> List[Dict[str, Any]]:
+    """search_spots の実体（キャッシュを介さず Places API を呼ぶ）。"""
     api_key = settings.MAPS_API_KEY
     if not api_key:
         logger.warning("[Places API] MAPS_API_KEY is not configured")
@@ -198,8 +239,8 @@ async def search_spots(
         body["keyword"] = keyword
 
     try:
-        client = get_client()
-        resp = await client.post(settings.MAPS_PLACES_BASE, json=body, headers=headers)
+        client = get_client("places")
+        resp = await client.post(settings.MAPS_PLACES_BASE, json=body, headers=headers, timeout=deadline.timeout(settings.REQUEST_TIMEOUT_SEC))
         if resp.status_code != 200:
             if resp.status_code == 400 and keyword:
                 logger.info(
@@ -208,7 +249,9 @@ async def search_spots(
                 )
                 body_retry = body.copy()
                 body_retry.pop("keyword", None)
-                resp = await client.post(settings.MAPS_PLACES_BASE, json=body_retry, headers=headers)
+                resp = await client.post(
+                    settings.MAPS_PLACES_BASE, json=body_retry, headers=headers, timeout=deadline.timeout(settings.REQUEST_TIMEOUT_SEC)
+                )
                 body = body_retry
             if resp.status_code != 200:
                 logger.warning(
@@ -251,7 +294,9 @@ async def search_spots(
             )
             body_fallback = body.copy()
             body_fallback.pop("includedTypes", None)
-            resp_fallback = await client.post(settings.MAPS_PLACES_BASE, json=body_fallback, headers=headers)
+            resp_fallback = await client.post(
+                settings.MAPS_PLACES_BASE, json=body_fallback, headers=headers, timeout=deadline.timeout(settings.REQUEST_TIMEOUT_SEC)
+            )
             if resp_fallback.status_code == 200:
                 data_fallback = resp_fallback.json()
                 places_fallback = data_fallback.get("places", [])
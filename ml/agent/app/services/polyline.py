@@ -3,12 +3,16 @@ from __future__ import annotations
 from typing import List, Tuple
 import math
 
+from app.services import polyline_codec, simplify
+
 
 def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
     """
     Google Mapsのエンコードされたpolylineを緯度経度のリストにデコードする
     
     Google Mapsで使用される標準のEncoded Polyline Algorithm Formatを実装。
+    デコード本体は polyline_codec（NumPy 実装、同一文字列の結果はメモ化）。配列で扱う場合は
+    polyline_codec.decode_array / decode_scaled を直接使う。
     
     Args:
         encoded: エンコードされたpolyline文字列
@@ -16,51 +20,7 @@ def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
     Returns:
         (緯度, 経度)のタプルのリスト
     """
-    if not encoded:
-        return []
-
-    index = 0  # 文字列のインデックス
-    lat = 0  # 緯度の累積値
-    lng = 0  # 経度の累積値
-    coordinates: List[Tuple[float, float]] = []  # 結果を格納するリスト
-
-    length = len(encoded)
-
-    while index < length:
-        # 緯度をデコード
-        shift = 0  # ビットシフト量
-        result = 0  # デコード結果
-        while True:
-            if index >= length:
-                return coordinates
-            b = ord(encoded[index]) - 63  # ASCII文字を数値に変換（63を引く）
-            index += 1
-            result |= (b & 0x1F) << shift  # 下位5ビットを取得してシフト
-            shift += 5
-            if b < 0x20:  # 最上位ビットが0なら終了
-                break
-        # 符号付き数値に変換（最下位ビットが1なら負数）
-        dlat = ~(result >> 1) if (result & 1) else (result >> 1)
-        lat += dlat  # 緯度の差分を累積
-
-        # 経度をデコード（緯度と同じアルゴリズム）
-        shift = 0
-        result = 0
-        while True:
-            if index >= length:
-                return coordinates
-            b = ord(encoded[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlng = ~(result >> 1) if (result & 1) else (result >> 1)
-        lng += dlng  # 経度の差分を累積
-
-        # 1e5で割って実際の緯度経度に変換（エンコード時は1e5倍している）
-        coordinates.append((lat / 1e5, lng / 1e5))
-    return coordinates
+    return polyline_codec.decode(encoded)
 
 
 def sample_points(points: List[Tuple[float, float]], ratios: List[float]) -> List[Tuple[float, float]]:
@@ -162,6 +122,8 @@ def _point_segment_distance_m(
 def distance_to_path_m(points: List[Tuple[float, float]], point: Tuple[float, float]) -> float:
     """
     点から経路（折れ線）までの最短距離（メートル）
+
+    1点ずつの逐次版。多数の点をまとめて扱う場合は path_distance.PathDistanceEngine を使う。
     """
     if not points:
         return float("inf")
@@ -181,32 +143,13 @@ def simplify_douglas_peucker(
 ) -> List[Tuple[float, float]]:
     """
     Douglas–Peuckerで折れ線を簡略化する（メートル基準）
+
+    距離計算は simplify.douglas_peucker_mask（区間ごとに NumPy で一括計算）。配列のまま扱う場合はそちらを直接使う。
     """
     if len(points) <= 2:
         return points
-
-    keep = [False] * len(points)
-    keep[0] = True
-    keep[-1] = True
-
-    stack: List[Tuple[int, int]] = [(0, len(points) - 1)]
-    while stack:
-        start, end = stack.pop()
-        max_dist = -1.0
-        index = None
-        a = points[start]
-        b = points[end]
-        for i in range(start + 1, end):
-            d = _point_segment_distance_m(points[i], a, b)
-            if d > max_dist:
-                max_dist = d
-                index = i
-        if index is not None and max_dist > epsilon_m:
-            keep[index] = True
-            stack.append((start, index))
-            stack.append((index, end))
-
-    return [p for i, p in enumerate(points) if keep[i]]
+    keep = simplify.douglas_peucker_mask(points, epsilon_m)
+    return [p for p, k in zip(points, keep.tolist()) if k]
 
 
 def pick_waypoints(points: List[Tuple[float, float]], max_points: int = 10) -> List[Tuple[float, float]]:
@@ -0,0 +1,151 @@
+"""
+Encoded Polyline Algorithm Format の NumPy 実装。
+
+- decode_array: (N, 2) float64 の緯度経度配列にデコード（文字単位のループを使わない）
+- decode_scaled: 1e5 倍した int32 の (N, 2) 配列にデコード（メモリ効率重視）
+- encode_array: 配列（またはタプルのリスト）から polyline 文字列にエンコード（polyline ライブラリと同じ出力）
+
+同じ文字列のデコードは候補評価・スポット検索・簡略化で何度も行われるため、結果を LRU でメモ化する。
+メモ化した配列は共有されるので読み取り専用にしている（書き換えが必要なら .copy() する）。
+"""
+from __future__ import annotations
+
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+from cachetools import LRUCache
+
+from app.settings import settings
+
+_FACTOR = 1e5
+# 1値あたりの最大チャンク数（緯度経度の差分は ±3.6e7 未満なので 2^35 未満に収まる）
+_MAX_CHUNKS = 7
+
+_decode_cache: LRUCache[str, np.ndarray] | None = None
+
+Coordinates = Union[np.ndarray, Sequence[Tuple[float, float]]]
+
+
+def _get_cache() -> LRUCache[str, np.ndarray]:
+    global _decode_cache
+    if _decode_cache is None:
+        _decode_cache = LRUCache(maxsize=max(1, int(getattr(settings, "POLYLINE_DECODE_CACHE_MAXSIZE", 256))))
+    return _decode_cache
+
+
+def _decode_scaled_uncached(encoded: str) -> np.ndarray:
+    try:
+        raw = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return _decode_scaled_pure(encoded)
+    if raw.size == 0:
+        return np.empty((0, 2), dtype=np.int32)
+    if raw.min() < 63:
+        return _decode_scaled_pure(encoded)
+
+    b = raw.astype(np.int64) - 63
+    # 各値は 0x20 未満のバイトで終わる。終端のない末尾（途中で切れた文字列）は捨てる
+    ends = np.flatnonzero(b < 0x20)
+    if ends.size < 2:
+        return np.empty((0, 2), dtype=np.int32)
+    n_values = ends.size - (ends.size % 2)
+    ends = ends[:n_values]
+    b = b[: ends[-1] + 1]
+
+    starts = np.empty(n_values, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # 値の中での位置（0, 1, 2, ...）から 5bit ずつのシフト量を決める
+    value_id = np.repeat(np.arange(n_values), ends - starts + 1)
+    pos = np.arange(b.size) - starts[value_id]
+    chunks = (b & 0x1F) << (5 * pos)
+    values = np.add.reduceat(chunks, starts)
+
+    # ジグザグ符号化を戻す（最下位ビットが1なら負数）
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0).astype(np.int32)
+
+
+def _decode_scaled_pure(encoded: str) -> np.ndarray:
+    """ASCII 以外・不正な文字を含む場合の逐次デコード（従来実装と同じ挙動）。"""
+    index = 0
+    lat = 0
+    lng = 0
+    out: List[Tuple[int, int]] = []
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = 0
+            result = 0
+            while True:
+                if index >= length:
+                    return np.array(out, dtype=np.int32).reshape(-1, 2)
+                c = ord(encoded[index]) - 63
+                index += 1
+                result |= (c & 0x1F) << shift
+                shift += 5
+                if c < 0x20:
+                    break
+            deltas.append(~(result >> 1) if (result & 1) else (result >> 1))
+        lat += deltas[0]
+        lng += deltas[1]
+        out.append((lat, lng))
+    return np.array(out, dtype=np.int32).reshape(-1, 2)
+
+
+def decode_scaled(encoded: str) -> np.ndarray:
+    """polyline を 1e5 倍した int32 の (N, 2) 配列にデコードする（メモ化、読み取り専用）。"""
+    if not encoded:
+        return np.empty((0, 2), dtype=np.int32)
+    cache = _get_cache()
+    cached = cache.get(encoded)
+    if cached is not None:
+        return cached
+    scaled = _decode_scaled_uncached(encoded)
+    scaled.setflags(write=False)
+    cache[encoded] = scaled
+    return scaled
+
+
+def decode_array(encoded: str) -> np.ndarray:
+    """polyline を (N, 2) float64 の [緯度, 経度] 配列にデコードする。"""
+    return decode_scaled(encoded) / _FACTOR
+
+
+def decode(encoded: str) -> List[Tuple[float, float]]:
+    """polyline を (緯度, 経度) のタプルのリストにデコードする（従来 API 互換）。"""
+    return [(lat, lng) for lat, lng in decode_array(encoded).tolist()]
+
+
+def encode_array(coords: Coordinates) -> str:
+    """
+    緯度経度の配列（またはタプルのリスト）を polyline 文字列にエンコードする。
+    丸めは polyline ライブラリと同じ四捨五入（0.5 は 0 から遠い方へ）で、出力も一致する。
+    """
+    arr = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if arr.shape[0] == 0:
+        return ""
+    scaled = arr * int(_FACTOR)
+    rounded = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+    deltas = np.diff(rounded, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).reshape(-1)
+
+    values = deltas << 1
+    values = np.where(values < 0, ~values, values)
+
+    shifts = 5 * np.arange(_MAX_CHUNKS, dtype=np.int64)
+    shifted = values[:, None] >> shifts
+    chunks = shifted & 0x1F
+    # 各値に必要なチャンク数（最低1）
+    n_chunks = np.maximum(1, np.count_nonzero(shifted, axis=1))
+    col = np.arange(_MAX_CHUNKS)
+    used = col[None, :] < n_chunks[:, None]
+    continuation = col[None, :] < (n_chunks[:, None] - 1)
+    out = (chunks | (continuation * 0x20)) + 63
+    return out[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def clear_cache() -> None:
+    """デコード結果のメモ化をクリアする（テスト・ベンチマーク用）。"""
+    global _decode_cache
+    _decode_cache = None
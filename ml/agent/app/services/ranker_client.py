@@ -5,6 +5,7 @@ from urllib.parse import urlparse
 import httpx
 
 from app.settings import settings
+from app.services import deadline
 from app.services.http_client import get_client
 from app.services.id_token import get_token
 
@@ -37,21 +38,26 @@ async def rank_routes(
     ranker_base = _ranker_base_url(settings.RANKER_URL)
     token = await get_token(ranker_base)
     headers = {"Authorization": f"Bearer {token}"}
+    # 残り時間を渡し、Ranker 側でもモデル推論の待ち時間を合わせてもらう
+    budget = deadline.current()
+    if budget is not None and budget.bounded:
+        headers["X-Request-Deadline-Ms"] = budget.to_header_ms()
+    timeout_sec = deadline.timeout(settings.RANKER_TIMEOUT_SEC)
 
     try:
-        client = get_client()
+        client = get_client("ranker")
         r = await client.post(
             f"{settings.RANKER_URL}/rank",
             json=payload,
             headers=headers,
-            timeout=httpx.Timeout(settings.RANKER_TIMEOUT_SEC),
+            timeout=httpx.Timeout(timeout_sec),
         )
     except httpx.TimeoutException as e:
         # タイムアウトエラー
         logger.error(
             "[Ranker Timeout] request_id=%s timeout_sec=%.1f err=%r",
             request_id,
-            settings.RANKER_TIMEOUT_SEC,
+            timeout_sec,
             e,
         )
         raise
@@ -0,0 +1,128 @@
+"""
+デコード済みの経路座標からルート形状の特徴量を計算する（NumPy、1ルート1パス）。
+
+- loop_closure_m: 始点と終点の距離（m、haversine）
+- bbox_area_km2: 局所平面でのバウンディングボックス面積（km²）
+- path_length_ratio: 経路長 / 弦の長さ。弦は片道なら始点→終点の直線距離、
+  周回（loop_closure_m <= LOOP_CLOSURE_M）なら始点から最も遠い点までの往復距離
+- turn_count: 一定間隔に再標本化した経路の進行方向が TURN_ANGLE_DEG 以上変わった箇所の数
+  （連続する急な方向変化は1回の曲がり角として数える）
+- backtrack_ratio: 経路の前半で通ったセルを、少し先に進んでから再び通った区間の割合（往復・重複の度合い、0〜1）
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+
+from app.services.path_distance import LocalFrame, haversine_m
+
+# 周回ルートとみなす始終点距離（m）。feature_calc の round_trip_fit と同じ基準
+LOOP_CLOSURE_M = 100.0
+# 方向変化を見るための再標本化間隔（m）。これより細かい折れ線のノイズは曲がり角に数えない
+RESAMPLE_STEP_M = 15.0
+# 曲がり角とみなす進行方向の変化（度）
+TURN_ANGLE_DEG = 40.0
+# 重複判定のセル幅（m）。道路の反対側を歩く程度のずれは同じ経路とみなす
+OVERLAP_CELL_M = 20.0
+# 同じセルに「戻ってきた」とみなすまでに進む距離（m）。隣接サンプルの同一セル判定を除く
+OVERLAP_MIN_GAP_M = 60.0
+
+LatLngArray = Union[np.ndarray, Sequence[Tuple[float, float]]]
+
+
+@dataclass(frozen=True)
+class RouteGeometry:
+    """ルート形状の特徴量"""
+    loop_closure_m: float  # 始点と終点の距離（m）
+    bbox_area_km2: float  # バウンディングボックス面積（km²）
+    path_length_m: float  # 経路長（m、局所平面）
+    path_length_ratio: float  # 経路長 / 弦の長さ
+    turn_count: int  # 曲がり角の数
+    backtrack_ratio: float  # 既に通った場所を再び通る区間の割合（0〜1）
+
+
+def _resample(xy: np.ndarray, cum: np.ndarray, step_m: float) -> np.ndarray:
+    """累積距離 cum に沿って step_m 間隔の点を線形補間で取る（始点・終点を含む）。"""
+    total = float(cum[-1])
+    n = max(2, int(total // step_m) + 1)
+    targets = np.linspace(0.0, total, n)
+    x = np.interp(targets, cum, xy[:, 0])
+    y = np.interp(targets, cum, xy[:, 1])
+    return np.column_stack((x, y))
+
+
+def _turn_count(samples: np.ndarray) -> int:
+    seg = np.diff(samples, axis=0)
+    moving = np.einsum("ij,ij->i", seg, seg) > 0.0
+    seg = seg[moving]
+    if seg.shape[0] < 2:
+        return 0
+    heading = np.arctan2(seg[:, 1], seg[:, 0])
+    # -π〜π に正規化した方向変化
+    change = np.abs((np.diff(heading) + np.pi) % (2.0 * np.pi) - np.pi)
+    sharp = change >= np.radians(TURN_ANGLE_DEG)
+    # 連続する急な方向変化（緩いカーブを複数サンプルで曲がる場合）は1回に数える
+    starts = sharp & ~np.concatenate(([False], sharp[:-1]))
+    return int(np.count_nonzero(starts))
+
+
+def _backtrack_ratio(samples: np.ndarray, step_m: float) -> float:
+    if samples.shape[0] < 3:
+        return 0.0
+    cells = np.floor(samples / OVERLAP_CELL_M).astype(np.int64)
+    cells -= cells.min(axis=0)
+    keys = cells[:, 0] * (int(cells[:, 1].max()) + 1) + cells[:, 1]
+    # セルごとに最初に通ったサンプル番号（安定ソートで同じセル内は通過順に並ぶ）
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    run_start = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+    first = np.empty_like(order)
+    first[order] = order[run_start][np.cumsum(run_start) - 1]
+    gap = np.arange(samples.shape[0]) - first
+    revisited = gap * step_m >= OVERLAP_MIN_GAP_M
+    return float(np.count_nonzero(revisited) / samples.shape[0])
+
+
+def compute_route_geometry(points: LatLngArray) -> RouteGeometry:
+    """
+    経路座標（(N, 2) の [緯度, 経度]）から形状特徴量を計算する。
+
+    Raises:
+        ValueError: 点が1つもない場合
+    """
+    arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if arr.shape[0] == 0:
+        raise ValueError("empty route")
+
+    loop_closure_m = float(haversine_m(arr[0], arr[-1]))
+    lat_min, lng_min = arr.min(axis=0)
+    lat_max, lng_max = arr.max(axis=0)
+    frame = LocalFrame((lat_min + lat_max) / 2.0, (lng_min + lng_max) / 2.0)
+    xy = frame.project(arr)
+    extent = xy.max(axis=0) - xy.min(axis=0)
+    bbox_area_km2 = float(extent[0] * extent[1] / 1e6)
+
+    seg_len = np.hypot(*np.diff(xy, axis=0).T) if arr.shape[0] >= 2 else np.empty((0,))
+    path_length_m = float(seg_len.sum())
+    if path_length_m <= 0.0:
+        return RouteGeometry(loop_closure_m, bbox_area_km2, 0.0, 1.0, 0, 0.0)
+
+    if loop_closure_m <= LOOP_CLOSURE_M:
+        chord_m = 2.0 * float(np.hypot(*(xy - xy[0]).T).max())
+    else:
+        chord_m = float(np.hypot(*(xy[-1] - xy[0])))
+    path_length_ratio = path_length_m / chord_m if chord_m > 0.0 else 1.0
+
+    cum = np.concatenate(([0.0], np.cumsum(seg_len)))
+    samples = _resample(xy, cum, RESAMPLE_STEP_M)
+    step_m = path_length_m / max(1, samples.shape[0] - 1)
+    return RouteGeometry(
+        loop_closure_m=loop_closure_m,
+        bbox_area_km2=bbox_area_km2,
+        path_length_m=path_length_m,
+        path_length_ratio=float(path_length_ratio),
+        turn_count=_turn_count(samples),
+        backtrack_ratio=_backtrack_ratio(samples, step_m),
+    )
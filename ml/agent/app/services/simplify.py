@@ -0,0 +1,269 @@
+"""
+折れ線の簡略化とナビ用代表点の選択（NumPy 実装）。
+
+- douglas_peucker_mask: Douglas–Peucker。同じ深さの全区間・全内点の距離を配列で一括計算する
+  （距離の定義は polyline._point_segment_distance_m と同じで、出力も一致する）
+- visvalingam_mask: Visvalingam–Whyatt。実効面積の小さい点から削り、target_count 点まで減らす
+- build_nav_waypoints: 代表点の重複除去・始点の付与・近接点の除去・周回の閉じを配列のまま行う
+
+いずれも保持する点のマスク／インデックス（または (N, 2) 配列）を返し、LatLng への変換は呼び出し側で最後に1回だけ行う。
+"""
+from __future__ import annotations
+
+import heapq
+import math
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.services.path_distance import LocalFrame
+
+_EARTH_RADIUS_M = 6371000.0
+
+LatLngArray = Union[np.ndarray, Sequence[Tuple[float, float]]]
+
+
+def _as_latlng_array(points: LatLngArray) -> np.ndarray:
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def _haversine_to_points_m(lat: np.ndarray, lng: np.ndarray, a_lat: np.ndarray, a_lng: np.ndarray) -> np.ndarray:
+    # polyline._haversine_m(p, a) と同じ式・同じ演算順（a == b の区間で使う）
+    phi1 = np.radians(lat)
+    phi2 = np.radians(a_lat)
+    dphi = np.radians(a_lat - lat)
+    dlambda = np.radians(a_lng - lng)
+    h = np.sin(dphi / 2.0) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2.0) ** 2
+    return 2.0 * _EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+
+
+def _spans_distances_m(
+    lat: np.ndarray,
+    lng: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    複数の区間 (starts[k], ends[k]) について、内点それぞれから線分 start–end までの距離（m）を一括計算する。
+
+    Returns:
+        (span_id, dists): 内点ごとの区間番号と距離（区間順・点順に並ぶ）
+    """
+    counts = ends - starts - 1
+    span_id = np.repeat(np.arange(starts.size), counts)
+    rank = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    idx = starts[span_id] + 1 + rank
+    p_lat = lat[idx]
+    p_lng = lng[idx]
+
+    # 線分ごとに中点の緯度で投影する（polyline._point_segment_distance_m と同じ近似・同じ演算順）
+    a_lat, a_lng = lat[starts], lng[starts]
+    b_lat, b_lng = lat[ends], lng[ends]
+    cos_lat0 = np.array([math.cos(math.radians((a + b) / 2.0)) for a, b in zip(a_lat.tolist(), b_lat.tolist())])
+    r = _EARTH_RADIUS_M
+    ax = np.radians(a_lng) * cos_lat0 * r
+    ay = np.radians(a_lat) * r
+    bx = np.radians(b_lng) * cos_lat0 * r
+    by = np.radians(b_lat) * r
+    abx = (bx - ax)[span_id]
+    aby = (by - ay)[span_id]
+    ax = ax[span_id]
+    ay = ay[span_id]
+    px = np.radians(p_lng) * cos_lat0[span_id] * r
+    py = np.radians(p_lat) * r
+
+    apx = px - ax
+    apy = py - ay
+    ab_len2 = abx * abx + aby * aby
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(ab_len2 > 0.0, np.clip((apx * abx + apy * aby) / ab_len2, 0.0, 1.0), 0.0)
+    dists = np.hypot(px - (ax + t * abx), py - (ay + t * aby))
+
+    # 始点と終点が同じ区間（周回の閉じなど）は、その点からの haversine 距離
+    same = (a_lat == b_lat) & (a_lng == b_lng)
+    if same.any():
+        on_same = same[span_id]
+        dists[on_same] = _haversine_to_points_m(
+            p_lat[on_same], p_lng[on_same], a_lat[span_id[on_same]], a_lng[span_id[on_same]]
+        )
+    return span_id, dists
+
+
+def douglas_peucker_mask(points: LatLngArray, epsilon_m: float = 20.0) -> np.ndarray:
+    """Douglas–Peucker で残す点のマスク（始点・終点は常に残す）。"""
+    arr = _as_latlng_array(points)
+    n = arr.shape[0]
+    keep = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+    keep[0] = True
+    keep[-1] = True
+    lat = np.ascontiguousarray(arr[:, 0])
+    lng = np.ascontiguousarray(arr[:, 1])
+
+    # 各区間の判定は両端点だけで決まり処理順に依存しないため、同じ深さの区間をまとめて処理する
+    starts = np.array([0])
+    ends = np.array([n - 1])
+    while starts.size:
+        span_id, dists = _spans_distances_m(lat, lng, starts, ends)
+        span_max = np.full(starts.size, -np.inf)
+        np.maximum.at(span_max, span_id, dists)
+        # 区間内で最大値をとる最初の点（従来実装の「より大きい場合のみ更新」と同じ）
+        at_max = np.flatnonzero(dists == span_max[span_id])
+        _, first = np.unique(span_id[at_max], return_index=True)
+        split_span = span_id[at_max[first]]
+        split_point = starts[split_span] + 1 + (at_max[first] - np.searchsorted(span_id, split_span))
+        split = span_max[split_span] > epsilon_m
+        split_span, split_point = split_span[split], split_point[split]
+        keep[split_point] = True
+
+        starts = np.concatenate([starts[split_span], split_point])
+        ends = np.concatenate([split_point, ends[split_span]])
+        inner = ends - starts >= 2
+        starts, ends = starts[inner], ends[inner]
+    return keep
+
+
+def visvalingam_mask(points: LatLngArray, target_count: int) -> np.ndarray:
+    """
+    Visvalingam–Whyatt で target_count 点まで減らしたときに残る点のマスク（始点・終点は常に残す）。
+    面積は経路の中心を基準にした局所平面（m²）で計算する。
+    """
+    arr = _as_latlng_array(points)
+    n = arr.shape[0]
+    keep = np.ones(n, dtype=bool)
+    target_count = max(2, int(target_count))
+    if n <= target_count:
+        return keep
+    lat_mid = float((arr[:, 0].min() + arr[:, 0].max()) / 2.0)
+    lng_mid = float((arr[:, 1].min() + arr[:, 1].max()) / 2.0)
+    xy = LocalFrame(lat_mid, lng_mid).project(arr)
+
+    # 内点の初期面積は配列で一括計算し、削除ループは Python のリストで回す（要素アクセスが速い）
+    initial = np.abs(
+        (xy[1:-1, 0] - xy[:-2, 0]) * (xy[2:, 1] - xy[:-2, 1]) - (xy[2:, 0] - xy[:-2, 0]) * (xy[1:-1, 1] - xy[:-2, 1])
+    ) / 2.0
+    areas = [math.inf, *initial.tolist(), math.inf]
+    xs = xy[:, 0].tolist()
+    ys = xy[:, 1].tolist()
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    alive = [True] * n
+    heap = [(areas[i], i) for i in range(1, n - 1)]
+    heapq.heapify(heap)
+
+    remaining = n
+    last_area = 0.0
+    while remaining > target_count and heap:
+        area, i = heapq.heappop(heap)
+        # 近傍の削除で面積が更新された古いエントリは読み飛ばす
+        if not alive[i] or area != areas[i]:
+            continue
+        alive[i] = False
+        remaining -= 1
+        # 削除した点より小さい面積にはしない（削除順の単調性を保つ）
+        last_area = max(last_area, area)
+        p, q = prev[i], nxt[i]
+        nxt[p] = q
+        prev[q] = p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                a, c = prev[j], nxt[j]
+                tri = abs((xs[j] - xs[a]) * (ys[c] - ys[a]) - (xs[c] - xs[a]) * (ys[j] - ys[a])) / 2.0
+                areas[j] = max(tri, last_area)
+                heapq.heappush(heap, (areas[j], j))
+    keep[:] = alive
+    return keep
+
+
+def simplify_mask(
+    points: LatLngArray,
+    mode: str = "douglas_peucker",
+    epsilon_m: float = 20.0,
+    target_count: int = 10,
+) -> np.ndarray:
+    """mode に応じて簡略化後に残す点のマスクを返す。"""
+    if mode == "visvalingam":
+        return visvalingam_mask(points, target_count)
+    if mode == "douglas_peucker":
+        return douglas_peucker_mask(points, epsilon_m)
+    raise ValueError(f"unsupported simplify mode: {mode}")
+
+
+def pick_waypoint_indices(n: int, max_points: int = 10) -> np.ndarray:
+    """n 点から最大 max_points 点を均等に選ぶインデックス（polyline.pick_waypoints と同じ選び方）。"""
+    if n <= 0:
+        return np.empty((0,), dtype=np.int64)
+    if n <= max_points:
+        return np.arange(n)
+    step = (n - 1) / (max_points - 1)
+    indices = np.array([int(i * step) for i in range(max_points)], dtype=np.int64)
+    indices[-1] = n - 1
+    return indices
+
+
+def _haversine_pair_m(a: np.ndarray, b: np.ndarray) -> float:
+    # graph._haversine_m(LatLng, LatLng) と同じ式
+    lat1 = math.radians(a[0])
+    lat2 = math.radians(b[0])
+    dlat = lat2 - lat1
+    dlng = math.radians(b[1] - a[1])
+    h = math.sin(dlat / 2.0) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2.0) ** 2
+    return 2.0 * _EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _first_occurrences(keys: np.ndarray) -> np.ndarray:
+    """行が重複する場合は最初の行だけを残すインデックス（順序保持）。"""
+    if keys.shape[0] == 0:
+        return np.empty((0,), dtype=np.int64)
+    _, first = np.unique(keys, axis=0, return_index=True)
+    return np.sort(first)
+
+
+def build_nav_waypoints(
+    waypoints: LatLngArray,
+    start: Tuple[float, float],
+    round_trip: bool,
+    max_points: int = 10,
+    dedupe_m: float = 10.0,
+) -> np.ndarray:
+    """
+    代表点の配列からナビ用 waypoint 列を作る（(K, 2) 配列）。
+
+    1. 小数6桁で同じ座標の重複を除く（max_points を超える場合は始点・終点を優先して切り詰める）
+    2. 出発地点と同じ座標を除いてから先頭に出発地点を置き、max_points 点に切り詰める
+    3. 直前の点から dedupe_m 以内の点を除く
+    4. 周回で始終点が dedupe_m より離れていれば、末尾に始点を置く
+    """
+    raw = _as_latlng_array(waypoints)
+    pts = raw[_first_occurrences(np.round(raw, 6))]
+
+    if pts.shape[0] > max_points:
+        # 元の列の始点・終点を優先し、残りを重複除去後の順に詰める
+        priority = [raw[0], raw[-1]] if raw.shape[0] >= 2 else []
+        picked: List[np.ndarray] = []
+        for row in [*priority, *pts]:
+            if len(picked) >= max_points:
+                break
+            if any(np.array_equal(row, q) for q in picked):
+                continue
+            picked.append(row)
+        pts = np.array(picked)
+
+    start_arr = np.array([[float(start[0]), float(start[1])]])
+    not_start = np.any(np.round(pts, 6) != np.round(start_arr, 6), axis=1)
+    pts = np.concatenate([start_arr, pts[not_start]])[:max_points]
+
+    kept = [0]
+    for i in range(1, pts.shape[0]):
+        if _haversine_pair_m(pts[kept[-1]], pts[i]) > dedupe_m:
+            kept.append(i)
+    pts = pts[kept]
+
+    if round_trip and pts.shape[0] > 0 and _haversine_pair_m(pts[0], pts[-1]) > dedupe_m:
+        if pts.shape[0] < max_points:
+            pts = np.concatenate([pts, pts[:1]])
+        else:
+            pts[-1] = pts[0]
+    return pts
@@ -0,0 +1,92 @@
+"""
+同一キーの並行処理を1本に集約する single-flight レジストリ。
+先行呼び出し（leader）の Future を後続呼び出しで共有し、完了したらエントリを削除する。
+キーごとのロックを保持し続けないため、長時間稼働してもメモリが増え続けない。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Generic, Tuple, TypeVar
+
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 直近に集約が発生したキーの件数だけを保持する（統計用、上限付き）
+_RECENT_KEYS_MAXSIZE = 128
+
+
+class SingleFlight(Generic[T]):
+    """
+    key ごとに実行中の処理を1つに制限し、後続の呼び出しはその結果を待つ。
+
+    - leader が例外で終わった場合、待っていた呼び出しにも同じ例外を伝える
+    - leader がキャンセルされた場合（クライアント切断など）は、待っていた呼び出しが改めて実行する
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._recent: LRUCache[str, int] = LRUCache(maxsize=_RECENT_KEYS_MAXSIZE)
+        self._stats: Dict[str, int] = {"leaders": 0, "coalesced": 0, "max_coalesced_per_key": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        fn() を key 単位で1回だけ実行して結果を返す。
+
+        Returns:
+            (result, shared): shared は他の呼び出しの結果を共有した場合 True
+        """
+        while True:
+            inflight = self._calls.get(key)
+            if inflight is None:
+                break
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            self._stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(inflight), True
+            except asyncio.CancelledError:
+                # leader 側のキャンセルなら自分で取り直す。自分自身のキャンセルはそのまま伝える
+                if not inflight.cancelled():
+                    raise
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self._waiters[key] = 0
+        self._stats["leaders"] += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 待ち手がいない場合に "exception was never retrieved" を出さない
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._calls.pop(key, None)
+            self._record(key, self._waiters.pop(key, 0))
+
+    def _record(self, key: str, coalesced: int) -> None:
+        if coalesced <= 0:
+            return
+        self._recent[key] = self._recent.get(key, 0) + coalesced
+        self._stats["max_coalesced_per_key"] = max(self._stats["max_coalesced_per_key"], coalesced)
+        logger.info("singleflight_done name=%s key=%s coalesced=%d", self._name, key[:16], coalesced)
+
+    def stats(self) -> Dict[str, Any]:
+        """集約件数のカウンタを返す（/metrics 用）。recent_keys は直近のキーごとの集約数。"""
+        return {
+            **self._stats,
+            "inflight": len(self._calls),
+            "inflight_waiters": sum(self._waiters.values()),
+            "recent_keys": dict(self._recent.items()),
+        }
@@ -1,38 +1,474 @@
 """
-/route/generate 用のインプロセスTTLキャッシュ。
+/route/generate 用のレスポンスキャッシュ。
 同一条件の連続リクエスト時に Maps/Ranker/LLM を呼ばず即時レスポンスする。
+
+バックエンドは GENERATE_CACHE_BACKEND で切り替える。
+- memory: インプロセス TTLCache（デフォルト）
+- redis: ローカル TTLCache + Redis の2段構成。Cloud Run の複数インスタンス間でレスポンスを共有し、
+  リース付きロック（SET NX PX）で同一キーの生成をインスタンスをまたいで1本に集約する。
+
+オプションで以下の参照モードを持つ（デフォルト無効）。
+- stale-while-revalidate: TTL 切れ後も GENERATE_CACHE_STALE_TTL_SEC の間は古いレスポンスを即返し、裏で再生成する
+- 近傍再利用: 開始地点が半径 GENERATE_CACHE_SPATIAL_RADIUS_M 以内・距離差が許容内の生成結果を流用する
 """
 from __future__ import annotations
 
+import abc
 import asyncio
 import hashlib
 import json
 import logging
-from typing import Any, Dict, Optional
+import math
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
 
 from cachetools import TTLCache
 
 from app.schemas import GenerateRouteRequest
+from app.services import deadline
+from app.services.singleflight import SingleFlight
 from app.settings import settings
 
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # redis は GENERATE_CACHE_BACKEND=redis のときのみ必要
+    redis_asyncio = None
+
 logger = logging.getLogger(__name__)
 
-# キャッシュ本体（設定で有効時のみ使用、遅延初期化）
-_ttl_cache: Optional[TTLCache[str, Dict[str, Any]]] = None
-# key ごとの Lock（同一キーの並行リクエストで生成を1回に集約）
-_key_locks: Dict[str, asyncio.Lock] = {}
-_lock_for_locks: asyncio.Lock = asyncio.Lock()
+# 同一キーの並行リクエストで生成を1回に集約（完了したキーは保持しない）
+generate_flight: SingleFlight[Any] = SingleFlight("generate")
+
+# 自分が取得したリースのみ削除する（期限切れ後に他インスタンスが取り直したロックを消さない）
+_RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class CacheBackend(abc.ABC):
+    """生成キャッシュのバックエンド共通インターフェース。get / set を実装しないサブクラスは生成時に TypeError になる。"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        ...
+
+    async def acquire_lease(self, key: str) -> Optional[str]:
+        """
+        key の生成権（リース）を取得する。取得できればトークン、他が生成中なら None。
+        インスタンス内の集約は SingleFlight（generate_flight）が担うため、単一プロセスのバックエンドは常に取得できる。
+        """
+        return "local"
+
+    async def release_lease(self, key: str, token: str) -> None:
+        return None
+
+    async def lease_exists(self, key: str) -> bool:
+        """key のリースが残っているか（他が生成中か）。単一プロセスのバックエンドはリースを持たないので常に False。"""
+        return False
+
+    async def close(self) -> None:
+        return None
 
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
 
-def _get_cache() -> TTLCache[str, Dict[str, Any]]:
-    """設定に従いキャッシュを返す。無効時は None を返さず maxsize=0 相当にしないため、呼び出し元で GENERATE_CACHE_ENABLED を確認する。"""
-    global _ttl_cache
-    if _ttl_cache is None:
-        _ttl_cache = TTLCache(
-            maxsize=max(1, settings.GENERATE_CACHE_MAXSIZE),
-            ttl=settings.GENERATE_CACHE_TTL_SEC,
+
+class MemoryCacheBackend(CacheBackend):
+    """インプロセス TTLCache（インスタンス間では共有しない）。"""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int, ttl_sec: float) -> None:
+        self._cache: TTLCache[str, Dict[str, Any]] = TTLCache(maxsize=max(1, maxsize), ttl=ttl_sec)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._cache[key] = value
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "size": len(self._cache)}
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    ローカル TTLCache → Redis の2段で参照するバックエンド。
+    値は JSON を zlib 圧縮して保存し、Redis の取得結果はローカルにも載せる。
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        client: Any,
+        *,
+        ttl_sec: float,
+        local_maxsize: int,
+        local_ttl_sec: float,
+        lease_ms: int,
+        key_prefix: str = "firstdown:",
+    ) -> None:
+        self._redis = client
+        self._ttl_ms = max(1, int(ttl_sec * 1000))
+        self._local: TTLCache[str, Dict[str, Any]] = TTLCache(
+            maxsize=max(1, local_maxsize),
+            ttl=max(0.001, min(local_ttl_sec, ttl_sec)),
         )
-    return _ttl_cache
+        self._lease_ms = max(1, int(lease_ms))
+        self._prefix = key_prefix
+        self._release_script = client.register_script(_RELEASE_LEASE_SCRIPT)
+        self._stats: Dict[str, int] = {
+            "local_hits": 0,
+            "remote_hits": 0,
+            "misses": 0,
+            "errors": 0,
+            "leases_acquired": 0,
+            "leases_contended": 0,
+        }
+
+    def _data_key(self, key: str) -> str:
+        return f"{self._prefix}{key}"
+
+    def _lease_key(self, key: str) -> str:
+        return f"{self._prefix}lease:{key}"
+
+    @staticmethod
+    def _encode(value: Dict[str, Any]) -> bytes:
+        return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def _decode(raw: bytes) -> Dict[str, Any]:
+        return json.loads(zlib.decompress(raw).decode("utf-8"))
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        local = self._local.get(key)
+        if local is not None:
+            self._stats["local_hits"] += 1
+            return local
+        try:
+            raw = await self._redis.get(self._data_key(key))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("generate cache redis get error key=%s err=%s", key[:16], e)
+            return None
+        if raw is None:
+            self._stats["misses"] += 1
+            return None
+        value = self._decode(raw)
+        self._local[key] = value
+        self._stats["remote_hits"] += 1
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._local[key] = value
+        try:
+            await self._redis.set(self._data_key(key), self._encode(value), px=self._ttl_ms)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("generate cache redis set error key=%s err=%s", key[:16], e)
+
+    async def acquire_lease(self, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        try:
+            ok = await self._redis.set(self._lease_key(key), token, nx=True, px=self._lease_ms)
+        except Exception as e:
+            # Redis 障害時は集約を諦めて自インスタンスで生成する
+            self._stats["errors"] += 1
+            logger.warning("generate cache redis lease error key=%s err=%s", key[:16], e)
+            return token
+        if ok:
+            self._stats["leases_acquired"] += 1
+            return token
+        self._stats["leases_contended"] += 1
+        return None
+
+    async def release_lease(self, key: str, token: str) -> None:
+        try:
+            await self._release_script(keys=[self._lease_key(key)], args=[token])
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning("generate cache redis release error key=%s err=%s", key[:16], e)
+
+    async def lease_exists(self, key: str) -> bool:
+        try:
+            return bool(await self._redis.exists(self._lease_key(key)))
+        except Exception as e:
+            # 確認できなければ待つのをやめて自インスタンスで生成する
+            self._stats["errors"] += 1
+            logger.warning("generate cache redis lease check error key=%s err=%s", key[:16], e)
+            return False
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "local_size": len(self._local), **self._stats}
+
+
+_backend: Optional[CacheBackend] = None
+
+
+def _build_backend() -> CacheBackend:
+    kind = str(getattr(settings, "GENERATE_CACHE_BACKEND", "memory")).lower()
+    if kind == "redis":
+        if redis_asyncio is None:
+            logger.warning("GENERATE_CACHE_BACKEND=redis but redis is not installed; using memory backend")
+        elif not settings.GENERATE_CACHE_REDIS_URL:
+            logger.warning("GENERATE_CACHE_BACKEND=redis but GENERATE_CACHE_REDIS_URL is empty; using memory backend")
+        else:
+            client = redis_asyncio.from_url(
+                settings.GENERATE_CACHE_REDIS_URL,
+                socket_timeout=settings.GENERATE_CACHE_REDIS_TIMEOUT_SEC,
+                socket_connect_timeout=settings.GENERATE_CACHE_REDIS_TIMEOUT_SEC,
+            )
+            return RedisCacheBackend(
+                client,
+                ttl_sec=_storage_ttl_sec(),
+                local_maxsize=settings.GENERATE_CACHE_MAXSIZE,
+                local_ttl_sec=settings.GENERATE_CACHE_LOCAL_TTL_SEC,
+                lease_ms=int(settings.GENERATE_CACHE_LEASE_SEC * 1000),
+            )
+    return MemoryCacheBackend(
+        maxsize=settings.GENERATE_CACHE_MAXSIZE,
+        ttl_sec=_storage_ttl_sec(),
+    )
+
+
+def _storage_ttl_sec() -> float:
+    """バックエンドでの保持期間。SWR 有効時は stale 期間の分だけ長く保持し、鮮度は cached_at で判定する。"""
+    ttl = float(settings.GENERATE_CACHE_TTL_SEC)
+    if getattr(settings, "GENERATE_CACHE_SWR_ENABLED", False):
+        ttl += float(settings.GENERATE_CACHE_STALE_TTL_SEC)
+    return ttl
+
+
+def get_backend() -> CacheBackend:
+    """設定に従いバックエンドを返す（遅延初期化）。"""
+    global _backend
+    if _backend is None:
+        _backend = _build_backend()
+    return _backend
+
+
+def set_backend(backend: Optional[CacheBackend]) -> None:
+    """バックエンドを差し替える（テスト・ベンチマーク用。None で設定から作り直す）。"""
+    global _backend
+    _backend = backend
+
+
+async def close_backend() -> None:
+    """バックエンドの接続を閉じる（FastAPI lifespan の終了時に呼ぶ）。"""
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
+
+@dataclass
+class CacheLookup:
+    """cache_lookup の結果。kind は hit（新鮮な完全一致）/ stale（TTL 切れ）/ near_hit（近傍の流用）。"""
+
+    response: Dict[str, Any]
+    kind: str
+    key: str
+    age_sec: float
+
+
+_lookup_stats: Dict[str, int] = {"hit": 0, "near_hit": 0, "stale": 0, "miss": 0}
+
+_EARTH_RADIUS_M = 6371000.0
+_M_PER_DEG_LAT = 111320.0
+
+
+@dataclass(frozen=True)
+class _SpatialEntry:
+    signature: Tuple[Any, ...]
+    lat: float
+    lng: float
+    distance_km: float
+
+
+class _SpatialIndex:
+    """
+    キャッシュ済みレスポンスの開始地点を一様グリッドで引く索引（インプロセス、件数上限付き）。
+    セル幅は検索半径と同じにし、近傍検索は周囲のセルだけを調べる。
+    """
+
+    def __init__(self, cell_m: float, maxsize: int) -> None:
+        self._cell_deg = max(1.0, cell_m) / _M_PER_DEG_LAT
+        self._maxsize = max(1, maxsize)
+        self._entries: "OrderedDict[str, _SpatialEntry]" = OrderedDict()
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self._cell_deg), math.floor(lng / self._cell_deg))
+
+    def add(self, key: str, entry: _SpatialEntry) -> None:
+        self.remove(key)
+        self._entries[key] = entry
+        self._cells.setdefault(self._cell(entry.lat, entry.lng), set()).add(key)
+        while len(self._entries) > self._maxsize:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        cell = self._cell(entry.lat, entry.lng)
+        keys = self._cells.get(cell)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
+
+    def nearby(
+        self,
+        signature: Tuple[Any, ...],
+        lat: float,
+        lng: float,
+        distance_km: float,
+        radius_m: float,
+        distance_tolerance_km: float,
+    ) -> list[Tuple[float, str]]:
+        """条件に合うキーを (開始地点間の距離m, key) の近い順で返す。"""
+        lat_span = radius_m / _M_PER_DEG_LAT
+        lng_span = radius_m / (_M_PER_DEG_LAT * max(0.01, math.cos(math.radians(lat))))
+        c_lat0, c_lng0 = self._cell(lat - lat_span, lng - lng_span)
+        c_lat1, c_lng1 = self._cell(lat + lat_span, lng + lng_span)
+        found: list[Tuple[float, str]] = []
+        for ci in range(c_lat0, c_lat1 + 1):
+            for cj in range(c_lng0, c_lng1 + 1):
+                for key in self._cells.get((ci, cj), ()):
+                    entry = self._entries[key]
+                    if entry.signature != signature:
+                        continue
+                    if abs(entry.distance_km - distance_km) > distance_tolerance_km:
+                        continue
+                    d = _haversine_m(lat, lng, entry.lat, entry.lng)
+                    if d <= radius_m:
+                        found.append((d, key))
+        found.sort()
+        return found
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * _EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+_spatial_index: Optional[_SpatialIndex] = None
+
+
+def _get_spatial_index() -> _SpatialIndex:
+    global _spatial_index
+    if _spatial_index is None:
+        _spatial_index = _SpatialIndex(
+            cell_m=settings.GENERATE_CACHE_SPATIAL_RADIUS_M,
+            maxsize=settings.GENERATE_CACHE_SPATIAL_INDEX_MAXSIZE,
+        )
+    return _spatial_index
+
+
+def _spatial_signature(req: GenerateRouteRequest) -> Tuple[Any, ...]:
+    """近傍再利用で一致が必要な条件（開始地点・距離以外）。"""
+    lat_dec = getattr(settings, "GENERATE_CACHE_ROUND_LATLNG_DECIMALS", 5)
+    if req.end_location is not None:
+        e = (round(req.end_location.lat, lat_dec), round(req.end_location.lng, lat_dec))
+    else:
+        e = None
+    return (req.theme, bool(req.round_trip), e)
+
+
+def _wrap(response_dict: Dict[str, Any]) -> Dict[str, Any]:
+    return {"cached_at": time.time(), "response": response_dict}
+
+
+def _unwrap(value: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+    """保存値から (レスポンス辞書, 経過秒) を取り出す。"""
+    if "response" in value and "cached_at" in value:
+        return value["response"], max(0.0, time.time() - float(value["cached_at"]))
+    return value, 0.0
+
+
+async def cache_lookup(req: GenerateRouteRequest, key: str) -> Optional[CacheLookup]:
+    """
+    完全一致（新鮮）→ 完全一致（stale、SWR 有効時）→ 近傍（新鮮、近傍再利用有効時）の順に探す。
+    見つからなければ None。
+    """
+    if not getattr(settings, "GENERATE_CACHE_ENABLED", True):
+        return None
+    ttl = float(settings.GENERATE_CACHE_TTL_SEC)
+    try:
+        raw = await get_backend().get(key)
+    except Exception as e:
+        logger.warning("generate cache get error key=%s err=%s", key[:16], e)
+        raw = None
+    if raw is not None:
+        response, age = _unwrap(raw)
+        if age <= ttl:
+            _lookup_stats["hit"] += 1
+            return CacheLookup(response=response, kind="hit", key=key, age_sec=age)
+        stale_ttl = ttl + float(settings.GENERATE_CACHE_STALE_TTL_SEC)
+        if getattr(settings, "GENERATE_CACHE_SWR_ENABLED", False) and age <= stale_ttl:
+            _lookup_stats["stale"] += 1
+            return CacheLookup(response=response, kind="stale", key=key, age_sec=age)
+
+    if getattr(settings, "GENERATE_CACHE_SPATIAL_ENABLED", False):
+        near = await _lookup_near(req, key, ttl)
+        if near is not None:
+            _lookup_stats["near_hit"] += 1
+            return near
+
+    _lookup_stats["miss"] += 1
+    return None
+
+
+async def _lookup_near(req: GenerateRouteRequest, key: str, ttl: float) -> Optional[CacheLookup]:
+    index = _get_spatial_index()
+    candidates = index.nearby(
+        _spatial_signature(req),
+        req.start_location.lat,
+        req.start_location.lng,
+        float(req.distance_km),
+        float(settings.GENERATE_CACHE_SPATIAL_RADIUS_M),
+        float(settings.GENERATE_CACHE_SPATIAL_DISTANCE_TOLERANCE_KM),
+    )
+    for _, near_key in candidates:
+        if near_key == key:
+            continue
+        try:
+            raw = await get_backend().get(near_key)
+        except Exception as e:
+            logger.warning("generate cache get error key=%s err=%s", near_key[:16], e)
+            return None
+        if raw is None:
+            # バックエンド側で期限切れ・追い出し済み
+            index.remove(near_key)
+            continue
+        response, age = _unwrap(raw)
+        if age <= ttl:
+            return CacheLookup(response=response, kind="near_hit", key=near_key, age_sec=age)
+    return None
 
 
 def build_cache_key(req: GenerateRouteRequest) -> str:
@@ -65,35 +501,108 @@ def build_cache_key(req: GenerateRouteRequest) -> str:
     return "gen:v1:" + h
 
 
-async def _get_key_lock(key: str) -> asyncio.Lock:
-    """key 用の Lock を取得する（同一キーで並行リクエストを1本化するため）。"""
-    async with _lock_for_locks:
-        if key not in _key_locks:
-            _key_locks[key] = asyncio.Lock()
-        return _key_locks[key]
-
-
-def cache_get(key: str) -> Optional[Dict[str, Any]]:
-    """キャッシュからレスポンス辞書を取得する。ヒットしなければ None。"""
+async def cache_get(key: str) -> Optional[Dict[str, Any]]:
+    """キャッシュから新鮮な（TTL 内の）レスポンス辞書を取得する。ヒットしなければ None。"""
     if not getattr(settings, "GENERATE_CACHE_ENABLED", True):
         return None
     try:
-        cache = _get_cache()
-        return cache.get(key)
+        raw = await get_backend().get(key)
     except Exception as e:
         logger.warning("generate cache get error key=%s err=%s", key[:16], e)
         return None
+    if raw is None:
+        return None
+    response, age = _unwrap(raw)
+    if age > float(settings.GENERATE_CACHE_TTL_SEC):
+        return None
+    return response
 
 
-def cache_set(key: str, response_dict: Dict[str, Any]) -> None:
-    """レスポンス辞書をキャッシュに保存する。best-effort。"""
+async def cache_set(
+    key: str,
+    response_dict: Dict[str, Any],
+    req: Optional[GenerateRouteRequest] = None,
+) -> None:
+    """レスポンス辞書をキャッシュに保存する。req を渡すと近傍再利用の索引にも登録する。best-effort。"""
     if not getattr(settings, "GENERATE_CACHE_ENABLED", True):
         return
     try:
-        cache = _get_cache()
-        cache[key] = response_dict
+        await get_backend().set(key, _wrap(response_dict))
     except Exception as e:
         logger.warning("generate cache set error key=%s err=%s", key[:16], e)
+        return
+    if req is not None and getattr(settings, "GENERATE_CACHE_SPATIAL_ENABLED", False):
+        _get_spatial_index().add(
+            key,
+            _SpatialEntry(
+                signature=_spatial_signature(req),
+                lat=float(req.start_location.lat),
+                lng=float(req.start_location.lng),
+                distance_km=float(req.distance_km),
+            ),
+        )
+
+
+async def acquire_lease(key: str) -> Optional[str]:
+    """インスタンス間の生成権を取得する。他インスタンスが生成中なら None。"""
+    try:
+        return await get_backend().acquire_lease(key)
+    except Exception as e:
+        logger.warning("generate cache lease error key=%s err=%s", key[:16], e)
+        return "local"
+
+
+async def release_lease(key: str, token: str) -> None:
+    """acquire_lease で取得したリースを解放する。best-effort。"""
+    try:
+        await get_backend().release_lease(key, token)
+    except Exception as e:
+        logger.warning("generate cache release error key=%s err=%s", key[:16], e)
+
+
+async def wait_for_peer(key: str, budget: Optional[deadline.Deadline] = None) -> Optional[Dict[str, Any]]:
+    """
+    他インスタンスが生成中のキーについて、キャッシュに載るまで待つ。
+    GENERATE_CACHE_LEASE_WAIT_SEC 以内に載らなければ None（呼び出し元で自ら生成する）。
+    生成中のインスタンスのリースが消えたら（失敗・キャッシュしない結果で解放した、期限切れ）その時点で待つのをやめる。
+    budget（リクエストの期限）を渡すと、自分で生成する時間（DEADLINE_GENERATE_MIN_SEC）を残すところまでしか待たない。
+    """
+    wait_sec = float(settings.GENERATE_CACHE_LEASE_WAIT_SEC)
+    if budget is not None and budget.bounded:
+        wait_sec = min(wait_sec, budget.remaining() - float(settings.DEADLINE_GENERATE_MIN_SEC))
+    loop = asyncio.get_running_loop()
+    wait_until = loop.time() + wait_sec
+    while loop.time() < wait_until:
+        await asyncio.sleep(settings.GENERATE_CACHE_LEASE_POLL_SEC)
+        # リースを先に確認する（キャッシュに保存してから解放するので、消えた後の取得で結果を取りこぼさない）
+        try:
+            leased = await get_backend().lease_exists(key)
+        except Exception as e:
+            logger.warning("generate cache lease check error key=%s err=%s", key[:16], e)
+            leased = False
+        cached = await cache_get(key)
+        if cached is not None:
+            return cached
+        if not leased:
+            logger.info("generate cache peer lease released without result key=%s", key[:16])
+            return None
+    return None
+
+
+def cache_stats() -> Dict[str, Any]:
+    """バックエンドのカウンタと参照結果（hit / near_hit / stale / miss）を返す（/metrics 用）。"""
+    if _backend is None:
+        backend_stats: Dict[str, Any] = {
+            "backend": str(getattr(settings, "GENERATE_CACHE_BACKEND", "memory")).lower(),
+            "initialized": False,
+        }
+    else:
+        backend_stats = _backend.stats()
+    return {
+        **backend_stats,
+        "lookups": dict(_lookup_stats),
+        "spatial_index_size": len(_spatial_index) if _spatial_index is not None else 0,
+    }
 
 
 def cache_key_prefix(key: str, length: int = 8) -> str:
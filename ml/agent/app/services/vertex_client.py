@@ -0,0 +1,211 @@
+"""
+Vertex AI（Gemini）の generate_content 呼び出しの実行層。
+
+イベントループの既定スレッドプール（run_in_executor(None, ...)）は CPU 数＋4 本しかなく、
+ID Token 取得などとも共有しているため、負荷時には LLM 呼び出しがスレッドの空き待ちで詰まる。ここでは
+
+- VERTEX_CLIENT_MODE=async: SDK の generate_content_async（gRPC の非同期クライアント）で呼ぶ。
+  同時実行数は VERTEX_MAX_CONCURRENCY のセマフォで制限する
+- VERTEX_CLIENT_MODE=executor: VERTEX_MAX_CONCURRENCY 本の専用スレッドプールで同期 API を呼ぶ
+
+のどちらかで実行し、1回の呼び出しに VERTEX_CALL_TIMEOUT_SEC の期限をかける（期限はキュー待ちを含む）。
+呼び出し元のタスクがキャンセルされると呼び出しもキャンセルする（executor モードでは、まだスレッドが
+拾っていない呼び出しは実行しない。実行中のものは結果を捨てる）。
+
+キュー待ち（セマフォ・スレッドの空き待ち）とモデルの応答時間は分けて計測し、応答の usage_metadata の
+トークン数とあわせて stats() と collect_timings() で取り出せる。
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from app.services import deadline
+from app.settings import settings
+
+CLIENT_MODES = ("async", "executor")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+# セマフォはイベントループごとに作る（ベンチマーク等で asyncio.run を繰り返しても使えるように）
+_semaphores: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+
+_counters: Dict[str, int] = {
+    "calls": 0,
+    "ok": 0,
+    "errors": 0,
+    "timeouts": 0,
+    "cancelled": 0,
+    "skipped_cancelled": 0,
+    "tokens": 0,
+}
+_in_flight = 0
+_queue_wait_ms = {"last": 0.0, "max": 0.0, "total": 0.0, "n": 0}
+_model_ms = {"last": 0.0, "max": 0.0, "total": 0.0, "n": 0}
+
+# collect_timings() の中で行った呼び出しのキュー待ち・モデル時間・トークン数の合計
+_call_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("vertex_call_timings", default=None)
+
+
+class VertexDeadlineExceeded(TimeoutError):
+    """VERTEX_CALL_TIMEOUT_SEC 以内に応答が得られなかった。"""
+
+
+def client_mode() -> str:
+    mode = str(settings.VERTEX_CLIENT_MODE or "async").lower()
+    return mode if mode in CLIENT_MODES else "async"
+
+
+def _max_concurrency() -> int:
+    return max(1, int(settings.VERTEX_MAX_CONCURRENCY))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_max_concurrency(), thread_name_prefix="vertex-llm")
+        return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    entry = _semaphores.get(id(loop))
+    if entry is None or entry[0] is not loop:
+        entry = (loop, asyncio.Semaphore(_max_concurrency()))
+        _semaphores[id(loop)] = entry
+    return entry[1]
+
+
+def _record(stat: Dict[str, float], ms: float) -> None:
+    stat["last"] = ms
+    stat["max"] = max(stat["max"], ms)
+    stat["total"] += ms
+    stat["n"] += 1
+
+
+def _record_call(queue_wait_ms: float, model_ms: float) -> None:
+    _record(_queue_wait_ms, queue_wait_ms)
+    _record(_model_ms, model_ms)
+    timings = _call_timings.get()
+    if timings is not None:
+        timings["queue_wait_ms"] += queue_wait_ms
+        timings["model_ms"] += model_ms
+        timings["calls"] += 1
+
+
+def _record_tokens(resp: Any) -> None:
+    usage = getattr(resp, "usage_metadata", None)
+    tokens = int(getattr(usage, "total_token_count", 0) or 0)
+    _counters["tokens"] += tokens
+    timings = _call_timings.get()
+    if timings is not None:
+        timings["tokens"] += tokens
+
+
+async def _generate_async(model: Any, prompt: str, config: Any) -> Any:
+    t_enqueued = time.perf_counter()
+    async with _get_semaphore():
+        t_started = time.perf_counter()
+        try:
+            resp = await model.generate_content_async(prompt, generation_config=config)
+        finally:
+            _record_call((t_started - t_enqueued) * 1000.0, (time.perf_counter() - t_started) * 1000.0)
+    return resp
+
+
+async def _generate_in_executor(model: Any, prompt: str, config: Any) -> Any:
+    t_enqueued = time.perf_counter()
+    cancelled = threading.Event()
+    started_at: Dict[str, float] = {}
+
+    def run() -> Any:
+        if cancelled.is_set():
+            # 呼び出し元が待つのをやめた後にスレッドが空いた。モデルは呼ばない
+            _counters["skipped_cancelled"] += 1
+            return None
+        started_at["t"] = time.perf_counter()
+        return model.generate_content(prompt, generation_config=config)
+
+    future = asyncio.get_running_loop().run_in_executor(_get_executor(), run)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+    finally:
+        t_done = time.perf_counter()
+        t_started = started_at.get("t", t_done)
+        _record_call((t_started - t_enqueued) * 1000.0, (t_done - t_started) * 1000.0)
+
+
+async def generate_content(model: Any, prompt: str, config: Any, timeout_sec: Optional[float] = None) -> Any:
+    """
+    model.generate_content を期限付きで実行する。SDK の例外はそのまま送出する。
+    期限は timeout_sec（省略時は VERTEX_CALL_TIMEOUT_SEC）と、リクエスト全体の残り時間の短い方。
+
+    Raises:
+        VertexDeadlineExceeded: 期限（キュー待ちを含む）を過ぎた場合
+    """
+    global _in_flight
+    timeout = deadline.timeout(float(settings.VERTEX_CALL_TIMEOUT_SEC if timeout_sec is None else timeout_sec))
+    call = _generate_async if client_mode() == "async" else _generate_in_executor
+    _counters["calls"] += 1
+    _in_flight += 1
+    try:
+        resp = await asyncio.wait_for(call(model, prompt, config), timeout=timeout if timeout > 0 else None)
+    except asyncio.TimeoutError:
+        _counters["timeouts"] += 1
+        raise VertexDeadlineExceeded(f"vertex call exceeded {timeout:.1f}s") from None
+    except asyncio.CancelledError:
+        _counters["cancelled"] += 1
+        raise
+    except Exception:
+        _counters["errors"] += 1
+        raise
+    finally:
+        _in_flight -= 1
+    _counters["ok"] += 1
+    _record_tokens(resp)
+    return resp
+
+
+@contextlib.contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """この中（同じタスク）で行った呼び出しのキュー待ち・モデル時間（ms）、回数、トークン数を合計する。"""
+    timings = {"queue_wait_ms": 0.0, "model_ms": 0.0, "calls": 0, "tokens": 0}
+    token = _call_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _call_timings.reset(token)
+
+
+def shutdown() -> None:
+    """専用スレッドプールを止める（実行中の呼び出しは待たない）。"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def stats() -> Dict[str, Any]:
+    """呼び出し件数とキュー待ち・モデル時間（/metrics 用）。"""
+    return {
+        **_counters,
+        "mode": client_mode(),
+        "max_concurrency": _max_concurrency(),
+        "in_flight": _in_flight,
+        "queue_wait_ms_last": _queue_wait_ms["last"],
+        "queue_wait_ms_max": _queue_wait_ms["max"],
+        "queue_wait_ms_avg": _queue_wait_ms["total"] / _queue_wait_ms["n"] if _queue_wait_ms["n"] else 0.0,
+        "model_ms_last": _model_ms["last"],
+        "model_ms_max": _model_ms["max"],
+        "model_ms_avg": _model_ms["total"] / _model_ms["n"] if _model_ms["n"] else 0.0,
+    }
@@ -22,6 +22,7 @@ from google.api_core.exceptions import (
 from vertexai.generative_models import GenerationConfig, GenerativeModel
 
 from app.schemas import DescriptionResponse, TitleResponse
+from app.services import deadline, llm_cache, vertex_client
 from app.services.microcopy_postprocess import (
     normalize_description as _normalize_description,
     normalize_title as _normalize_title,
@@ -116,17 +117,17 @@ def _log_raw_response(raw: object) -> None:
             logger.warning("[Vertex LLM] raw.prompt_feedback=%s", repr(pf)[:cap])
 
 
-def _invoke_vertex_text_sync(
+async def _invoke_vertex_text_once(
     prompt: str,
     *,
     temperature: float,
     max_output_tokens: int,
 ) -> tuple[str, bool]:
     """
-    Vertex AI 公式 SDK で同期的にテキスト生成する。
+    Vertex AI 公式 SDK でテキスト生成する（実行方式・期限は vertex_client）。
     戻り値: (抽出したテキスト, リトライすべきか).
     - 成功: (text, False)
-    - 恒久エラー(404/403/InvalidArgument) or 空レスポンス: ("", False)
+    - 恒久エラー(404/403/InvalidArgument) or 空レスポンス or 期限切れ: ("", False)
     - 一時的エラー(429/503): ("", True)
     """
     model_name = settings.VERTEX_TEXT_MODEL
@@ -144,7 +145,10 @@ def _invoke_vertex_text_sync(
         top_k=top_k,
     )
     try:
-        resp = model.generate_content(prompt, generation_config=config)
+        resp = await vertex_client.generate_content(model, prompt, config)
+    except vertex_client.VertexDeadlineExceeded as e:
+        logger.warning("[Vertex LLM] deadline exceeded, skip retry: %s", e)
+        return ("", False)
     except NotFound:
         logger.warning("[Vertex LLM] NotFound (404), skip retry")
         return ("", False)
@@ -179,31 +183,27 @@ async def _invoke_vertex_text(
     max_output_tokens: int,
 ) -> str:
     """
-    Vertex AI 公式 SDK でテキスト生成（非同期ラップ）。
-    429/503 は最大1回だけ短いバックオフでリトライする。
+    Vertex AI 公式 SDK でテキスト生成する。
+    429/503 は最大1回だけ短いバックオフでリトライする。呼び出し元のタスクがキャンセルされると呼び出しも止まる。
     """
-    loop = asyncio.get_event_loop()
-    text, should_retry = await loop.run_in_executor(
-        None,
-        lambda: _invoke_vertex_text_sync(
-            prompt,
-            temperature=temperature,
-            max_output_tokens=max_output_tokens,
-        ),
+    text, should_retry = await _invoke_vertex_text_once(
+        prompt,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
     )
     if not should_retry:
         return text
-    # 0.3〜1.0秒のバックオフで1回だけリトライ
+    # 0.3〜1.0秒のバックオフで1回だけリトライ（リクエストの期限内に収まらなければ諦める）
     backoff = 0.3 + (random.random() * 0.7)
+    if not deadline.can_afford(backoff + float(settings.DEADLINE_LLM_MIN_SEC)):
+        logger.info("[Vertex LLM] skip retry (deadline)")
+        return ""
     logger.info("[Vertex LLM] retry after %.2fs (429/503)", backoff)
     await asyncio.sleep(backoff)
-    text2, _ = await loop.run_in_executor(
-        None,
-        lambda: _invoke_vertex_text_sync(
-            prompt,
-            temperature=temperature,
-            max_output_tokens=max_output_tokens,
-        ),
+    text2, _ = await _invoke_vertex_text_once(
+        prompt,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
     )
     return text2
 
@@ -494,7 +494,7 @@ async def generate_title_and_description(
     fallback_title = _fallback_title(theme, distance_km, duration_min, spots)
     fallback_desc = _fallback_summary(theme, distance_km, duration_min, spots)
 
-    try:
+    async def generate() -> Optional[tuple[str, str]]:
         logger.info(
             "[Vertex LLM Title+Summary] invoke max_output_tokens=%s temperature=%s",
             max_out,
@@ -507,11 +507,24 @@ async def generate_title_and_description(
         )
         if not text:
             logger.warning("[Vertex LLM Title+Summary] empty response")
-            return {"title": fallback_title, "description": fallback_desc}
-
+            return None
         parsed = _parse_title_description_json(text)
         if parsed is None:
             logger.warning("[Vertex LLM Title+Summary] JSON parse failed")
+        return parsed
+
+    # 同じプロンプト・生成パラメータの応答はキャッシュから返す（正規化は毎回この距離・所要時間で行う）
+    cache_key = llm_cache.build_key(
+        prompt,
+        model=str(settings.VERTEX_TEXT_MODEL or ""),
+        temperature=temperature,
+        max_output_tokens=max_out,
+        top_p=float(getattr(settings, "VERTEX_TOP_P", 0.95)),
+        top_k=int(getattr(settings, "VERTEX_TOP_K", 40)),
+    )
+    try:
+        parsed, cached = await llm_cache.get_or_generate(cache_key, generate)
+        if parsed is None:
             return {"title": fallback_title, "description": fallback_desc}
 
         raw_title, raw_desc = parsed
@@ -519,9 +532,10 @@ async def generate_title_and_description(
         description = _normalize_description(raw_desc, theme, distance_km, duration_min)
 
         logger.info(
-            "[LLM_RESULT] raw_length=%d normalized_length=%d fallback=false",
+            "[LLM_RESULT] raw_length=%d normalized_length=%d fallback=false cached=%s",
             len(raw_title) + len(raw_desc),
             len(title) + len(description),
+            str(cached).lower(),
         )
         return {"title": title, "description": description}
 
@@ -9,11 +9,30 @@ class Settings(BaseSettings):
     RANKER_URL: str = "https://ranker-203786374782.asia-northeast1.run.app"
     REQUEST_TIMEOUT_SEC: float = 10.0  # 一般的なリクエストのタイムアウト（秒）
     RANKER_TIMEOUT_SEC: float = 10.0  # Ranker APIのタイムアウト（秒）
+    REQUEST_DEADLINE_SEC: float = 8.0  # /route/generate 1リクエストの期限（秒、0 以下で無効）。各外部呼び出しのタイムアウトは残り時間で頭打ちにする
+    DEADLINE_RESERVE_SEC: float = 0.2  # 期限のうち応答の組み立て用に残しておく時間（秒）
+    DEADLINE_ROUTE_RETRY_MIN_SEC: float = 3.0  # 距離の再試行をするのに必要な残り時間（秒）
+    DEADLINE_PLACES_PHASE2_MIN_SEC: float = 1.5  # Places の二段目（テーマ別タイプ）の検索をするのに必要な残り時間（秒）
+    DEADLINE_LLM_MIN_SEC: float = 1.5  # タイトル・紹介文を生成するのに必要な残り時間（秒）。足りなければテンプレート
+    DEADLINE_GENERATE_MIN_SEC: float = 4.0  # 他インスタンスの生成結果を待った後、自分で生成するために残しておく時間（秒）
     LOG_LEVEL: str = "INFO"  # ログレベル（INFO/DEBUG/WARNING）
 
+    # HTTP 接続プール（上流ごとに分ける）
+    HTTP2_ENABLED: bool = True  # TLS の相手とは HTTP/2 で接続する（h2 が必要。未インストールなら HTTP/1.1）
+    HTTP_KEEPALIVE_EXPIRY_SEC: float = 30.0  # アイドル接続を残しておく時間（秒）
+    HTTP_ROUTES_MAX_CONNECTIONS: int = 40  # Routes / Route Matrix / Elevation 用プールの最大接続数
+    HTTP_ROUTES_MAX_KEEPALIVE: int = 20  # 同プールに残すアイドル接続数の上限
+    HTTP_PLACES_MAX_CONNECTIONS: int = 30  # Places 用プールの最大接続数
+    HTTP_PLACES_MAX_KEEPALIVE: int = 15  # 同プールに残すアイドル接続数の上限
+    HTTP_RANKER_MAX_CONNECTIONS: int = 20  # Ranker 用プールの最大接続数
+    HTTP_RANKER_MAX_KEEPALIVE: int = 10  # 同プールに残すアイドル接続数の上限
+    HTTP_WARMUP_CONNECTIONS: int = 2  # 起動時に上流ごとに張っておく接続数（0 で無効。HTTP/2 では1本に集約される）
+    HTTP_WARMUP_TIMEOUT_SEC: float = 2.0  # 起動時の接続のタイムアウト（秒）
+
     # Google Maps Platform
     MAPS_API_KEY: str = ""  # Google Maps APIキー
     MAPS_ROUTES_BASE: str = "https://routes.googleapis.com/directions/v2:computeRoutes"  # Routes APIエンドポイント
+    MAPS_ROUTE_MATRIX_BASE: str = "https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix"  # Route Matrix エンドポイント
     MAPS_PLACES_BASE: str = "https://places.googleapis.com/v1/places:searchNearby"  # Places APIエンドポイント
 
     # Vertex AI
@@ -25,11 +44,30 @@ class Settings(BaseSettings):
     VERTEX_TOP_P: float = 0.95  # Top-pサンプリングパラメータ
     VERTEX_TOP_K: int = 40  # Top-kサンプリングパラメータ
     VERTEX_FORBIDDEN_WORDS: str = ""  # 禁止ワード（カンマ区切り）
+    VERTEX_CLIENT_MODE: str = "async"  # async（SDK の generate_content_async）/ executor（専用スレッドプールで同期 API）
+    VERTEX_MAX_CONCURRENCY: int = 32  # 同時に投げる呼び出しの上限（executor モードではスレッド数）
+    VERTEX_CALL_TIMEOUT_SEC: float = 8.0  # 1回の呼び出しの期限（秒、空き待ちを含む。0 以下で無制限）
+    VERTEX_SPECULATIVE_ENABLED: bool = False  # 候補ルートが出そろった時点でタイトル・紹介文の生成を始める（Ranker と並行）
+    VERTEX_SPECULATIVE_TOP_K: int = 1  # 投機的に生成する候補数（距離のヒューリスティック上位。外れた分のトークンは無駄になる）
+    LLM_CACHE_ENABLED: bool = True  # タイトル・紹介文の応答キャッシュ（プロンプト＋生成パラメータのハッシュがキー）
+    LLM_CACHE_TTL_SEC: float = 21600.0  # 応答キャッシュの TTL（秒）
+    LLM_CACHE_MAXSIZE: int = 4096  # 応答キャッシュのローカル最大キー数（超過時は LRU で追い出し）
+    LLM_CACHE_VARIANTS: int = 3  # 1キーあたりにためる応答の数。たまるまではモデルを呼び、たまった後はランダムに返す
+    LLM_CACHE_REDIS_URL: str = ""  # 設定すると応答を Redis にも保存してインスタンス間で共有する（例: redis://10.0.0.3:6379/1）
+    LLM_CACHE_REDIS_TIMEOUT_SEC: float = 0.2  # 応答キャッシュの Redis 接続・コマンドタイムアウト（秒）
 
     # Places API（コスト最適化）
     PLACES_RADIUS_M: int = 300  # 検索半径（m）
     PLACES_MAX_RESULTS: int = 2  # 1地点あたりの最大件数
     PLACES_SAMPLE_POINTS_MAX: int = 1  # 検索地点数（サンプル点の上限）
+    PLACES_CACHE_ENABLED: bool = True  # Places 検索結果のインプロセスキャッシュ（候補間・リクエスト間で共有）
+    PLACES_CACHE_TTL_SEC: float = 900.0  # Places キャッシュの TTL（秒）
+    PLACES_CACHE_MAXSIZE: int = 2048  # Places キャッシュの最大エントリ数（超過時は LRU で追い出し）
+    PLACES_CACHE_ROUND_LATLNG_DECIMALS: int = 3  # キャッシュキー用の緯度・経度の丸め桁数（3桁 ≒ 100m）
+    POLYLINE_DECODE_CACHE_MAXSIZE: int = 256  # polyline デコード結果のメモ化件数（同一文字列の再デコードを省く）
+    SIMPLIFY_MODE: str = "douglas_peucker"  # nav_waypoints 用の簡略化方式（douglas_peucker / visvalingam）
+    SIMPLIFY_EPSILON_M: float = 20.0  # Douglas–Peucker の許容誤差（m）
+    SIMPLIFY_TARGET_POINTS: int = 10  # Visvalingam で残す点数
     PLACES_NAME_BLOCKLIST: str = (
         "セブン-イレブン,ファミリーマート,ローソン,ミニストップ,"
         "マクドナルド,モスバーガー,バーガーキング,ケンタッキー,"
@@ -43,10 +81,24 @@ class Settings(BaseSettings):
     MIN_ROUTES: int = 2  # 最低生成本数
     SCORE_THRESHOLD: float = 0.6  # 早期終了の閾値（暫定）
     CONCURRENCY: int = 2  # 外部APIの並列数
+    ROUTES_FANOUT_ENABLED: bool = True  # 目的地ごとの Routes API 呼び出しを同時に投げる（False で従来の逐次生成）
+    ROUTES_FANOUT_CONCURRENCY: int = 6  # ファンアウト時の Routes API 同時呼び出し数の上限
+    ROUTE_MATRIX_PRESCREEN_ENABLED: bool = False  # computeRouteMatrix の見積もり距離で目的地を事前に絞る（距離の再試行が多い場合だけ得になる。README 参照）
+    ROUTE_MATRIX_SAMPLE_LEGS: int = 1  # 迂回率を測るために行列 API で取得する区間数（出発地 → 最初の地点。課金される要素数。リクエストあたり1回）
+    ROUTE_MATRIX_MAX_ELEMENTS: int = 625  # computeRouteMatrix 1回あたりの要素数（origins × destinations）の上限
+    ROUTE_MATRIX_TOLERANCE_SLACK: float = 0.05  # 事前選別の許容誤差比率に足す余裕（見積もりと実経路の差を吸収）
+    FEATURES_CONCURRENCY: int = 5  # 特徴量計算（候補ごとの Places 検索）の同時実行数
+    FEATURES_CANDIDATE_TIMEOUT_SEC: float = 3.0  # 候補1本あたりの特徴量計算タイムアウト（秒、超過時は spot_type_diversity=0）
     ROUTE_DISTANCE_ERROR_RATIO_MAX: float = 0.3  # 目標距離の許容誤差比率
     ROUTE_DISTANCE_RETRY_MAX: int = 1  # 距離フィルタ後の再生成回数
     SHORT_DISTANCE_TARGET_RATIO: float = 0.7  # 短距離時の事前距離補正比率（配布確認用コメント）
     SHORT_DISTANCE_MAX_KM: float = 3.0  # 短距離補正の上限距離（km）
+    DISTANCE_CALIBRATION_ENABLED: bool = True  # 地域・形状ごとに学習した距離比率で経由地の距離を補正する
+    DISTANCE_CALIBRATION_PATH: str = ""  # 比率スナップショット（JSON / NDJSON）のパス。空ならインスタンス内のみで学習
+    DISTANCE_CALIBRATION_GEOHASH_PRECISION: int = 5  # 学習単位の geohash 桁数（5桁 ≒ 4.9km 四方）
+    DISTANCE_CALIBRATION_ALPHA: float = 0.2  # 比率の指数移動平均の重み（新しい観測の比重）
+    DISTANCE_CALIBRATION_MIN_SAMPLES: int = 3  # セルの比率を使う最低標本数（未満なら全セル共通の比率）
+    DISTANCE_CALIBRATION_MAXSIZE: int = 20000  # 保持する (セル, 形状) の最大数（超過時は更新が古いものから削除）
 
     # BigQuery
     BQ_DATASET: str = "firstdown_mvp"  # BigQueryデータセット名
@@ -54,15 +106,24 @@ class Settings(BaseSettings):
     BQ_TABLE_CANDIDATE: str = "route_candidate"  # 候補テーブル名
     BQ_TABLE_PROPOSAL: str = "route_proposal"  # 提案テーブル名
     BQ_TABLE_FEEDBACK: str = "route_feedback"  # フィードバックテーブル名
+    BQ_WRITER_ENABLED: bool = True  # BigQuery 書き込みをキューに積みバックグラウンドでまとめて送る
+    BQ_WRITER_BATCH_MAX_ROWS: int = 200  # 1回の insert_rows_json で送る最大行数（この行数たまると即フラッシュ）
+    BQ_WRITER_FLUSH_INTERVAL_SEC: float = 2.0  # キューのフラッシュ間隔（秒）
+    BQ_WRITER_MAX_QUEUE_ROWS: int = 10000  # テーブルごとのキュー上限（行）
+    BQ_WRITER_OVERFLOW_POLICY: str = "drop_oldest"  # キュー満杯時: drop_oldest / drop_newest / sync（呼び出し元で同期書き込み）
+    BQ_WRITER_MAX_RETRIES: int = 3  # 書き込み例外時の再送回数
+    BQ_WRITER_RETRY_BACKOFF_SEC: float = 0.5  # 再送の初回待ち時間（秒、指数バックオフ＋ジッター）
+    BQ_WRITER_DRAIN_TIMEOUT_SEC: float = 8.0  # シャットダウン時にキューを書き切るまでの最大待ち時間（秒）
 
     # 特徴量/バージョニング
-    FEATURES_VERSION: str = "mvp_v1"  # 特徴量のバージョン（モデルの互換性管理用）
+    FEATURES_VERSION: str = "mvp_v2"  # 特徴量のバージョン（モデルの互換性管理用）
     RANKER_VERSION: str = "rule_v1"  # Rankerのバージョン（モデル/ロジックの追跡用）
 
     # ルート近傍の見どころ抽出
     SPOT_MAX_DISTANCE_M: float = 30.0  # ルートからの最大距離（m）
     SPOT_MAX_DISTANCE_M_RELAXED: float = 60.0  # 緩和時の最大距離（m）
     SPOT_MAX_DISTANCE_M_FALLBACK: float = 120.0  # 追加緩和時の最大距離（m）
+    ROUTE_INDEX_CELL_M: float = 50.0  # ルート線分の空間インデックス（一様グリッド）のセル幅（m）
 
     # /route/generate インプロセスTTLキャッシュ（同一条件の連続リクエストで即時レスポンス）
     GENERATE_CACHE_ENABLED: bool = True
@@ -70,6 +131,19 @@ class Settings(BaseSettings):
     GENERATE_CACHE_MAXSIZE: int = 256
     GENERATE_CACHE_ROUND_LATLNG_DECIMALS: int = 5
     GENERATE_CACHE_ROUND_DISTANCE_DECIMALS: int = 1
+    GENERATE_CACHE_BACKEND: str = "memory"  # memory（インプロセス）/ redis（ローカル + Redis の2段、インスタンス間で共有）
+    GENERATE_CACHE_REDIS_URL: str = ""  # redis バックエンドの接続先（例: redis://10.0.0.3:6379/0）
+    GENERATE_CACHE_REDIS_TIMEOUT_SEC: float = 0.5  # Redis の接続・コマンドタイムアウト（秒）
+    GENERATE_CACHE_LOCAL_TTL_SEC: float = 30.0  # redis バックエンド時のローカル層の TTL（秒、GENERATE_CACHE_TTL_SEC が上限）
+    GENERATE_CACHE_LEASE_SEC: float = 30.0  # インスタンス間ロック（リース）の有効期限（秒）。生成中にプロセスが落ちても自動で外れる
+    GENERATE_CACHE_LEASE_WAIT_SEC: float = 20.0  # 他インスタンスの生成結果を待つ最大時間（秒）。超えたら自分で生成（リクエストの期限から DEADLINE_GENERATE_MIN_SEC を引いた時間までに縮める）
+    GENERATE_CACHE_LEASE_POLL_SEC: float = 0.25  # 他インスタンスの生成結果をポーリングする間隔（秒）
+    GENERATE_CACHE_SWR_ENABLED: bool = False  # TTL 切れのレスポンスを即返し、裏で再生成する（stale-while-revalidate）
+    GENERATE_CACHE_STALE_TTL_SEC: float = 600.0  # TTL 切れ後に stale として返してよい期間（秒）
+    GENERATE_CACHE_SPATIAL_ENABLED: bool = False  # 開始地点が近い生成結果を流用する（近傍再利用）
+    GENERATE_CACHE_SPATIAL_RADIUS_M: float = 150.0  # 近傍再利用の開始地点の許容半径（m）
+    GENERATE_CACHE_SPATIAL_DISTANCE_TOLERANCE_KM: float = 0.2  # 近傍再利用の目標距離の許容差（km）
+    GENERATE_CACHE_SPATIAL_INDEX_MAXSIZE: int = 4096  # 近傍検索用索引の最大件数
 
 
 settings = Settings()  # グローバル設定インスタンス
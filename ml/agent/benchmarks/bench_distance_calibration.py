@@ -0,0 +1,92 @@
+"""
+地域・形状ごとの距離補正のシミュレーション（Routes API は呼ばない）。
+
+街区の違いを「経由地をつないだ直線距離に対する実際の経路長の倍率」としてセルごと・形状ごとに乱数で与え、
+compute_route_dests が作った経由地セットの経路長を模擬する。補正なし（短距離の一律補正のみ）と
+DistanceCalibrator で学習しながら補正した場合とで、1試行目に距離フィルタを通る候補が1本以上ある割合を比較する。
+
+実行（ml/agent で）:
+    python -m benchmarks.bench_distance_calibration
+"""
+from __future__ import annotations
+
+import random
+from typing import Dict, List, Optional, Tuple
+
+from app.services import maps_routes_client
+from app.services.distance_calibration import CALIBRATED_LABELS, DistanceCalibrator
+
+# 東京・大阪・札幌・名古屋付近の開始地点（セルごとに街区の倍率が異なる想定）
+CITIES = [(35.681, 139.767), (34.702, 135.495), (43.062, 141.354), (35.170, 136.882)]
+TARGETS_KM = [1.0, 1.5, 2.0, 3.0, 5.0, 8.0]
+SHORT_MAX_KM = 3.0
+SHORT_RATIO = 0.7
+MAX_ROUTES = 5
+
+
+def _chain_km(start: Tuple[float, float], dest: Dict) -> float:
+    chain = maps_routes_client._dest_chain(start_lat=start[0], start_lng=start[1], dest=dest, round_trip=True)
+    return sum(maps_routes_client._haversine_km(a[0], a[1], b[0], b[1]) for a, b in zip(chain, chain[1:]))
+
+
+def _street_factors(rng: random.Random) -> Dict[Tuple[int, str], float]:
+    return {(c, label): rng.uniform(1.15, 1.7) for c in range(len(CITIES)) for label in CALIBRATED_LABELS}
+
+
+def _first_attempt_ok(
+    rng: random.Random,
+    factors: Dict[Tuple[int, str], float],
+    city: int,
+    target_km: float,
+    calibrator: Optional[DistanceCalibrator],
+) -> bool:
+    start = CITIES[city]
+    requested_km = target_km * SHORT_RATIO if target_km <= SHORT_MAX_KM else target_km
+    max_error = 0.2 if target_km <= SHORT_MAX_KM else 0.3
+    label_scales: Dict[str, float] = {}
+    if calibrator is not None:
+        ratios = calibrator.ratios_for(*start)
+        label_scales = {k: target_km / (r * requested_km) for k, r in ratios.items()}
+    dests = maps_routes_client.compute_route_dests(
+        request_id="bench",
+        start_lat=start[0],
+        start_lng=start[1],
+        distance_km=requested_km,
+        round_trip=True,
+        label_scales=label_scales or None,
+    )[:MAX_ROUTES]
+    ok = False
+    for dest in dests:
+        label = dest["label"]
+        # 経由地の置き方（幾何）から直線距離を求め、街区の倍率とノイズで実際の経路長を模擬する
+        observed_km = _chain_km(start, dest) * factors[(city, label)] * rng.uniform(0.92, 1.08)
+        if calibrator is not None:
+            calibrator.observe(*start, label, built_km=requested_km * label_scales.get(label, 1.0), observed_km=observed_km)
+        ok = ok or abs(observed_km - target_km) / target_km <= max_error
+    return ok
+
+
+def _simulate(calibrated: bool, n_requests: int, seed: int) -> List[bool]:
+    rng = random.Random(seed)
+    random.seed(seed)
+    factors = _street_factors(random.Random(1234))
+    calibrator = DistanceCalibrator(precision=5, alpha=0.2, min_samples=3) if calibrated else None
+    return [
+        _first_attempt_ok(rng, factors, rng.randrange(len(CITIES)), rng.choice(TARGETS_KM), calibrator)
+        for _ in range(n_requests)
+    ]
+
+
+def main() -> None:
+    n_requests = 2000
+    warmup = 200
+    for calibrated in (False, True):
+        results = _simulate(calibrated, n_requests, seed=7)
+        after_warmup = results[warmup:]
+        rate = sum(after_warmup) / len(after_warmup)
+        name = "calibrated" if calibrated else "uncalibrated (short ratio only)"
+        print(f"{name:<34} first-attempt acceptance={rate:6.1%} (requests {warmup + 1}..{n_requests})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+ルート生成グラフのレイテンシ内訳（直列グラフ vs DAG）。
+
+外部サービスは benchmarks.graph_stubs の遅延付きスタブに差し替え、BigQuery はバックグラウンド書き込みなし
+（insert_rows_json を呼び出し元で同期実行する設定）で動かす。直列グラフは DAG 化する前の辺の並びを再現したもので、
+BigQuery への書き込みも従来どおり同期で行う。
+
+ノードごとの実行区間（node_spans）から graph.latency_attribution でクリティカルパスを求め、
+応答時間・クリティカルパス長・クリティカルパス外に逃がせた時間を比較する。
+
+実行（ml/agent で）:
+    python -m benchmarks.bench_graph_critical_path
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import statistics
+from typing import Any, Dict, List, Optional
+
+from langgraph.graph import END, StateGraph
+
+from app import graph
+from app.services import bq_writer
+from benchmarks.graph_stubs import StubDelays, sample_request, stubbed_services
+
+# 直列グラフ（DAG 化前）の辺。条件分岐はどちらに進んでも直列のまま
+_LINEAR_CHAIN = [
+    "validate_request",
+    "log_request_bq",
+    "generate_candidates_routes",
+    "compute_features",
+    "score_by_ranker",
+    "select_best_route",
+    "sample_points_from_polyline",
+    "parallel_postprocess",
+    "simplify_polyline_to_waypoints",
+    "compute_quality",
+    "build_fallback_details",
+    "store_candidates_bq",
+    "store_proposal_bq",
+    "build_response",
+]
+
+
+def _build_linear_graph() -> Any:
+    g = StateGraph(graph.AgentState)
+    for name in _LINEAR_CHAIN + ["fallback_candidates", "fallback_ranking"]:
+        g.add_node(name, graph._timed_node(name, getattr(graph, name)))
+    g.set_entry_point(_LINEAR_CHAIN[0])
+    for a, b in zip(_LINEAR_CHAIN, _LINEAR_CHAIN[1:]):
+        if a in ("generate_candidates_routes", "score_by_ranker"):
+            continue
+        g.add_edge(a, b)
+    g.add_conditional_edges(
+        "generate_candidates_routes",
+        lambda s: "fallback_candidates" if s.get("routes_api_status") != "ok" else "compute_features",
+        ["fallback_candidates", "compute_features"],
+    )
+    g.add_edge("fallback_candidates", "compute_features")
+    g.add_conditional_edges(
+        "score_by_ranker",
+        lambda s: "fallback_ranking" if s.get("ranker_status") != "ok" else "select_best_route",
+        ["fallback_ranking", "select_best_route"],
+    )
+    g.add_edge("fallback_ranking", "select_best_route")
+    g.add_edge("build_response", END)
+    return g.compile()
+
+
+def _linear_predecessors() -> Dict[str, List[str]]:
+    preds = {b: [a] for a, b in zip(_LINEAR_CHAIN, _LINEAR_CHAIN[1:])}
+    preds["compute_features"] = ["generate_candidates_routes", "fallback_candidates"]
+    preds["select_best_route"] = ["score_by_ranker", "fallback_ranking"]
+    return preds
+
+
+async def _run(compiled: Any, n: int) -> List[Dict[str, Any]]:
+    out = []
+    for i in range(n):
+        state = graph._init_state(sample_request(i))
+        result = await compiled.ainvoke(state)
+        out.append(result["node_spans"])
+        await asyncio.sleep(0.1)  # スレッドに逃がした BigQuery 書き込みを次の計測に持ち越さない
+    return out
+
+
+def _report(name: str, runs: List[Dict[str, Any]], predecessors: Optional[Dict[str, List[str]]]) -> float:
+    reports = [graph.latency_attribution(spans, predecessors=predecessors) for spans in runs]
+    wall = statistics.median(spans["build_response"][1] for spans in runs)
+    critical = statistics.median(r["critical_path_ms"] for r in reports)
+    total = statistics.median(r["node_ms_total"] for r in reports)
+    print(f"{name}")
+    print(f"  wall (build_response end) p50 = {wall:7.0f} ms")
+    print(f"  critical path           p50 = {critical:7.0f} ms  ({' -> '.join(reports[-1]['critical_path'])})")
+    print(f"  sum of node time        p50 = {total:7.0f} ms")
+    off = reports[-1]["off_critical_path_ms"]
+    if off:
+        print(f"  off critical path (last run): {off}")
+    return wall
+
+
+def main() -> None:
+    logging.disable(logging.WARNING)
+    n = 8
+    with stubbed_services(StubDelays()):
+        # 直列グラフ: BigQuery 書き込みも従来どおり呼び出し元で同期実行
+        nowait = bq_writer.insert_rows_nowait
+        bq_writer.insert_rows_nowait = bq_writer.insert_rows
+        try:
+            linear_runs = asyncio.run(_run(_build_linear_graph(), n))
+        finally:
+            bq_writer.insert_rows_nowait = nowait
+        dag_runs = asyncio.run(_run(graph._route_graph, n))
+
+    linear = _report("linear graph", linear_runs, _linear_predecessors())
+    dag = _report("DAG", dag_runs, None)
+    print(f"wall time: {linear:.0f} ms -> {dag:.0f} ms ({(linear - dag) / linear:.1%} saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+ルート生成グラフの end-to-end ベンチマーク（外部サービスなし）。
+
+benchmarks.offline_services の代替サービス（Routes/Places のフィクスチャ、ローカル Ranker、偽 Vertex、
+インメモリ BigQuery）に遅延・失敗率を与え、graph.run_generate_graph を N 並列で流して次を出す。
+
+- ノードごとの所要時間（state の latency_ms）の p50 / p95 / p99
+- リクエスト全体の所要時間の p50 / p95 / p99 とスループット（req/s）
+- フォールバックの内訳と、各サービスへの呼び出し回数
+- メモリ確保（別パスで逐次に流し、tracemalloc のピークと、バッチ後に残ったブロック数。
+  Places キャッシュやインメモリ BigQuery に溜まった行も含む）
+
+実行（ml/agent で）:
+    python -m benchmarks.bench_offline_e2e
+    python -m benchmarks.bench_offline_e2e --requests 200 --concurrency 16 --latency vertex=900 --failure ranker=0.05
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import logging
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app import graph
+from app.schemas import GenerateRouteRequest
+from app.services import llm_cache, llm_speculation
+from benchmarks.offline_services import HarnessConfig, OfflineEnv, UpstreamProfile, local_ranker, offline_services
+
+_UPSTREAMS = ("routes", "matrix", "places", "ranker", "vertex", "bigquery")
+_THEMES = ("exercise", "think", "refresh", "nature")
+# 東京・大阪・札幌・名古屋付近
+_CITIES = ((35.681, 139.767), (34.702, 135.495), (43.062, 141.354), (35.170, 136.882))
+_DISTANCES_KM = (1.5, 2.0, 3.0, 5.0)
+
+
+class _RecordingGraph:
+    """コンパイル済みグラフの代わりに差し込み、ainvoke の最終状態を request_id ごとに残す。"""
+
+    def __init__(self, compiled: Any) -> None:
+        self._compiled = compiled
+        self.states: Dict[str, Dict[str, Any]] = {}
+
+    async def ainvoke(self, state: Any, *args: Any, **kwargs: Any) -> Any:
+        result = await self._compiled.ainvoke(state, *args, **kwargs)
+        self.states[result["request"].request_id] = result
+        return result
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._compiled, name)
+
+
+def build_request(i: int) -> GenerateRouteRequest:
+    """i 番目のリクエスト（開始地点をずらし、テーマ・距離・周回/片道を回す）。"""
+    lat, lng = _CITIES[i % len(_CITIES)]
+    lat += 0.003 * (i // len(_CITIES))
+    distance_km = _DISTANCES_KM[i % len(_DISTANCES_KM)]
+    round_trip = i % 5 != 4
+    # 片道の終了地点は北東方向、直線で目標距離の 3/4 程度
+    offset_deg = distance_km * 0.75 / 111.0 / 2 ** 0.5
+    return GenerateRouteRequest(
+        request_id=f"offline-{i}",
+        theme=_THEMES[i % len(_THEMES)],
+        distance_km=distance_km,
+        start_location={"lat": lat, "lng": lng},
+        end_location=None if round_trip else {"lat": lat + offset_deg, "lng": lng + offset_deg},
+        round_trip=round_trip,
+    )
+
+
+def _pct(values: Sequence[float]) -> str:
+    p50, p95, p99 = np.percentile(np.asarray(values, dtype=np.float64), [50, 95, 99])
+    return f"p50={p50:7.0f}  p95={p95:7.0f}  p99={p99:7.0f}"
+
+
+async def _run_batch(recorder: _RecordingGraph, start: int, n: int, concurrency: int) -> Dict[str, Any]:
+    sem = asyncio.Semaphore(concurrency)
+    e2e_ms: List[float] = []
+    errors: Counter = Counter()
+    responses = []
+
+    async def one(i: int) -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                responses.append(await graph.run_generate_graph(build_request(i)))
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                return
+            e2e_ms.append((time.perf_counter() - t0) * 1000.0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(start, start + n)))
+    return {"wall_sec": time.perf_counter() - t0, "e2e_ms": e2e_ms, "errors": errors, "responses": responses}
+
+
+async def _measure_allocations(recorder: _RecordingGraph, start: int, n: int) -> Dict[str, float]:
+    """逐次に n 件流し、1件ごとの tracemalloc ピークと、バッチ後に残ったブロック数を測る。"""
+    peaks: List[float] = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    try:
+        for i in range(start, start + n):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            await graph.run_generate_graph(build_request(i))
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - base) / 1024.0)
+        recorder.states.clear()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = after.compare_to(before, "filename")
+    return {
+        "peak_kib_p50": float(np.median(peaks)),
+        "peak_kib_max": float(max(peaks)),
+        "retained_blocks": float(sum(s.count_diff for s in retained)),
+        "retained_kib": sum(s.size_diff for s in retained) / 1024.0,
+    }
+
+
+def _report(result: Dict[str, Any], recorder: _RecordingGraph, env: OfflineEnv, concurrency: int) -> None:
+    states = list(recorder.states.values())
+    node_ms: Dict[str, List[float]] = {}
+    for state in states:
+        for node, ms in (state.get("latency_ms") or {}).items():
+            node_ms.setdefault(node, []).append(float(ms))
+    print("per-node latency_ms")
+    for node in sorted(node_ms, key=lambda k: -float(np.median(node_ms[k]))):
+        print(f"  {node:<34} n={len(node_ms[node]):4d}  {_pct(node_ms[node])}")
+
+    n_ok = len(result["e2e_ms"])
+    print(f"end-to-end (ms)                      n={n_ok:4d}  {_pct(result['e2e_ms'])}" if n_ok else "end-to-end: no successful requests")
+    print(f"throughput: {n_ok / result['wall_sec']:.2f} req/s (concurrency={concurrency}, wall={result['wall_sec']:.1f}s)")
+    if result["errors"]:
+        print(f"errors: {dict(result['errors'])}")
+    fallback = Counter(
+        reason
+        for r in result["responses"]
+        for reason in (r.meta.fallback_reason or "").split(",")
+        if reason
+    )
+    print(f"fallback reasons: {dict(fallback) or '-'}")
+    print(f"upstream calls: {env.fixtures.requests} vertex={env.vertex.calls}")
+    cache = llm_cache.stats()
+    print(
+        f"llm cache: hit_ratio={cache['hit_ratio']:.1%} hits={cache['hits']} coalesced={cache['coalesced']} "
+        f"misses={cache['misses']} fills={cache['fills']} keys={cache['size']}"
+    )
+    spec = llm_speculation.stats()
+    if spec["started"]:
+        print(
+            f"llm speculation: hit_ratio={spec['hit_ratio']:.1%} started={spec['started']} hits={spec['hits']} "
+            f"misses={spec['misses']} wasted={spec['wasted']} cancelled={spec['cancelled']} "
+            f"wasted_tokens={spec['wasted_tokens']}"
+        )
+
+
+async def _main(args: argparse.Namespace, config: HarnessConfig, ranker_url: str) -> None:
+    async with offline_services(config, ranker_url=ranker_url) as env:
+        recorder = _RecordingGraph(graph._route_graph)
+        graph._route_graph = recorder
+        try:
+            await _run_batch(recorder, start=-args.warmup, n=args.warmup, concurrency=args.concurrency)  # ウォームアップ
+            recorder.states.clear()
+            result = await _run_batch(recorder, start=0, n=args.requests, concurrency=args.concurrency)
+            _report(result, recorder, env, args.concurrency)
+            if args.alloc_requests > 0:
+                alloc = await _measure_allocations(recorder, start=args.requests, n=args.alloc_requests)
+                print(
+                    f"allocations (sequential, n={args.alloc_requests}): peak per request p50={alloc['peak_kib_p50']:.0f} KiB "
+                    f"max={alloc['peak_kib_max']:.0f} KiB, retained after batch {alloc['retained_blocks']:+.0f} blocks "
+                    f"({alloc['retained_kib']:+.0f} KiB)"
+                )
+        finally:
+            graph._route_graph = recorder._compiled
+    print(f"bigquery rows: {env.bigquery.row_counts()} insert failures={env.bigquery.failures}")
+
+
+def _parse_overrides(items: Optional[List[str]], option: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        if name not in _UPSTREAMS or not value:
+            raise SystemExit(f"{option} expects NAME=VALUE with NAME in {', '.join(_UPSTREAMS)}: {item!r}")
+        out[name] = float(value)
+    return out
+
+
+def _config_from_args(args: argparse.Namespace) -> HarnessConfig:
+    latency = _parse_overrides(args.latency, "--latency")
+    failure = _parse_overrides(args.failure, "--failure")
+    base = HarnessConfig()
+    profiles = {}
+    for name in _UPSTREAMS:
+        p: UpstreamProfile = getattr(base, name)
+        profiles[name] = UpstreamProfile(
+            latency_ms=latency.get(name, p.latency_ms),
+            jitter_ms=p.jitter_ms * args.jitter_scale,
+            failure_rate=failure.get(name, p.failure_rate),
+        )
+    return dataclasses.replace(base, seed=args.seed, fixtures_path=args.fixtures or "", **profiles)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40, help="計測するリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に流すリクエスト数")
+    parser.add_argument("--warmup", type=int, default=4, help="計測前に流すリクエスト数")
+    parser.add_argument("--alloc-requests", type=int, default=5, help="メモリ確保を測るリクエスト数（0 で省略）")
+    parser.add_argument("--latency", action="append", metavar="NAME=MS", help="サービスの基本遅延（ms）。繰り返し指定可")
+    parser.add_argument("--failure", action="append", metavar="NAME=RATE", help="サービスの失敗率（0〜1）。繰り返し指定可")
+    parser.add_argument("--jitter-scale", type=float, default=1.0, help="揺らぎの倍率（0 で遅延を固定）")
+    parser.add_argument("--fixtures", help="録画した Routes/Places 応答（NDJSON）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.ERROR), format="%(message)s", force=True)
+    config = _config_from_args(args)
+    with local_ranker() as ranker_url:
+        asyncio.run(_main(args, config, ranker_url))
+
+
+if __name__ == "__main__":
+    main()
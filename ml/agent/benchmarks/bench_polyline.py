@@ -0,0 +1,106 @@
+"""
+polyline デコード／エンコードのマイクロベンチマーク。
+
+徒歩ルート相当（1〜2k 点、1点あたり数m〜十数m間隔）の polyline を生成し、
+従来の逐次デコード・polyline ライブラリと polyline_codec を比較する。
+
+実行（ml/agent で）:
+    python -m benchmarks.bench_polyline
+"""
+from __future__ import annotations
+
+import math
+import random
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+import polyline as polyline_lib
+
+from app.services import polyline_codec
+
+
+def _walking_route(n_points: int, seed: int) -> List[Tuple[float, float]]:
+    """開始地点から少しずつ向きを変えながら歩く折れ線（周回ルート風）。"""
+    rng = random.Random(seed)
+    lat, lng = 35.6812 + rng.uniform(-0.05, 0.05), 139.7671 + rng.uniform(-0.05, 0.05)
+    heading = rng.uniform(0, 2 * math.pi)
+    points = []
+    for _ in range(n_points):
+        heading += rng.gauss(0.0, 0.25)
+        step_m = rng.uniform(3.0, 15.0)
+        lat += (step_m * math.cos(heading)) / 111320.0
+        lng += (step_m * math.sin(heading)) / (111320.0 * math.cos(math.radians(lat)))
+        points.append((round(lat, 5), round(lng, 5)))
+    return points
+
+
+def _decode_reference(encoded: str) -> List[Tuple[float, float]]:
+    """置き換え前の文字単位デコード（比較用）。"""
+    index = 0
+    lat = 0
+    lng = 0
+    coordinates: List[Tuple[float, float]] = []
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = 0
+            result = 0
+            while True:
+                if index >= length:
+                    return coordinates
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if (result & 1) else (result >> 1))
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append((lat / 1e5, lng / 1e5))
+    return coordinates
+
+
+def _bench(name: str, fn: Callable[[], object], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    median = statistics.median(samples)
+    print(f"  {name:<36} median={median:9.1f} us  p95={sorted(samples)[int(len(samples) * 0.95) - 1]:9.1f} us")
+    return median
+
+
+def main() -> None:
+    repeat = 200
+    for n_points in (1000, 2000):
+        routes = [_walking_route(n_points, seed) for seed in range(5)]
+        encoded = [polyline_lib.encode(r) for r in routes]
+        for e in encoded:
+            assert polyline_codec.decode(e) == _decode_reference(e)
+            assert polyline_codec.encode_array(polyline_codec.decode_array(e)) == e
+
+        print(f"{n_points} points ({len(encoded[0])} chars), {len(routes)} routes per iteration")
+        ref = _bench("decode reference (pure python)", lambda: [_decode_reference(e) for e in encoded], repeat)
+        _bench("decode polyline lib", lambda: [polyline_lib.decode(e) for e in encoded], repeat)
+
+        def _decode_cold() -> None:
+            polyline_codec.clear_cache()
+            for e in encoded:
+                polyline_codec.decode_array(e)
+
+        cold = _bench("decode_array (cold)", _decode_cold, repeat)
+        warm = _bench("decode_array (memoized)", lambda: [polyline_codec.decode_array(e) for e in encoded], repeat)
+        _bench("decode tuple-list wrapper (memoized)", lambda: [polyline_codec.decode(e) for e in encoded], repeat)
+        _bench("encode polyline lib", lambda: [polyline_lib.encode(r) for r in routes], repeat)
+        arrays = [polyline_codec.decode_array(e) for e in encoded]
+        _bench("encode_array", lambda: [polyline_codec.encode_array(a) for a in arrays], repeat)
+        print(f"  speedup vs reference: cold x{ref / cold:.1f}, memoized x{ref / warm:.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
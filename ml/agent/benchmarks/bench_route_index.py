@@ -0,0 +1,55 @@
+"""
+点→経路距離のマイクロベンチマーク（総当たり vs 線分グリッドインデックス）。
+
+10 km 超の徒歩ルート相当（数千点）とその周辺に散らばったスポット候補で、
+PathDistanceEngine（全点×全線分）と SegmentGridIndex（近傍セルのみ）を比較する。
+
+実行（ml/agent で）:
+    python -m benchmarks.bench_route_index
+"""
+from __future__ import annotations
+
+import random
+import statistics
+import time
+
+import numpy as np
+
+from app.services.path_distance import PathDistanceEngine, SegmentGridIndex
+from benchmarks.bench_polyline import _walking_route
+
+
+def _bench(name: str, fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e3)
+    median = statistics.median(samples)
+    print(f"  {name:<36} median={median:8.2f} ms")
+    return median
+
+
+def main() -> None:
+    repeat = 30
+    for n_points, n_spots in ((1000, 60), (3000, 200), (6000, 400)):
+        path = _walking_route(n_points, seed=1)
+        lat0, lng0 = np.asarray(path).mean(axis=0)
+        rng = random.Random(0)
+        spots = [(lat0 + rng.uniform(-0.01, 0.01), lng0 + rng.uniform(-0.01, 0.01)) for _ in range(n_spots)]
+
+        engine = PathDistanceEngine(path)
+        index = SegmentGridIndex(path, cell_m=50.0)
+        assert np.allclose(engine.distances_m(spots), index.distances_m(spots))
+
+        print(f"{n_points} points, {n_spots} spots, {index.n_cells} occupied cells")
+        _bench("build SegmentGridIndex", lambda: SegmentGridIndex(path, cell_m=50.0), repeat)
+        brute = _bench("brute force (all segments)", lambda: engine.distances_m(spots), repeat)
+        radius = _bench("index, within 120 m", lambda: index.distances_m(spots, max_distance_m=120.0), repeat)
+        exact = _bench("index, exact nearest", lambda: index.distances_m(spots), repeat)
+        print(f"  speedup vs brute force: within-radius x{brute / radius:.1f}, exact x{brute / exact:.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+折れ線簡略化と nav_waypoints 生成のマイクロベンチマーク。
+
+徒歩ルート相当の折れ線に加えて、重複点・往復（始点＝終点）・直線・ジグザグなどの固定パターンを
+コーパスにし、置き換え前の逐次実装（_simplify_reference / _nav_waypoints_reference）と時間を比較する。
+出力が一致することは test_simplify.py（同じコーパスと逐次実装を使う）で確認する。
+
+実行（ml/agent で）:
+    python -m benchmarks.bench_simplify
+"""
+from __future__ import annotations
+
+import random
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from app.schemas import LatLng
+from app.services import polyline, simplify
+from benchmarks.bench_polyline import _walking_route
+
+Point = Tuple[float, float]
+
+
+def _simplify_reference(points: List[Point], epsilon_m: float = 20.0) -> List[Point]:
+    """置き換え前の Douglas–Peucker（点ごとに _point_segment_distance_m を呼ぶ）。"""
+    if len(points) <= 2:
+        return points
+    keep = [False] * len(points)
+    keep[0] = True
+    keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        max_dist = -1.0
+        index = None
+        a = points[start]
+        b = points[end]
+        for i in range(start + 1, end):
+            d = polyline._point_segment_distance_m(points[i], a, b)
+            if d > max_dist:
+                max_dist = d
+                index = i
+        if index is not None and max_dist > epsilon_m:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return [p for i, p in enumerate(points) if keep[i]]
+
+
+def _haversine_latlng_m(a: LatLng, b: LatLng) -> float:
+    return simplify._haversine_pair_m(np.array([a.lat, a.lng]), np.array([b.lat, b.lng]))
+
+
+def _nav_waypoints_reference(waypoint_points: List[Point], start: Point, round_trip: bool) -> List[LatLng]:
+    """置き換え前の graph.simplify_polyline_to_waypoints の後半（LatLng のリストで処理）。"""
+    nav_waypoints = [LatLng(lat=float(lat), lng=float(lng)) for (lat, lng) in waypoint_points]
+    seen = set()
+    deduped: List[LatLng] = []
+    for wp in nav_waypoints:
+        key = (round(wp.lat, 6), round(wp.lng, 6))
+        if key in seen:
+            continue
+        seen.add(key)
+        deduped.append(wp)
+    max_points = 10
+    if len(deduped) > max_points:
+        trimmed: List[LatLng] = []
+        if len(nav_waypoints) >= 2:
+            for candidate in (nav_waypoints[0], nav_waypoints[-1]):
+                if len(trimmed) >= max_points:
+                    break
+                if candidate in trimmed:
+                    continue
+                trimmed.append(candidate)
+        for wp in deduped:
+            if len(trimmed) >= max_points:
+                break
+            if wp in trimmed:
+                continue
+            trimmed.append(wp)
+        deduped = trimmed[:max_points]
+    start_wp = LatLng(lat=float(start[0]), lng=float(start[1]))
+    start_key = (round(start_wp.lat, 6), round(start_wp.lng, 6))
+    out = [wp for wp in deduped if (round(wp.lat, 6), round(wp.lng, 6)) != start_key]
+    out.insert(0, start_wp)
+    out = out[:max_points]
+    if out:
+        kept = [out[0]]
+        for p in out[1:]:
+            if _haversine_latlng_m(kept[-1], p) <= 10.0:
+                continue
+            kept.append(p)
+        out = kept
+    if round_trip and out:
+        if _haversine_latlng_m(out[0], out[-1]) > 10.0:
+            if len(out) < max_points:
+                out.append(out[0])
+            else:
+                out[-1] = out[0]
+    return out
+
+
+def fixture_corpus() -> List[List[Point]]:
+    """比較用の折れ線コーパス（乱数ルート＋境界ケース）。"""
+    corpus: List[List[Point]] = []
+    for seed in range(40):
+        n = random.Random(seed).choice([3, 10, 50, 300, 1000, 2000])
+        corpus.append(_walking_route(n, seed))
+    base = _walking_route(400, 99)
+    corpus.append(base + base[::-1])  # 往復（始点＝終点、折り返し点の重複）
+    corpus.append(base + [base[0]])  # 周回で閉じる
+    corpus.append([p for p in base for _ in range(2)])  # 全点が2回ずつ重複
+    corpus.append([base[0]] * 5)  # 1点の繰り返し
+    corpus.append([base[0], base[1]])
+    corpus.append([(35.0 + i * 1e-4, 139.0) for i in range(200)])  # 直線
+    corpus.append([(35.0 + i * 1e-4, 139.0 + (i % 2) * 2e-4) for i in range(200)])  # ジグザグ
+    return corpus
+
+
+def _bench(name: str, fn: Callable[[], object], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e3)
+    median = statistics.median(samples)
+    print(f"  {name:<40} median={median:8.2f} ms")
+    return median
+
+
+def main() -> None:
+    repeat = 20
+    for n_points in (1000, 3000):
+        routes = [_walking_route(n_points, seed) for seed in range(5)]
+        arrays = [np.asarray(r, dtype=np.float64) for r in routes]
+        print(f"{n_points} points, {len(routes)} routes per iteration")
+        ref = _bench("douglas-peucker reference (pure python)", lambda: [_simplify_reference(r) for r in routes], repeat)
+        new = _bench("douglas_peucker_mask", lambda: [simplify.douglas_peucker_mask(a) for a in arrays], repeat)
+        _bench("visvalingam_mask (target 10)", lambda: [simplify.visvalingam_mask(a, 10) for a in arrays], repeat)
+        print(f"  speedup vs reference: x{ref / new:.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+グラフ1回分の実行で確保されるメモリ（tracemalloc）と、ノードが返す状態更新の大きさ。
+
+外部サービスは benchmarks.graph_stubs のスタブ（遅延 0）に差し替え、BigQuery 書き込みは呼び出し元で同期実行する。
+
+- peak: 1回の ainvoke の間に同時に確保されていたメモリの最大値（実行開始時点からの増分、tracemalloc）
+- update bytes: 全ノードが返した latency_ms / tools_used / fallback_reasons / errors の入れ物の大きさの合計
+  （sys.getsizeof）。ノードが状態を丸ごとコピーして返すと、ノード数に比例してここが増える
+- update entries: 同じく要素数の合計
+
+実行（ml/agent で）:
+    python -m benchmarks.bench_state_allocations
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import statistics
+import sys
+import tracemalloc
+from typing import Any, Dict, List
+
+from app import graph
+from app.services import bq_writer
+from benchmarks.graph_stubs import StubDelays, sample_request, stubbed_services
+
+# 状態の集計用フィールド（リクエスト中に各ノードが追記していくもの）
+_BOOKKEEPING_KEYS = ("latency_ms", "tools_used", "fallback_reasons", "errors")
+
+_update_totals: Dict[str, int] = {"bytes": 0, "entries": 0}
+
+
+def _counting_graph() -> Any:
+    """ノードが返した更新の大きさを数えるラッパーを挟んでグラフを組み直す。"""
+    timed_node = graph._timed_node
+
+    def counting_node(name: str, fn: graph.NodeFn) -> graph.NodeFn:
+        inner = timed_node(name, fn)
+
+        async def run(state: graph.AgentState) -> Dict[str, Any]:
+            update = await inner(state)
+            for key in _BOOKKEEPING_KEYS:
+                value = update.get(key)
+                if value is not None:
+                    _update_totals["bytes"] += sys.getsizeof(value)
+                    _update_totals["entries"] += len(value)
+            return update
+
+        run.__name__ = name
+        return run
+
+    graph._timed_node = counting_node
+    try:
+        return graph._build_graph().compile()
+    finally:
+        graph._timed_node = timed_node
+
+
+async def _measure(compiled: Any, i: int) -> Dict[str, float]:
+    state = graph._init_state(sample_request(i))
+    _update_totals.update(bytes=0, entries=0)
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    try:
+        await compiled.ainvoke(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_kib": (peak - base) / 1024.0,
+        "update_bytes": float(_update_totals["bytes"]),
+        "update_entries": float(_update_totals["entries"]),
+    }
+
+
+async def _run(n: int) -> List[Dict[str, float]]:
+    compiled = _counting_graph()
+    await compiled.ainvoke(graph._init_state(sample_request(-1)))  # ウォームアップ（import・キャッシュ）
+    return [await _measure(compiled, i) for i in range(n)]
+
+
+def main() -> None:
+    logging.disable(logging.WARNING)
+    n = 20
+    zero = StubDelays(routes_ms=0.0, places_ms=0.0, ranker_ms=0.0, vertex_ms=0.0, bq_ms=0.0)
+    with stubbed_services(zero):
+        nowait = bq_writer.insert_rows_nowait
+        bq_writer.insert_rows_nowait = bq_writer.insert_rows
+        try:
+            results = asyncio.run(_run(n))
+        finally:
+            bq_writer.insert_rows_nowait = nowait
+    for key, label in (
+        ("peak_kib", "peak traced memory per run (KiB)"),
+        ("update_bytes", "bookkeeping update bytes per run"),
+        ("update_entries", "bookkeeping update entries per run"),
+    ):
+        values = [r[key] for r in results]
+        print(f"{label:<36} p50={statistics.median(values):9.1f}  max={max(values):9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+グラフ全体を外部 API なしで動かすためのサービススタブ（ベンチマーク用）。
+
+Routes / Places / Ranker / Vertex AI / BigQuery の呼び出しを、指定した遅延のあとに
+それらしい値を返す関数に差し替える。経路は経由地をつないだ折れ線を細かく補間して polyline にする。
+
+    with stubbed_services(StubDelays(routes_ms=250)):
+        response = asyncio.run(graph.run_generate_graph(req))
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.schemas import GenerateRouteRequest
+from app.services import bq_writer, maps_routes_client, places_client, polyline_codec, ranker_client, vertex_llm
+
+
+@dataclass(frozen=True)
+class StubDelays:
+    """各サービス呼び出しの遅延（ms）。"""
+    routes_ms: float = 250.0
+    places_ms: float = 120.0
+    ranker_ms: float = 60.0
+    vertex_ms: float = 500.0
+    bq_ms: float = 40.0  # insert_rows_json（同期、スレッドまたは呼び出し元で実行される）
+
+
+def _densify(chain: List[Tuple[float, float]], step_m: float = 15.0) -> np.ndarray:
+    pts: List[Tuple[float, float]] = [chain[0]]
+    for a, b in zip(chain, chain[1:]):
+        d = maps_routes_client._haversine_km(a[0], a[1], b[0], b[1]) * 1000.0
+        n = max(1, int(d // step_m))
+        for i in range(1, n + 1):
+            t = i / n
+            pts.append((a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t))
+    return np.asarray(pts, dtype=np.float64)
+
+
+def _route_for(*, start_lat: float, start_lng: float, dest: Any, idx: int, round_trip: bool) -> Dict[str, Any]:
+    chain = maps_routes_client._dest_chain(start_lat=start_lat, start_lng=start_lng, dest=dest, round_trip=round_trip)
+    length_km = sum(maps_routes_client._haversine_km(a[0], a[1], b[0], b[1]) for a, b in zip(chain, chain[1:]))
+    return {
+        "route_id": f"route_{idx}",
+        "polyline": polyline_codec.encode_array(_densify(chain)),
+        "distance_km": length_km * 1.25,  # 街路の迂回を模した倍率
+        "duration_min": length_km * 1.25 * 15.0,
+        "has_stairs": False,
+        "elevation_gain_m": 0.0,
+    }
+
+
+@contextlib.contextmanager
+def stubbed_services(delays: Optional[StubDelays] = None, seed: int = 0) -> Iterator[StubDelays]:
+    """サービス関数をスタブに差し替え、抜けるときに元に戻す。"""
+    delays = delays or StubDelays()
+    rng = random.Random(seed)
+
+    async def compute_route_candidate(*, request_id, start_lat, start_lng, dest, idx, round_trip):
+        await asyncio.sleep(delays.routes_ms / 1000.0)
+        return _route_for(start_lat=start_lat, start_lng=start_lng, dest=dest, idx=idx, round_trip=round_trip)
+
+    async def search_spots(*, lat, lng, theme=None, radius_m=1500, max_results=5, **_: Any):
+        await asyncio.sleep(delays.places_ms / 1000.0)
+        out = []
+        for i in range(max_results):
+            angle = rng.uniform(0.0, 2.0 * math.pi)
+            r_deg = rng.uniform(0.0, radius_m) / 111_000.0
+            out.append({
+                "name": f"spot_{round(lat, 4)}_{round(lng, 4)}_{i}",
+                "type": rng.choice(["park", "cafe", "museum", "shrine", "bakery"]),
+                "place_id": f"p_{rng.getrandbits(32):08x}",
+                "lat": lat + r_deg * math.sin(angle),
+                "lng": lng + r_deg * math.cos(angle),
+            })
+        return out
+
+    async def rank_routes(request_id, routes):
+        await asyncio.sleep(delays.ranker_ms / 1000.0)
+        return [{"route_id": r["route_id"], "score": rng.random()} for r in routes], []
+
+    async def generate_title_and_description(*, theme, distance_km, duration_min, spots=None):
+        await asyncio.sleep(delays.vertex_ms / 1000.0)
+        return {"title": "川沿いをゆっくり歩く道", "description": "約%.1fkmの散歩道です。" % distance_km}
+
+    def insert_rows_sync(table, rows, row_ids=None):
+        time.sleep(delays.bq_ms / 1000.0)
+        return []
+
+    patches = [
+        (maps_routes_client, "compute_route_candidate", compute_route_candidate),
+        (places_client, "search_spots", search_spots),
+        (ranker_client, "rank_routes", rank_routes),
+        (vertex_llm, "generate_title_and_description", generate_title_and_description),
+        (bq_writer, "insert_rows_sync", insert_rows_sync),
+    ]
+    originals = [(mod, name, getattr(mod, name)) for mod, name, _ in patches]
+    from app.settings import settings
+
+    original_key = settings.MAPS_API_KEY
+    settings.MAPS_API_KEY = settings.MAPS_API_KEY or "stub"
+    for mod, name, fn in patches:
+        setattr(mod, name, fn)
+    try:
+        yield delays
+    finally:
+        for mod, name, fn in originals:
+            setattr(mod, name, fn)
+        settings.MAPS_API_KEY = original_key
+
+
+def sample_request(i: int = 0, distance_km: float = 3.0) -> GenerateRouteRequest:
+    """開始地点を少しずつずらしたリクエスト（キャッシュに当たらないように）。"""
+    return GenerateRouteRequest(
+        request_id=f"bench-{i}",
+        theme="nature",
+        distance_km=distance_km,
+        start_location={"lat": 35.6812 + 0.002 * i, "lng": 139.7671},
+        round_trip=True,
+    )
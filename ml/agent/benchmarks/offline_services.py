@@ -0,0 +1,421 @@
+"""
+ルート生成グラフを外部サービスなしで end-to-end に動かすためのローカル代替（ベンチマーク用）。
+
+graph_stubs がサービス関数そのものを差し替えるのに対し、こちらはクライアント実装（httpx・Vertex SDK 呼び出し・
+BigQuery 書き込みキュー）をそのまま通し、その先だけを置き換える。
+
+- Routes / Route Matrix / Places: httpx.MockTransport のフィクスチャサーバー。応答はリクエスト本文から決定的に作る
+  （同じリクエストには同じ応答）。録画した応答（NDJSON）を渡すと、一致するリクエストにはそれを返す
+- Ranker: ml/ranker のアプリを uvicorn でローカル起動し、RANKER_URL をそこに向ける（ID Token は取得しない）
+- Vertex AI: generate_content だけを持つ偽モデル（タイトル・説明文の JSON を返す）
+- BigQuery: insert_rows_json を受けて行をメモリに溜める偽クライアント（書き込みキューはそのまま動かす）
+
+各サービスに UpstreamProfile で遅延（基本値＋指数分布の揺らぎ）と失敗率を与えられる。
+
+    with local_ranker() as ranker_url:
+        async with offline_services(HarnessConfig(), ranker_url=ranker_url) as env:
+            response = await graph.run_generate_graph(req)
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from google.api_core.exceptions import ServiceUnavailable
+
+from app.services import bq_writer, http_client, maps_routes_client, polyline_codec, ranker_client, vertex_llm
+from app.settings import settings
+
+_RANKER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "ranker"))
+
+# Places の includedTypes がないときに返す種別
+_DEFAULT_PLACE_TYPES = ["park", "cafe", "museum", "shrine", "bakery", "library", "garden"]
+
+
+@dataclass(frozen=True)
+class UpstreamProfile:
+    """1サービス分の注入する遅延と失敗率。"""
+    latency_ms: float = 0.0  # 基本の遅延
+    jitter_ms: float = 0.0  # 揺らぎ（平均 jitter_ms の指数分布を足す。裾の長い遅延を模す）
+    failure_rate: float = 0.0  # 失敗させる割合（0〜1）
+
+
+@dataclass(frozen=True)
+class HarnessConfig:
+    """各サービスの遅延・失敗率（既定値は本番のおおよその中央値）。"""
+    routes: UpstreamProfile = UpstreamProfile(250.0, 80.0)
+    matrix: UpstreamProfile = UpstreamProfile(200.0, 60.0)
+    places: UpstreamProfile = UpstreamProfile(120.0, 40.0)
+    ranker: UpstreamProfile = UpstreamProfile(20.0, 10.0)  # ローカル Ranker の処理時間に上乗せする分
+    vertex: UpstreamProfile = UpstreamProfile(600.0, 200.0)
+    bigquery: UpstreamProfile = UpstreamProfile(40.0, 10.0)
+    seed: int = 0
+    fixtures_path: str = ""  # 録画した応答（NDJSON: {"url", "request", "status", "response"}）
+
+
+class _Injector:
+    """UpstreamProfile に従って遅延と失敗を引く（スレッドからも呼ばれるのでロックする）。"""
+
+    def __init__(self, seed: int) -> None:
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self, profile: UpstreamProfile) -> Tuple[float, bool]:
+        with self._lock:
+            delay = profile.latency_ms
+            if profile.jitter_ms > 0:
+                delay += self._rng.expovariate(1.0 / profile.jitter_ms)
+            failed = self._rng.random() < profile.failure_rate
+        return delay / 1000.0, failed
+
+
+def _stable_hash(obj: Any) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _unit(seed: str) -> float:
+    """文字列から [0, 1) の値を決定的に作る。"""
+    return int(hashlib.sha1(seed.encode("utf-8")).hexdigest()[:8], 16) / 0x100000000
+
+
+def _latlng(waypoint: Dict[str, Any]) -> Tuple[float, float]:
+    ll = waypoint.get("location", {}).get("latLng", {})
+    return float(ll["latitude"]), float(ll["longitude"])
+
+
+def _densify(chain: List[Tuple[float, float]], step_m: float = 15.0) -> List[Tuple[float, float]]:
+    pts = [chain[0]]
+    for a, b in zip(chain, chain[1:]):
+        d = maps_routes_client._haversine_km(a[0], a[1], b[0], b[1]) * 1000.0
+        n = max(1, int(d // step_m))
+        pts.extend((a[0] + (b[0] - a[0]) * i / n, a[1] + (b[1] - a[1]) * i / n) for i in range(1, n + 1))
+    return pts
+
+
+def _detour_factor(lat: float, lng: float) -> float:
+    """街路の迂回倍率。開始地点の約 1km セルごとに 1.15〜1.55 で決まる（距離補正が学習できるように）。"""
+    return 1.15 + 0.4 * _unit(f"{round(lat, 2)}:{round(lng, 2)}")
+
+
+def _routes_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    chain = [_latlng(body["origin"])]
+    chain += [_latlng(w) for w in body.get("intermediates") or []]
+    chain.append(_latlng(body["destination"]))
+    length_m = sum(maps_routes_client._haversine_km(a[0], a[1], b[0], b[1]) for a, b in zip(chain, chain[1:])) * 1000.0
+    distance_m = int(length_m * _detour_factor(*chain[0]))
+    return {
+        "routes": [{
+            "distanceMeters": distance_m,
+            "duration": f"{int(distance_m / 1.3)}s",  # 徒歩 約 4.7km/h
+            "polyline": {"encodedPolyline": polyline_codec.encode_array(_densify(chain))},
+        }]
+    }
+
+
+def _matrix_response(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    origins = [_latlng(o["waypoint"]) for o in body.get("origins") or []]
+    destinations = [_latlng(d["waypoint"]) for d in body.get("destinations") or []]
+    out = []
+    for i, o in enumerate(origins):
+        factor = _detour_factor(*o)
+        for j, d in enumerate(destinations):
+            km = maps_routes_client._haversine_km(o[0], o[1], d[0], d[1])
+            out.append({
+                "originIndex": i,
+                "destinationIndex": j,
+                "distanceMeters": int(km * 1000.0 * factor),
+                "status": {},
+                "condition": "ROUTE_EXISTS",
+            })
+    return out
+
+
+def _places_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    circle = body["locationRestriction"]["circle"]
+    lat = float(circle["center"]["latitude"])
+    lng = float(circle["center"]["longitude"])
+    radius_m = float(circle.get("radius") or 500.0)
+    types = body.get("includedTypes") or _DEFAULT_PLACE_TYPES
+    key = _stable_hash(body)
+    n = int(_unit(key) * (int(body.get("maxResultCount") or 5) + 1))
+    places = []
+    for i in range(n):
+        u = _unit(f"{key}:{i}")
+        v = _unit(f"{key}:{i}:r")
+        r_deg = radius_m * v / 111_000.0
+        place_type = types[int(u * len(types)) % len(types)]
+        places.append({
+            "id": f"fixture_{key[:10]}_{i}",
+            "displayName": {"text": f"{place_type}_{key[:6]}_{i}", "languageCode": "ja"},
+            "types": [place_type],
+            "location": {"latitude": lat + r_deg * (2.0 * u - 1.0), "longitude": lng + r_deg * (2.0 * v - 1.0)},
+        })
+    return {"places": places}
+
+
+class FixtureServer:
+    """Routes / Route Matrix / Places の応答を返し、それ以外（Ranker）は実際の HTTP に流す MockTransport。"""
+
+    def __init__(self, config: HarnessConfig, injector: _Injector) -> None:
+        self.config = config
+        self._injector = injector
+        self._passthrough = httpx.AsyncHTTPTransport()
+        self._recordings: Dict[Tuple[str, str], Tuple[int, Any]] = {}
+        self.requests: Dict[str, int] = {
+            "routes": 0,
+            "matrix": 0,
+            "matrix_elements": 0,  # 行列 API の課金単位（origins × destinations）
+            "places": 0,
+            "ranker": 0,
+            "replayed": 0,
+            "failed": 0,
+        }
+        if config.fixtures_path:
+            self.load_recordings(config.fixtures_path)
+
+    def load_recordings(self, path: str) -> int:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                key = (rec["url"], _stable_hash(rec["request"]))
+                self._recordings[key] = (int(rec.get("status", 200)), rec["response"])
+        return len(self._recordings)
+
+    def _upstream(self, url: str) -> Optional[str]:
+        if url == settings.MAPS_ROUTES_BASE:
+            return "routes"
+        if url == settings.MAPS_ROUTE_MATRIX_BASE:
+            return "matrix"
+        if url == settings.MAPS_PLACES_BASE:
+            return "places"
+        if url.startswith(settings.RANKER_URL):
+            return "ranker"
+        return None
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url.copy_with(query=None))
+        upstream = self._upstream(url)
+        if upstream is None:
+            return httpx.Response(404, json={"error": {"message": f"no fixture for {url}"}})
+        self.requests[upstream] += 1
+        delay, failed = self._injector.draw(getattr(self.config, upstream))
+        await asyncio.sleep(delay)
+        if failed:
+            self.requests["failed"] += 1
+            return httpx.Response(503, json={"error": {"code": 503, "status": "UNAVAILABLE"}})
+        if upstream == "ranker":
+            return await self._passthrough.handle_async_request(request)
+
+        body = json.loads(request.content or b"{}")
+        if upstream == "matrix":
+            self.requests["matrix_elements"] += len(body.get("origins") or []) * len(body.get("destinations") or [])
+        recorded = self._recordings.get((url, _stable_hash(body)))
+        if recorded is not None:
+            self.requests["replayed"] += 1
+            return httpx.Response(recorded[0], json=recorded[1])
+        if upstream == "routes":
+            return httpx.Response(200, json=_routes_response(body))
+        if upstream == "matrix":
+            return httpx.Response(200, json=_matrix_response(body))
+        return httpx.Response(200, json=_places_response(body))
+
+    async def aclose(self) -> None:
+        await self._passthrough.aclose()
+
+
+class _FakeVertexUsage:
+    def __init__(self, total_token_count: int) -> None:
+        self.total_token_count = total_token_count
+
+
+class _FakeVertexResponse:
+    def __init__(self, text: str, total_token_count: int = 0) -> None:
+        self.text = text
+        self.usage_metadata = _FakeVertexUsage(total_token_count)
+
+
+class FakeVertexModel:
+    """vertexai GenerativeModel の代わり。generate_content（executor モード）と generate_content_async（async モード）。"""
+
+    def __init__(self, profile: UpstreamProfile, injector: _Injector) -> None:
+        self._profile = profile
+        self._injector = injector
+        self.calls = 0
+
+    def generate_content(self, prompt: str, generation_config: Any = None) -> _FakeVertexResponse:
+        self.calls += 1
+        delay, failed = self._injector.draw(self._profile)
+        time.sleep(delay)
+        return self._respond(prompt, failed)
+
+    async def generate_content_async(self, prompt: str, generation_config: Any = None) -> _FakeVertexResponse:
+        self.calls += 1
+        delay, failed = self._injector.draw(self._profile)
+        await asyncio.sleep(delay)
+        return self._respond(prompt, failed)
+
+    def _respond(self, prompt: str, failed: bool) -> _FakeVertexResponse:
+        if failed:
+            raise ServiceUnavailable("injected failure")
+        key = _stable_hash(prompt)[:4]
+        text = json.dumps({
+            "title": f"ゆっくり歩く道 {key}",
+            "description": "無理のない距離で、景色を眺めながら歩けるルートです。途中で休める場所もあります。",
+        }, ensure_ascii=False)
+        # トークン数は日本語をおおむね1文字1トークンとして概算する
+        return _FakeVertexResponse(text, total_token_count=len(prompt) + len(text))
+
+
+class InMemoryBigQuery:
+    """bigquery.Client の代わり。insert_rows_json の行をテーブルごとに溜める。"""
+
+    project = "offline-bench"
+
+    def __init__(self, profile: UpstreamProfile, injector: _Injector) -> None:
+        self._profile = profile
+        self._injector = injector
+        self._lock = threading.Lock()
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.failures = 0
+
+    def insert_rows_json(self, table_id: str, rows: List[Dict[str, Any]], row_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        delay, failed = self._injector.draw(self._profile)
+        time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.failures += 1
+            raise ServiceUnavailable("injected failure")
+        json.dumps(rows)  # 本物のクライアントと同じく、送る前に JSON にできることを確かめる
+        with self._lock:
+            self.tables.setdefault(table_id.rsplit(".", 1)[-1], []).extend(rows)
+        return []
+
+    def row_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {table: len(rows) for table, rows in self.tables.items()}
+
+
+@dataclass
+class OfflineEnv:
+    """offline_services が差し込んだ代替サービス（件数の確認用）。"""
+    fixtures: FixtureServer
+    vertex: FakeVertexModel
+    bigquery: InMemoryBigQuery
+    patched_settings: Dict[str, Any] = field(default_factory=dict)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+@contextlib.contextmanager
+def local_ranker(startup_timeout_sec: float = 30.0) -> Iterator[str]:
+    """ml/ranker のアプリを uvicorn でローカル起動し、ベース URL を返す。"""
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=_RANKER_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + startup_timeout_sec
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"ranker exited during startup (code={proc.returncode})")
+            try:
+                if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("ranker did not become healthy")
+            time.sleep(0.2)
+        yield url
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+@contextlib.asynccontextmanager
+async def offline_services(config: HarnessConfig, *, ranker_url: str) -> AsyncIterator[OfflineEnv]:
+    """
+    代替サービスを差し込み、抜けるときに元に戻す（イベントループの中で使う）。
+    BigQuery 書き込みキューは本番と同じく起動し、抜けるときに書き切る。
+    """
+    injector = _Injector(config.seed)
+    env = OfflineEnv(
+        fixtures=FixtureServer(config, injector),
+        vertex=FakeVertexModel(config.vertex, injector),
+        bigquery=InMemoryBigQuery(config.bigquery, injector),
+    )
+    overrides = {
+        "MAPS_API_KEY": settings.MAPS_API_KEY or "offline",
+        "RANKER_URL": ranker_url,
+        "VERTEX_PROJECT": "offline-bench",
+        "VERTEX_LOCATION": settings.VERTEX_LOCATION or "us-central1",
+    }
+    env.patched_settings = {name: getattr(settings, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+    async def _no_token(audience: str) -> str:
+        return "offline"
+
+    model_name = settings.VERTEX_TEXT_MODEL
+    original = {
+        "client": http_client._http_client,
+        "get_token": ranker_client.get_token,
+        "vertex_init": vertex_llm._VERTEX_INIT_DONE,
+        "vertex_model": vertex_llm._VERTEX_MODEL_CACHE.get(model_name),
+        "bq_client": bq_writer._client,
+        "bq_writer": bq_writer._writer,
+    }
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(env.fixtures.handle),
+        timeout=httpx.Timeout(settings.REQUEST_TIMEOUT_SEC),
+    )
+    http_client.set_client(client)
+    ranker_client.get_token = _no_token
+    vertex_llm._VERTEX_INIT_DONE = True
+    vertex_llm._VERTEX_MODEL_CACHE[model_name] = env.vertex
+    bq_writer._client = env.bigquery
+    bq_writer._writer = bq_writer._build_writer()  # 統計を実行ごとに分ける
+    await bq_writer.start_writer()
+    try:
+        yield env
+    finally:
+        await bq_writer.stop_writer()
+        await client.aclose()
+        await env.fixtures.aclose()
+        http_client.set_client(original["client"])
+        ranker_client.get_token = original["get_token"]
+        vertex_llm._VERTEX_INIT_DONE = original["vertex_init"]
+        if original["vertex_model"] is None:
+            vertex_llm._VERTEX_MODEL_CACHE.pop(model_name, None)
+        else:
+            vertex_llm._VERTEX_MODEL_CACHE[model_name] = original["vertex_model"]
+        bq_writer._client = original["bq_client"]
+        bq_writer._writer = original["bq_writer"]
+        for name, value in env.patched_settings.items():
+            setattr(settings, name, value)
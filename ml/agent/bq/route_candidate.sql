@@ -2,6 +2,8 @@
 -- 実行例:
 --   bq query --use_legacy_sql=false < route_candidate.sql
 -- ※ データセット名を変更する場合は下記のテーブル参照を修正してください。
+-- 既存テーブルへの列追加（features_version=mvp_v2 以降。.github/workflows/deploy-agent.yml がデプロイ前に実行する）:
+--   ALTER TABLE `firstdown_mvp.route_candidate` ADD COLUMN IF NOT EXISTS backtrack_ratio FLOAT64;
 
 CREATE TABLE IF NOT EXISTS `firstdown_mvp.route_candidate` (
   event_ts TIMESTAMP,
@@ -23,6 +25,7 @@ CREATE TABLE IF NOT EXISTS `firstdown_mvp.route_candidate` (
   path_length_ratio FLOAT64,
   turn_count INT64,
   turn_density FLOAT64,
+  backtrack_ratio FLOAT64,
   theme_exercise INT64,
   theme_think INT64,
   theme_refresh INT64,
@@ -0,0 +1,101 @@
+"""
+/route/generate/stream の単体テスト: run_generate_graph をスタブにして、NDJSON のイベント順と
+キャッシュヒット時の再送、想定外の例外時のエラー行を確認する
+"""
+import json
+from typing import Any, Dict, List
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.schemas import GenerateRouteResponse
+from app.services import ttl_cache
+from app.settings import settings
+
+ROUTE = {
+    "route_id": "route-1",
+    "polyline": "_p~iF~ps|U_ulLnnqC",
+    "distance_km": 3.0,
+    "duration_min": 40,
+    "title": "皇居まわりの朝ラン",
+    "summary": "お堀沿いを一周するコースです。",
+    "spots": [{"name": "桜田門", "type": "tourist_attraction", "lat": 35.6776, "lng": 139.7525}],
+}
+
+
+def _request(request_id: str) -> Dict[str, Any]:
+    return {
+        "request_id": request_id,
+        "theme": "exercise",
+        "distance_km": 3.0,
+        "start_location": {"lat": 35.681, "lng": 139.767},
+        "round_trip": True,
+    }
+
+
+def _response(request_id: str) -> GenerateRouteResponse:
+    return GenerateRouteResponse(
+        request_id=request_id,
+        route=ROUTE,
+        meta={
+            "fallback_used": False,
+            "tools_used": ["maps_routes", "places", "vertex_llm"],
+            "route_quality": {"is_fallback": False, "distance_match": 1.0, "distance_error_km": 0.0},
+        },
+    )
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "GENERATE_CACHE_ENABLED", True)
+    ttl_cache.set_backend(ttl_cache.MemoryCacheBackend(maxsize=16, ttl_sec=60.0))
+    try:
+        # lifespan（上流クライアントの作成・ウォームアップ）は動かさない
+        yield TestClient(main.app)
+    finally:
+        ttl_cache.set_backend(None)
+
+
+def _stream(client: TestClient, request_id: str) -> List[Dict[str, Any]]:
+    resp = client.post("/route/generate/stream", json=_request(request_id))
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in resp.text.splitlines() if line]
+
+
+def test_stream_events_in_order_and_cache_hit_replays_once(client, monkeypatch):
+    calls: List[str] = []
+
+    async def fake_graph(req, on_event=None, budget=None):
+        calls.append(req.request_id)
+        response = _response(req.request_id)
+        # 途中経過は route → spots → text の順に届く
+        for item in main._progress_from_response(response):
+            on_event(item)
+        return response
+
+    monkeypatch.setattr(main, "run_generate_graph", fake_graph)
+
+    lines = _stream(client, "req-1")
+    assert [line["event"] for line in lines] == ["route", "spots", "text", "done"]
+    assert all(line["request_id"] == "req-1" for line in lines)
+    assert lines[0]["data"]["polyline"] == ROUTE["polyline"]
+    assert lines[-1]["data"]["route"]["title"] == ROUTE["title"]
+
+    # 同じ条件はキャッシュから返し、各イベントを1回ずつ補って送る
+    lines = _stream(client, "req-2")
+    assert calls == ["req-1"]
+    assert [line["event"] for line in lines] == ["route", "spots", "text", "done"]
+    assert lines[-1]["data"]["request_id"] == "req-2"
+
+
+def test_stream_unexpected_error_hides_detail(client, monkeypatch):
+    async def failing_graph(req, on_event=None, budget=None):
+        raise RuntimeError("upstream https://example.invalid/?key=secret")
+
+    monkeypatch.setattr(main, "run_generate_graph", failing_graph)
+
+    lines = _stream(client, "req-err")
+    assert [line["event"] for line in lines] == ["error"]
+    assert lines[0]["data"] == {"status_code": 500, "detail": "Internal Server Error"}
@@ -0,0 +1,62 @@
+"""
+点→経路の最短距離の一括計算（path_distance.PathDistanceEngine / SegmentGridIndex）が、
+逐次版の polyline.distance_to_path_m と一致するかのテスト
+"""
+import math
+import random
+from typing import List, Tuple
+
+import numpy as np
+import pytest
+
+from app.services import polyline
+from app.services.path_distance import PathDistanceEngine, SegmentGridIndex
+
+START = (35.681, 139.767)
+# 数 km 規模のルートで許す差（m）。局所平面への投影と線分ごとの投影の差
+TOLERANCE_M = 1.0
+
+
+def _random_path(rng: random.Random, n_points: int) -> List[Tuple[float, float]]:
+    """約 30〜150m 間隔で向きを少しずつ変えながら進む徒歩経路（数 km）"""
+    lat, lng = START
+    heading = rng.uniform(0.0, 2.0 * math.pi)
+    path = [(lat, lng)]
+    for _ in range(n_points - 1):
+        heading += rng.uniform(-0.8, 0.8)
+        step_m = rng.uniform(30.0, 150.0)
+        lat += step_m * math.cos(heading) / 111_320.0
+        lng += step_m * math.sin(heading) / (111_320.0 * math.cos(math.radians(lat)))
+        path.append((lat, lng))
+    return path
+
+
+def _random_spots(rng: random.Random, path: List[Tuple[float, float]], n: int) -> List[Tuple[float, float]]:
+    """経路の頂点のまわり ±約 1km に散らしたスポット"""
+    spots = []
+    for _ in range(n):
+        lat, lng = rng.choice(path)
+        spots.append((lat + rng.uniform(-0.01, 0.01), lng + rng.uniform(-0.01, 0.01)))
+    return spots
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_engine_matches_sequential(seed):
+    rng = random.Random(seed)
+    path = _random_path(rng, rng.randint(2, 80))
+    spots = _random_spots(rng, path, 50)
+    expected = np.array([polyline.distance_to_path_m(path, p) for p in spots])
+
+    engine = PathDistanceEngine(path)
+    assert np.max(np.abs(engine.distances_m(spots) - expected)) < TOLERANCE_M
+
+    index = SegmentGridIndex(path, cell_m=50.0)
+    assert np.allclose(index.distances_m(spots), engine.distances_m(spots))
+
+
+def test_single_point_path_uses_haversine():
+    rng = random.Random(0)
+    path = [START]
+    spots = _random_spots(rng, path, 10)
+    expected = np.array([polyline.distance_to_path_m(path, p) for p in spots])
+    assert np.allclose(PathDistanceEngine(path).distances_m(spots), expected)
@@ -0,0 +1,231 @@
+"""
+行列 API による事前選別（_prescreen_dests）の単体テスト: computeRouteMatrix をローカルのスタブで返す
+"""
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import httpx
+import pytest
+
+from app import graph
+from app.schemas import GenerateRouteRequest
+from app.services import http_client, maps_routes_client
+from app.settings import settings
+
+START = (35.681, 139.767)
+TARGET_KM = 3.0
+
+
+def _dest(i: int) -> Dict[str, float]:
+    # 片道の目的地。緯度をずらして区間を区別する
+    return {"lat": START[0] + 0.01 * (i + 1), "lng": START[1]}
+
+
+def _request() -> GenerateRouteRequest:
+    return GenerateRouteRequest(
+        request_id="test-prescreen",
+        theme="exercise",
+        distance_km=TARGET_KM,
+        start_location={"lat": START[0], "lng": START[1]},
+        end_location=_dest(0),
+        round_trip=False,
+    )
+
+
+@pytest.fixture
+def matrix_stub(monkeypatch):
+    """直線距離 × detour の徒歩距離で computeRouteMatrix に答えるスタブ。detour が None なら ROUTE_NOT_FOUND。"""
+    state: Dict[str, Any] = {"detour": 1.3, "status": 200, "calls": 0, "elements": 0}
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        assert request.url == httpx.URL(settings.MAPS_ROUTE_MATRIX_BASE)
+        state["calls"] += 1
+        if state["status"] != 200:
+            return httpx.Response(state["status"], json={"error": "stub"})
+        body = request.read()
+        payload = httpx.Response(200, content=body).json()
+        state["elements"] += len(payload["origins"]) * len(payload["destinations"])
+        elements = []
+        for oi, o in enumerate(payload["origins"]):
+            for di, d in enumerate(payload["destinations"]):
+                if state["detour"] is None:
+                    elements.append({"originIndex": oi, "destinationIndex": di, "condition": "ROUTE_NOT_FOUND"})
+                    continue
+                a, b = o["waypoint"]["location"]["latLng"], d["waypoint"]["location"]["latLng"]
+                km = maps_routes_client._haversine_km(a["latitude"], a["longitude"], b["latitude"], b["longitude"])
+                elements.append(
+                    {
+                        "originIndex": oi,
+                        "destinationIndex": di,
+                        "condition": "ROUTE_EXISTS",
+                        "distanceMeters": km * 1000.0 * state["detour"],
+                    }
+                )
+        return httpx.Response(200, json=elements)
+
+    monkeypatch.setattr(settings, "MAPS_API_KEY", "test")
+    monkeypatch.setattr(settings, "ROUTE_MATRIX_TOLERANCE_SLACK", 0.05)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    http_client.set_client(client)
+    try:
+        yield state
+    finally:
+        http_client.set_client(None)
+        asyncio.run(client.aclose())
+
+
+def _set_estimates(monkeypatch, km_by_index: Dict[int, Optional[float]]) -> None:
+    """目的地の番号 → 見積もり距離（km）を返すように estimate_dest_distances_km を差し替える"""
+    async def fake_estimates(**kwargs):
+        return [km_by_index[i] for i in range(len(kwargs["dests"]))]
+
+    monkeypatch.setattr(maps_routes_client, "estimate_dest_distances_km", fake_estimates)
+
+
+def _estimate(dests: List[Any], memo: Optional[Dict[str, float]] = None) -> List[Optional[float]]:
+    return asyncio.run(
+        maps_routes_client.estimate_dest_distances_km(
+            request_id="test-estimate",
+            start_lat=START[0],
+            start_lng=START[1],
+            dests=dests,
+            round_trip=False,
+            memo=memo,
+        )
+    )
+
+
+def _straight_km(dest: Dict[str, float]) -> float:
+    return maps_routes_client._haversine_km(START[0], START[1], dest["lat"], dest["lng"])
+
+
+def _prescreen(dests: List[Any], *, final_attempt: bool = False, keep_min: int = 2):
+    return asyncio.run(
+        graph._prescreen_dests(
+            req=_request(),
+            dests=dests,
+            error_base_km=TARGET_KM,
+            max_error_ratio=0.3,
+            keep_min=keep_min,
+            final_attempt=final_attempt,
+        )
+    )
+
+
+def test_prescreen_keeps_sets_within_tolerance(monkeypatch):
+    """見積もりが許容誤差（0.3 + 0.05）に収まるセットだけを元の順序で残す"""
+    dests = [_dest(i) for i in range(4)]
+    _set_estimates(monkeypatch, {0: 5.0, 1: 3.2, 2: 1.0, 3: 2.1})
+    kept, closest_km = _prescreen(dests)
+    assert kept == [dests[1], dests[3]]
+    assert closest_km == pytest.approx(3.2)
+
+
+def test_prescreen_keeps_sets_without_estimate(monkeypatch):
+    """見積もれなかったセットは落とさない（全経路を取得して判定する）"""
+    dests = [_dest(i) for i in range(3)]
+    _set_estimates(monkeypatch, {0: 6.0, 1: None, 2: 0.5})
+    kept, closest_km = _prescreen(dests)
+    assert kept == [dests[1]]
+    assert closest_km == pytest.approx(0.5)
+
+
+def test_prescreen_all_rejected_defers_to_retry(monkeypatch):
+    """最終試行でなければ、全セットが外れたら空を返し、最近傍の見積もりを補正に使わせる"""
+    dests = [_dest(i) for i in range(3)]
+    _set_estimates(monkeypatch, {0: 6.0, 1: 5.0, 2: 7.0})
+    kept, closest_km = _prescreen(dests)
+    assert kept == []
+    assert closest_km == pytest.approx(5.0)
+
+
+def test_prescreen_final_attempt_keeps_closest(monkeypatch):
+    """最終試行で全セットが外れたら、見積もりが目標に近い順に keep_min 件を残す"""
+    dests = [_dest(i) for i in range(4)]
+    _set_estimates(monkeypatch, {0: 7.0, 1: 5.0, 2: 9.0, 3: 6.0})
+    kept, _ = _prescreen(dests, final_attempt=True, keep_min=2)
+    assert kept == [dests[1], dests[3]]
+
+
+def test_estimate_bills_only_sampled_legs(matrix_stub):
+    """行列 API には出発地 → 最初の地点の区間を ROUTE_MATRIX_SAMPLE_LEGS 本だけ要求し、迂回率を直線距離に掛ける"""
+    dests = [_dest(i) for i in range(4)]
+    estimates = _estimate(dests)
+    assert matrix_stub["calls"] == 1
+    assert matrix_stub["elements"] == settings.ROUTE_MATRIX_SAMPLE_LEGS
+    for d, km in zip(dests, estimates):
+        assert km == pytest.approx(_straight_km(d) * 1.3, rel=1e-3)
+
+
+def test_estimate_reuses_detour_across_attempts(matrix_stub):
+    """memo に迂回率があれば行列 API を呼ばずに見積もる（同じリクエストの再試行）"""
+    memo: Dict[str, float] = {}
+    _estimate([_dest(0)], memo)
+    estimates = _estimate([_dest(1), _dest(2)], memo)
+    assert matrix_stub["calls"] == 1
+    assert memo["detour"] == pytest.approx(1.3, rel=1e-3)
+    assert estimates[1] == pytest.approx(_straight_km(_dest(2)) * 1.3, rel=1e-3)
+
+
+def test_estimate_without_route_returns_none(matrix_stub):
+    """迂回率が取れなければ全セット None（絞らない）"""
+    matrix_stub["detour"] = None
+    assert _estimate([_dest(i) for i in range(3)]) == [None, None, None]
+
+
+def test_prescreen_matrix_failure_keeps_all(matrix_stub):
+    """行列 API が失敗したら絞らずに全目的地を返す"""
+    dests = [_dest(i) for i in range(3)]
+    matrix_stub["status"] = 500
+    kept, closest_km = _prescreen(dests)
+    assert kept == dests
+    assert closest_km is None
+
+
+def test_prescreen_matrix_exception_keeps_all(monkeypatch):
+    """見積もりで例外が出ても（API キー未設定など）全目的地を返す"""
+    async def boom(**kwargs):
+        raise RuntimeError("stub")
+
+    monkeypatch.setattr(maps_routes_client, "estimate_dest_distances_km", boom)
+    dests = [_dest(i) for i in range(3)]
+    kept, closest_km = _prescreen(dests)
+    assert kept == dests
+    assert closest_km is None
+
+
+def test_all_rejected_retry_corrects_long_target(monkeypatch):
+    """短距離でなくても、全セットが外れた試行の次は見積もりの最近傍距離で目標を補正して経由地を作り直す"""
+    targets: List[float] = []
+
+    def fake_dests(**kwargs):
+        targets.append(kwargs["distance_km"])
+        return [_dest(i) for i in range(3)]
+
+    async def fake_estimates(**kwargs):
+        # 経由地の距離の 1.5 倍の経路になる地域
+        return [targets[-1] * 1.5 + 0.1 * i for i in range(len(kwargs["dests"]))]
+
+    async def fake_route(**kwargs):
+        return {"distance_km": targets[-1] * 1.5, "duration_min": 60.0, "polyline": "_p~iF~ps|U_ulLnnqC"}
+
+    monkeypatch.setattr(settings, "ROUTE_MATRIX_PRESCREEN_ENABLED", True)
+    monkeypatch.setattr(settings, "ROUTE_DISTANCE_RETRY_MAX", 1)
+    monkeypatch.setattr(settings, "DISTANCE_CALIBRATION_ENABLED", False)
+    monkeypatch.setattr(settings, "REQUEST_DEADLINE_SEC", 0.0)
+    monkeypatch.setattr(maps_routes_client, "compute_route_dests", fake_dests)
+    monkeypatch.setattr(maps_routes_client, "estimate_dest_distances_km", fake_estimates)
+    monkeypatch.setattr(maps_routes_client, "compute_route_candidate", fake_route)
+
+    req = GenerateRouteRequest(
+        request_id="test-prescreen-retry",
+        theme="exercise",
+        distance_km=6.0,
+        start_location={"lat": START[0], "lng": START[1]},
+        round_trip=True,
+    )
+    out = asyncio.run(graph.generate_candidates_routes(graph._init_state(req)))
+    assert targets[0] == pytest.approx(6.0)
+    # 1回目は見積もり 9.0km → 目標 6.0 × 6.0 / 9.0 = 4.0km で作り直す
+    assert targets[1] == pytest.approx(4.0)
+    assert out["candidates"]
@@ -0,0 +1,33 @@
+"""
+折れ線簡略化と nav_waypoints 生成（simplify.douglas_peucker_mask / build_nav_waypoints）が、
+置き換え前の逐次実装（benchmarks/bench_simplify.py の _simplify_reference / _nav_waypoints_reference）と
+同じ出力になるかのテスト。コーパスは乱数の徒歩ルートと境界ケース（重複点・往復・直線・ジグザグなど）
+"""
+import numpy as np
+import pytest
+
+from app.services import polyline, simplify
+from benchmarks.bench_simplify import _nav_waypoints_reference, _simplify_reference, fixture_corpus
+
+CORPUS = fixture_corpus()
+
+
+@pytest.mark.parametrize("points", CORPUS, ids=[f"route{i}-{len(p)}pts" for i, p in enumerate(CORPUS)])
+def test_douglas_peucker_matches_reference(points):
+    expected = _simplify_reference(points, 20.0)
+    arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    assert [tuple(p) for p in arr[simplify.douglas_peucker_mask(arr, 20.0)].tolist()] == expected
+    assert polyline.simplify_douglas_peucker(points, 20.0) == expected
+
+
+@pytest.mark.parametrize("points", CORPUS, ids=[f"route{i}-{len(p)}pts" for i, p in enumerate(CORPUS)])
+def test_nav_waypoints_match_reference(points):
+    simplified = _simplify_reference(points, 20.0)
+    picked = polyline.pick_waypoints(simplified, max_points=10)
+    arr = np.asarray(simplified, dtype=np.float64)
+    picked_arr = arr[simplify.pick_waypoint_indices(arr.shape[0], max_points=10)]
+    # 始点から始まる周回・片道と、始点が経路から少し離れた周回
+    for start, round_trip in ((points[0], True), (points[0], False), ((points[0][0] + 3e-4, points[0][1]), True)):
+        expected = [(wp.lat, wp.lng) for wp in _nav_waypoints_reference(picked, start, round_trip)]
+        actual = [tuple(p) for p in simplify.build_nav_waypoints(picked_arr, start, round_trip).tolist()]
+        assert actual == expected, (start, round_trip)
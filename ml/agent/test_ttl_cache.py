@@ -0,0 +1,158 @@
+"""
+生成キャッシュの Redis バックエンド（RedisCacheBackend）と他インスタンスの生成待ち（wait_for_peer）の単体テスト。
+Redis は fakeredis（リース解放の Lua スクリプト用に lupa も）で置き換え、同じサーバーに繋いだ2つのバックエンドを
+2インスタンスに見立てる
+"""
+import asyncio
+import json
+import time
+import zlib
+from typing import Any, Dict
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services import deadline, ttl_cache
+from app.settings import settings
+
+KEY = "gen:v1:test"
+RESPONSE: Dict[str, Any] = {"request_id": "r1", "route": {"title": "皇居ラン", "spots": []}, "meta": {"fallback_used": False}}
+
+
+def _backend(server: Any, **overrides: Any) -> ttl_cache.RedisCacheBackend:
+    opts: Dict[str, Any] = {"ttl_sec": 60.0, "local_maxsize": 16, "local_ttl_sec": 30.0, "lease_ms": 30000}
+    opts.update(overrides)
+    return ttl_cache.RedisCacheBackend(fakeredis.FakeAsyncRedis(server=server), **opts)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(settings, "GENERATE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_POLL_SEC", 0.02)
+    monkeypatch.setattr(settings, "GENERATE_CACHE_LEASE_WAIT_SEC", 2.0)
+    try:
+        yield fakeredis.FakeServer()
+    finally:
+        ttl_cache.set_backend(None)
+
+
+def test_set_get_roundtrip_compressed(server):
+    """Redis には zlib 圧縮した JSON で保存し、別インスタンスからも同じ辞書に戻せる"""
+    async def run():
+        a, b = _backend(server), _backend(server)
+        await a.set(KEY, RESPONSE)
+        raw = await fakeredis.FakeAsyncRedis(server=server).get(f"firstdown:{KEY}")
+        assert json.loads(zlib.decompress(raw).decode("utf-8")) == RESPONSE
+        assert await b.get(KEY) == RESPONSE
+        assert b.stats()["remote_hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_two_tier_lookup(server):
+    """Redis から取れた値はローカルにも載せ、ローカルの期限までは Redis を引かない"""
+    async def run():
+        a, b = _backend(server), _backend(server, local_ttl_sec=0.1)
+        assert await b.get(KEY) is None
+        await a.set(KEY, RESPONSE)
+        assert await b.get(KEY) == RESPONSE
+        await fakeredis.FakeAsyncRedis(server=server).delete(f"firstdown:{KEY}")
+        # Redis から消えてもローカルに残っている間はそのまま返す
+        assert await b.get(KEY) == RESPONSE
+        await asyncio.sleep(0.15)
+        assert await b.get(KEY) is None
+        assert {k: b.stats()[k] for k in ("local_hits", "remote_hits", "misses")} == {
+            "local_hits": 1,
+            "remote_hits": 1,
+            "misses": 2,
+        }
+
+    asyncio.run(run())
+
+
+def test_lease_acquire_and_expiry(server):
+    """SET NX PX のリースは1インスタンスだけが取れ、期限が切れると他が取り直せる"""
+    async def run():
+        a, b = _backend(server, lease_ms=100), _backend(server, lease_ms=100)
+        token = await a.acquire_lease(KEY)
+        assert token is not None
+        assert await b.acquire_lease(KEY) is None
+        assert await b.lease_exists(KEY)
+        pttl = await fakeredis.FakeAsyncRedis(server=server).pttl(f"firstdown:lease:{KEY}")
+        assert 0 < pttl <= 100
+        await asyncio.sleep(0.15)
+        assert not await b.lease_exists(KEY)
+        assert await b.acquire_lease(KEY) is not None
+        assert a.stats()["leases_acquired"] == 1
+        assert b.stats()["leases_contended"] == 1
+
+    asyncio.run(run())
+
+
+def test_release_refuses_foreign_token(server):
+    """リースの解放は自分のトークンのときだけ消す（期限切れ後に他が取り直したリースを消さない）"""
+    async def run():
+        a, b = _backend(server), _backend(server)
+        token = await a.acquire_lease(KEY)
+        await b.release_lease(KEY, "not-the-owner")
+        assert await b.lease_exists(KEY)
+        await a.release_lease(KEY, token)
+        assert not await b.lease_exists(KEY)
+
+    asyncio.run(run())
+
+
+def test_wait_for_peer_returns_peer_result(server):
+    """他インスタンスがキャッシュに保存してからリースを解放すると、その結果を受け取る"""
+    async def run():
+        peer, me = _backend(server), _backend(server)
+        ttl_cache.set_backend(me)
+        token = await peer.acquire_lease(KEY)
+        assert await me.acquire_lease(KEY) is None
+
+        async def generate() -> None:
+            await asyncio.sleep(0.1)
+            await peer.set(KEY, ttl_cache._wrap(RESPONSE))
+            await peer.release_lease(KEY, token)
+
+        task = asyncio.create_task(generate())
+        assert await ttl_cache.wait_for_peer(KEY) == RESPONSE
+        await task
+
+    asyncio.run(run())
+
+
+def test_wait_for_peer_stops_when_lease_released(server):
+    """結果を残さずにリースが消えたら、待ち時間の上限を待たずに諦める"""
+    async def run():
+        peer, me = _backend(server), _backend(server)
+        ttl_cache.set_backend(me)
+        token = await peer.acquire_lease(KEY)
+
+        async def fail() -> None:
+            await asyncio.sleep(0.1)
+            await peer.release_lease(KEY, token)
+
+        task = asyncio.create_task(fail())
+        t0 = time.monotonic()
+        assert await ttl_cache.wait_for_peer(KEY) is None
+        assert time.monotonic() - t0 < 1.0
+        await task
+
+    asyncio.run(run())
+
+
+def test_wait_for_peer_bounded_by_deadline(server, monkeypatch):
+    """リクエストの期限を渡すと、自分で生成する時間（DEADLINE_GENERATE_MIN_SEC）を残すところまでしか待たない"""
+    monkeypatch.setattr(settings, "DEADLINE_GENERATE_MIN_SEC", 0.1)
+
+    async def run():
+        peer, me = _backend(server), _backend(server)
+        ttl_cache.set_backend(me)
+        await peer.acquire_lease(KEY)
+        budget = deadline.Deadline(0.3)
+        assert await ttl_cache.wait_for_peer(KEY, budget) is None
+        assert 0.05 < budget.remaining() <= 0.15
+
+    asyncio.run(run())
@@ -1,5 +1,9 @@
 from __future__ import annotations
 
+import logging
+import queue
+import threading
+import time
 from datetime import datetime, timezone
 from typing import Any, Dict, Iterable, List, Optional
 
@@ -7,6 +11,8 @@ from google.cloud import bigquery
 
 from app.settings import settings
 
+logger = logging.getLogger(__name__)
+
 
 class BigQueryRankResultLogger:
     """rank_result へのログ書き込み（失敗しても例外は上げない）"""
@@ -16,15 +22,26 @@ class BigQueryRankResultLogger:
         project: Optional[str] = None,
         dataset: Optional[str] = None,
         table: Optional[str] = None,
+        client: Optional[bigquery.Client] = None,
     ) -> None:
         self._project = project or settings.BQ_PROJECT
         self._dataset = dataset or settings.BQ_DATASET
         self._table = table or settings.BQ_RANK_RESULT_TABLE
-        self._client = bigquery.Client(project=self._project) if self._project else bigquery.Client()
+        # クライアントは初回書き込み時に1度だけ作成して使い回す（テストでは差し替え可能）
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self) -> bigquery.Client:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = bigquery.Client(project=self._project) if self._project else bigquery.Client()
+        return self._client
 
     def log_rank_result(self, rows: Iterable[Dict[str, Any]]) -> None:
-        table_id = f"{self._client.project}.{self._dataset}.{self._table}"
-        errors = self._client.insert_rows_json(table_id, list(rows))
+        table_id = f"{self.client.project}.{self._dataset}.{self._table}"
+        errors = self.client.insert_rows_json(table_id, list(rows))
         if errors:
             raise RuntimeError(f"BigQuery insert error: {errors}")
 
@@ -53,3 +70,138 @@ class BigQueryRankResultLogger:
                 }
             )
         return rows
+
+
+class RankResultWriter:
+    """
+    rank_result 行をキューに積み、バックグラウンドスレッドでまとめて書き込む。
+
+    /rank のリクエストスレッドでは BigQuery を待たない。キュー満杯時は新しい行を捨て、
+    捨てた行数・書き込みに失敗した行数をカウンタに残す。
+    """
+
+    def __init__(
+        self,
+        bq_logger: BigQueryRankResultLogger,
+        batch_max_rows: int = 200,
+        flush_interval_s: float = 1.0,
+        max_queue_rows: int = 5000,
+    ) -> None:
+        self._bq_logger = bq_logger
+        self._batch_max_rows = max(1, int(batch_max_rows))
+        self._flush_interval_s = max(0.01, float(flush_interval_s))
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max(1, int(max_queue_rows)))
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            "enqueued_rows": 0,
+            "dropped_rows": 0,
+            "written_rows": 0,
+            "failed_rows": 0,
+            "flushes": 0,
+        }
+        self._last_flush_ms = 0
+
+    def _incr(self, name: str, value: int) -> None:
+        with self._counters_lock:
+            self._counters[name] += value
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="rank-result-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        """キューに残った行を書き切ってからスレッドを止める。"""
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=timeout_s)
+            if thread.is_alive():
+                logger.warning("rank_result writer did not drain in %.1fs (pending=%d)", timeout_s, self._queue.qsize())
+        self._thread = None
+
+    def submit(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """行をキューに積む（ブロックしない）。未起動なら起動する。"""
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+                self._incr("enqueued_rows", 1)
+            except queue.Full:
+                self._incr("dropped_rows", 1)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stop_event.is_set():
+                return
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self._flush_interval_s
+        while len(batch) < self._batch_max_rows:
+            if self._stop_event.is_set():
+                # 停止時は待たずにキューの残りを取り出す
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        start = time.perf_counter()
+        try:
+            self._bq_logger.log_rank_result(batch)
+            self._incr("written_rows", len(batch))
+        except Exception:
+            self._incr("failed_rows", len(batch))
+            logger.exception("Failed to write rank_result to BigQuery (rows=%d)", len(batch))
+        finally:
+            self._incr("flushes", 1)
+            self._last_flush_ms = int((time.perf_counter() - start) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counters_lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "queue_depth": self._queue.qsize(),
+            "last_flush_ms": self._last_flush_ms,
+            "running": self._thread is not None and self._thread.is_alive(),
+        }
+
+
+_writer: Optional[RankResultWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_rank_result_writer() -> RankResultWriter:
+    """プロセス共通の RankResultWriter を返す（BigQuery クライアントも共有）。"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = RankResultWriter(
+                    BigQueryRankResultLogger(),
+                    batch_max_rows=settings.BQ_LOG_BATCH_MAX_ROWS,
+                    flush_interval_s=settings.BQ_LOG_FLUSH_INTERVAL_S,
+                    max_queue_rows=settings.BQ_LOG_MAX_QUEUE_ROWS,
+                )
+    return _writer
@@ -1,24 +1,42 @@
 from __future__ import annotations
-from typing import Dict, Any
+from contextlib import asynccontextmanager
+from typing import Annotated, Dict, Any, Optional
 import logging
 import uuid
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from app.schemas import RankRequest, RankResponse, ScoreItem
 from app.settings import settings
 from app.model_scoring import ModelScorer
-from app.bq_logger import BigQueryRankResultLogger
+from app.bq_logger import BigQueryRankResultLogger, get_rank_result_writer
 
 logger = logging.getLogger(__name__)
-app = FastAPI(title="firstdown Ranker API", version="1.0.0")
 model_scorer = ModelScorer()
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    writer = get_rank_result_writer()
+    writer.start()
+    yield
+    # シャットダウン時にキューに残った rank_result を書き切る
+    writer.stop(timeout_s=settings.BQ_LOG_DRAIN_TIMEOUT_S)
+
+
+app = FastAPI(title="firstdown Ranker API", version="1.0.0", lifespan=lifespan)
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics():
+    """rank_result 書き込みキューのカウンタ（運用・負荷試験用）"""
+    return {"rank_result_writer": get_rank_result_writer().stats()}
+
+
 def _calculate_score(features: Dict[str, Any]) -> tuple[float, Dict[str, float]]:
     """
     ルールベーススコアリング: 距離乖離 / loop closure / POI数を考慮
@@ -100,7 +118,10 @@ def _calculate_score(features: Dict[str, Any]) -> tuple[float, Dict[str, float]]
 
 
 @app.post("/rank", response_model=RankResponse)
-def rank(req: RankRequest) -> RankResponse:
+def rank(
+    req: RankRequest,
+    x_request_deadline_ms: Annotated[Optional[float], Header()] = None,
+) -> RankResponse:
     """
     ルート候補をスコアリングしてランキングする
     
@@ -121,6 +142,7 @@ def rank(req: RankRequest) -> RankResponse:
     
     Args:
         req: ランキングリクエスト（ルート候補のリスト）
+        x_request_deadline_ms: 呼び出し元（Agent）の残り時間（ms）。モデル推論のタイムアウトをこれで頭打ちにする
     
     Returns:
         スコアリング結果（スコア順にソート済み）
@@ -133,43 +155,45 @@ def rank(req: RankRequest) -> RankResponse:
     failed = []  # 失敗したルートIDのリスト
     log_items = []  # BQ用ログ行
 
-    # 各ルートをスコアリング
+    # ルールスコアは必ず計算（シャドー用）
+    ruled = []  # (route, rule_score, breakdown)
     for r in req.routes:
         try:
-            # ルールスコアは必ず計算（シャドー用）
             rule_score, breakdown = _calculate_score(r.features)
-            breakdown = breakdown or {}
-            
-            # モデルスコアを取得（Vertex AIまたはXGBoost）
-            model_score, model_latency_ms, model_status = model_scorer.score(r.features)
-            
-            # モデルスコアを優先的に採用、失敗時はルールスコアにフォールバック
-            if model_score is not None and model_status == "ok":
-                final_score = float(model_score)
-            else:
-                # モデル推論失敗時はルールスコアにフォールバック
-                final_score = rule_score
-            
-            # breakdownに両方のスコアを記録
-            breakdown["rule_score"] = rule_score
-            breakdown["model_score"] = model_score
-            breakdown["model_latency_ms"] = model_latency_ms
-            breakdown["model_status"] = model_status
-            
-            scores.append(ScoreItem(route_id=r.route_id, score=final_score, breakdown=breakdown))
-            log_items.append(
-                {
-                    "route_id": r.route_id,
-                    "rule_score": rule_score,
-                    "model_score": model_score,
-                    "model_latency_ms": model_latency_ms,
-                    "status": model_status,
-                }
-            )
-        except Exception as e:
+            ruled.append((r, rule_score, breakdown or {}))
+        except Exception:
             # スコアリングに失敗したルートIDを記録
             failed.append(r.route_id)
 
+    # モデルスコアを全ルートまとめて取得（Vertex AIまたはXGBoost、predict は1回）
+    deadline_s = x_request_deadline_ms / 1000.0 if x_request_deadline_ms is not None else None
+    model_results = model_scorer.score_batch([r.features for r, _, _ in ruled], deadline_s=deadline_s)
+
+    for (r, rule_score, breakdown), (model_score, model_latency_ms, model_status) in zip(ruled, model_results):
+        # モデルスコアを優先的に採用、失敗時はルールスコアにフォールバック
+        if model_score is not None and model_status == "ok":
+            final_score = float(model_score)
+        else:
+            # モデル推論失敗時はルールスコアにフォールバック
+            final_score = rule_score
+
+        # breakdownに両方のスコアを記録
+        breakdown["rule_score"] = rule_score
+        breakdown["model_score"] = model_score
+        breakdown["model_latency_ms"] = model_latency_ms
+        breakdown["model_status"] = model_status
+
+        scores.append(ScoreItem(route_id=r.route_id, score=final_score, breakdown=breakdown))
+        log_items.append(
+            {
+                "route_id": r.route_id,
+                "rule_score": rule_score,
+                "model_score": model_score,
+                "model_latency_ms": model_latency_ms,
+                "status": model_status,
+            }
+        )
+
     # すべて失敗した場合はエラー
     if len(scores) == 0:
         raise HTTPException(status_code=422, detail="No successful inference")
@@ -181,16 +205,16 @@ def rank(req: RankRequest) -> RankResponse:
 
     if log_items:
         try:
-            bq_logger = BigQueryRankResultLogger()
-            rows = bq_logger.build_rows(
+            rows = BigQueryRankResultLogger.build_rows(
                 request_id=request_id,
                 items=log_items,
                 rule_version=settings.RANKER_VERSION,
                 model_version=settings.MODEL_VERSION,
                 status="ok",
             )
-            bq_logger.log_rank_result(rows)
+            # 書き込みはバックグラウンドスレッドで行い、レスポンスを待たせない
+            get_rank_result_writer().submit(rows)
         except Exception:
-            logger.exception("Failed to write rank_result to BigQuery")
+            logger.exception("Failed to enqueue rank_result rows")
 
     return response
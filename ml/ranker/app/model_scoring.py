@@ -4,7 +4,7 @@ import json
 import logging
 import time
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 
@@ -76,6 +76,76 @@ class ModelScorer:
             logger.exception("[Vertex predict error] %r", e)
             return None, self._elapsed_ms(start), "model_error"
 
+    def score_batch(
+        self,
+        features_list: Sequence[Dict[str, Any]],
+        deadline_s: Optional[float] = None,
+    ) -> List[Tuple[Optional[float], int, str]]:
+        """
+        複数ルートの特徴量をまとめてスコアリングする（predict 呼び出しは1回）。
+
+        xgb は全ルートを1つの行列にして1回 predict、vertex は instances に全ルートを
+        載せて1回 predict する。latency_ms はバッチ全体の所要時間を各行に入れる。
+
+        deadline_s は呼び出し元の残り時間（秒）。vertex の predict タイムアウトをこれで頭打ちにし、
+        DEADLINE_MIN_MODEL_S 未満なら predict を呼ばずに全行 model_skipped_deadline を返す。
+
+        Returns:
+            入力と同じ順序の (score, latency_ms, status) のリスト
+        """
+        if not features_list:
+            return []
+        start = time.perf_counter()
+
+        def _all(score: Optional[float], status: str) -> List[Tuple[Optional[float], int, str]]:
+            elapsed = self._elapsed_ms(start)
+            return [(score, elapsed, status) for _ in features_list]
+
+        if self._mode == "disabled":
+            return _all(None, "model_disabled")
+        if self._mode == "stub":
+            results: List[Tuple[Optional[float], int, str]] = []
+            for features in features_list:
+                try:
+                    results.append((self._stub_score(features), 0, "ok"))
+                except Exception:
+                    logger.exception("[Stub score error]")
+                    results.append((None, 0, "model_error"))
+            elapsed = self._elapsed_ms(start)
+            return [(score, elapsed, status) for score, _, status in results]
+        if self._mode == "vertex":
+            if self._load_error or self._vertex_client is None or not self._vertex_endpoint:
+                return _all(None, "model_not_loaded")
+            timeout_s = self._vertex_timeout_s
+            if deadline_s is not None:
+                if deadline_s < settings.DEADLINE_MIN_MODEL_S:
+                    return _all(None, "model_skipped_deadline")
+                timeout_s = min(timeout_s, deadline_s)
+            try:
+                preds = self._vertex_score_batch(features_list, timeout_s=timeout_s)
+            except Exception as e:
+                logger.exception("[Vertex predict error] %r", e)
+                return _all(None, "model_error")
+            elapsed = self._elapsed_ms(start)
+            return [
+                (pred, elapsed, "ok") if pred is not None else (None, elapsed, "model_error")
+                for pred in preds
+            ]
+        if self._mode != "xgb":
+            return _all(None, "model_mode_unsupported")
+        if self._load_error or self._model is None or not self._feature_columns:
+            return _all(None, "model_not_loaded")
+
+        try:
+            matrix = np.array([self._feature_row(f) for f in features_list], dtype=float)
+            preds = self._model.predict(matrix)
+            elapsed = self._elapsed_ms(start)
+            return [(float(p), elapsed, "ok") for p in preds]
+        except Exception as e:
+            # 行列全体で失敗した場合は1行ずつ推論し、失敗行だけを model_error にする
+            logger.warning("[XGB batch predict error] %r; falling back to per-row predict", e)
+            return [self.score(f) for f in features_list]
+
     def _load_model(self) -> None:
         model_path = Path(settings.MODEL_PATH)
         features_path = Path(settings.MODEL_FEATURES_PATH)
@@ -128,6 +198,28 @@ class ModelScorer:
             raise ValueError("Empty prediction response from Vertex AI.")
         return _extract_prediction_value(response.predictions[0])
 
+    def _vertex_score_batch(
+        self, features_list: Sequence[Dict[str, Any]], timeout_s: Optional[float] = None
+    ) -> List[Optional[float]]:
+        values = [json_format.ParseDict(self._sanitize_instance(f), Value()) for f in features_list]
+        response = self._vertex_client.predict(
+            endpoint=self._vertex_endpoint,
+            instances=values,
+            timeout=self._vertex_timeout_s if timeout_s is None else timeout_s,
+        )
+        predictions = list(response.predictions)
+        if len(predictions) != len(features_list):
+            raise ValueError(
+                f"Prediction count mismatch from Vertex AI: {len(predictions)} != {len(features_list)}"
+            )
+        results: List[Optional[float]] = []
+        for prediction in predictions:
+            try:
+                results.append(_extract_prediction_value(prediction))
+            except ValueError:
+                results.append(None)
+        return results
+
     @staticmethod
     def _sanitize_instance(features: Dict[str, Any]) -> Dict[str, Any]:
         sanitized: Dict[str, Any] = {}
@@ -142,6 +234,9 @@ class ModelScorer:
 
 
     def _vectorize_features(self, features: Dict[str, Any]) -> np.ndarray:
+        return np.array([self._feature_row(features)], dtype=float)
+
+    def _feature_row(self, features: Dict[str, Any]) -> list[float]:
         values: list[float] = []
         for name in self._feature_columns:
             raw = features.get(name, None)
@@ -155,7 +250,7 @@ class ModelScorer:
                 values.append(float(raw))
             except (TypeError, ValueError):
                 values.append(np.nan)
-        return np.array([values], dtype=float)
+        return values
 
     def _stub_score(self, features: Dict[str, Any]) -> float:
         """
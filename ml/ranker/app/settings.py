@@ -17,10 +17,15 @@ class Settings(BaseSettings):
     VERTEX_LOCATION: str = "asia-northeast1"
     VERTEX_ENDPOINT_ID: str = ""
     VERTEX_TIMEOUT_S: float = 10.0  # Vertex predict タイムアウト。5秒でタイムアウトしていたため延長
+    DEADLINE_MIN_MODEL_S: float = 0.1  # 呼び出し元の残り時間（X-Request-Deadline-Ms）がこれ未満ならモデル推論を省きルールスコアを使う
 
     BQ_PROJECT: str | None = None
     BQ_DATASET: str = "firstdown_mvp"
     BQ_RANK_RESULT_TABLE: str = "rank_result"
+    BQ_LOG_BATCH_MAX_ROWS: int = 200  # rank_result を1回に書き込む最大行数
+    BQ_LOG_FLUSH_INTERVAL_S: float = 1.0  # rank_result キューのフラッシュ間隔（秒）
+    BQ_LOG_MAX_QUEUE_ROWS: int = 5000  # rank_result キューの上限（超過分は捨ててカウント）
+    BQ_LOG_DRAIN_TIMEOUT_S: float = 5.0  # シャットダウン時にキューを書き切る最大待ち時間（秒）
 
 
 settings = Settings()  # グローバル設定インスタンス
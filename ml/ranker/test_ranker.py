@@ -1,8 +1,11 @@
 """
 Ranker 単体テスト: 入力固定で順序が崩れないことを確認
 """
+import numpy as np
 import pytest
+from app.bq_logger import BigQueryRankResultLogger, RankResultWriter
 from app.main import rank, _calculate_score
+from app.model_scoring import ModelScorer
 from app.schemas import RankRequest, RankRoute
 
 
@@ -150,3 +153,189 @@ def test_poi_bonus():
     score_low, _ = _calculate_score(features_low_poi)
     
     assert score_high > score_low, "POI数が多い方がスコアが高い"
+
+
+BATCH_FEATURES = [
+    {"distance_error_ratio": 0.05, "loop_closure_m": 30.0, "poi_density": 0.6, "park_poi_ratio": 0.4},
+    {"distance_error_ratio": 0.2, "loop_closure_m": 200.0, "poi_density": 0.2, "round_trip_req": True},
+    {"distance_error_ratio": 0.1, "loop_closure_m": None, "spot_type_diversity": 0.5},
+]
+
+
+class _CountingModel:
+    """predict の呼び出し回数と行数を記録する XGBRegressor の代替"""
+
+    def __init__(self, fail_on_batch: bool = False):
+        self.calls = []
+        self.fail_on_batch = fail_on_batch
+
+    def predict(self, matrix):
+        self.calls.append(matrix.shape)
+        if self.fail_on_batch and matrix.shape[0] > 1:
+            raise ValueError("batch failed")
+        return np.nansum(matrix, axis=1)
+
+
+def _xgb_scorer(model) -> ModelScorer:
+    scorer = ModelScorer(mode="disabled")
+    scorer._mode = "xgb"
+    scorer._model = model
+    scorer._feature_columns = ["distance_error_ratio", "loop_closure_m", "poi_density", "round_trip_req"]
+    return scorer
+
+
+def test_score_batch_stub_matches_per_row():
+    """stub モードのバッチ結果が1件ずつのスコアと一致し、順序も保たれることを確認"""
+    scorer = ModelScorer(mode="stub")
+    batch = scorer.score_batch(BATCH_FEATURES)
+    per_row = [scorer.score(f) for f in BATCH_FEATURES]
+    assert [(s, status) for s, _, status in batch] == [(s, status) for s, _, status in per_row]
+    # 不正な値（loop_closure_m=None）の行だけが model_error になる
+    assert [status for _, _, status in batch] == ["ok", "ok", "model_error"]
+
+
+def test_score_batch_xgb_single_predict():
+    """xgb モードでは全ルートを1つの行列にして predict を1回だけ呼ぶ"""
+    model = _CountingModel()
+    scorer = _xgb_scorer(model)
+    batch = scorer.score_batch(BATCH_FEATURES)
+    assert model.calls == [(3, 4)]
+    per_row = [scorer.score(f)[0] for f in BATCH_FEATURES]
+    assert [s for s, _, _ in batch] == pytest.approx(per_row)
+
+
+def test_score_batch_xgb_falls_back_per_row():
+    """行列での推論に失敗した場合は1行ずつ推論して行ごとの status を返す"""
+    model = _CountingModel(fail_on_batch=True)
+    batch = _xgb_scorer(model).score_batch(BATCH_FEATURES)
+    assert [status for _, _, status in batch] == ["ok", "ok", "ok"]
+    assert model.calls == [(3, 4), (1, 4), (1, 4), (1, 4)]
+
+
+def test_score_batch_vertex_single_request():
+    """vertex モードでは instances に全ルートを載せて predict を1回だけ呼ぶ"""
+
+    class _Response:
+        def __init__(self, predictions):
+            self.predictions = predictions
+
+    class _Client:
+        def __init__(self):
+            self.calls = []
+
+        def predict(self, endpoint, instances, timeout):
+            self.calls.append(len(instances))
+            return _Response([0.1 * (i + 1) for i in range(len(instances))])
+
+    client = _Client()
+    scorer = ModelScorer(mode="disabled")
+    scorer._mode = "vertex"
+    scorer._vertex_client = client
+    scorer._vertex_endpoint = "projects/p/locations/l/endpoints/e"
+    batch = scorer.score_batch(BATCH_FEATURES)
+    assert client.calls == [3]
+    assert [s for s, _, _ in batch] == pytest.approx([0.1, 0.2, 0.3])
+    assert all(status == "ok" for _, _, status in batch)
+
+
+def test_score_batch_vertex_deadline():
+    """呼び出し元の残り時間で predict のタイムアウトを縮め、足りなければ predict を呼ばない"""
+
+    class _Response:
+        def __init__(self, predictions):
+            self.predictions = predictions
+
+    class _Client:
+        def __init__(self):
+            self.timeouts = []
+
+        def predict(self, endpoint, instances, timeout):
+            self.timeouts.append(timeout)
+            return _Response([0.5] * len(instances))
+
+    client = _Client()
+    scorer = ModelScorer(mode="disabled")
+    scorer._mode = "vertex"
+    scorer._vertex_client = client
+    scorer._vertex_endpoint = "projects/p/locations/l/endpoints/e"
+    scorer._vertex_timeout_s = 10.0
+
+    assert all(status == "ok" for _, _, status in scorer.score_batch(BATCH_FEATURES, deadline_s=0.5))
+    assert client.timeouts == [0.5]
+    skipped = scorer.score_batch(BATCH_FEATURES, deadline_s=0.01)
+    assert [status for _, _, status in skipped] == ["model_skipped_deadline"] * 3
+    assert client.timeouts == [0.5]
+
+
+def test_score_batch_disabled_and_empty():
+    """disabled は全行 model_disabled、空入力は空リストを返す"""
+    scorer = ModelScorer(mode="disabled")
+    assert scorer.score_batch([]) == []
+    assert [status for _, _, status in scorer.score_batch(BATCH_FEATURES)] == ["model_disabled"] * 3
+
+
+class _FakeBQClient:
+    """insert_rows_json の呼び出しを記録する bigquery.Client の代替"""
+
+    project = "test-project"
+
+    def __init__(self, fail: bool = False):
+        self.inserts = []
+        self.fail = fail
+
+    def insert_rows_json(self, table_id, rows):
+        if self.fail:
+            raise RuntimeError("bq unavailable")
+        self.inserts.append((table_id, list(rows)))
+        return []
+
+
+def _rows(n: int):
+    return BigQueryRankResultLogger.build_rows(
+        request_id="req",
+        items=[{"route_id": f"r{i}", "rule_score": 0.5} for i in range(n)],
+        rule_version="rule",
+        model_version="model",
+        status="ok",
+    )
+
+
+def test_rank_result_writer_batches_with_shared_client():
+    """rank_result 行をまとめて書き込み、停止時にキューを書き切る"""
+    client = _FakeBQClient()
+    writer = RankResultWriter(
+        BigQueryRankResultLogger(dataset="ds", table="rank_result", client=client),
+        batch_max_rows=4,
+        flush_interval_s=5.0,
+    )
+    writer.submit(_rows(3))
+    writer.submit(_rows(3))
+    writer.stop(timeout_s=5.0)
+
+    assert sum(len(rows) for _, rows in client.inserts) == 6
+    assert all(table_id == "test-project.ds.rank_result" for table_id, _ in client.inserts)
+    assert max(len(rows) for _, rows in client.inserts) <= 4
+    stats = writer.stats()
+    assert stats["written_rows"] == 6
+    assert stats["queue_depth"] == 0
+    assert not stats["running"]
+
+
+def test_rank_result_writer_counts_dropped_and_failed():
+    """キュー超過分は dropped、書き込み失敗分は failed として数える"""
+    client = _FakeBQClient(fail=True)
+    writer = RankResultWriter(
+        BigQueryRankResultLogger(client=client),
+        flush_interval_s=5.0,
+        max_queue_rows=2,
+    )
+    writer.start = lambda: None  # スレッドを起動せずにキュー溢れを再現する
+    writer.submit(_rows(5))
+    assert writer.stats()["dropped_rows"] == 3
+
+    del writer.start
+    writer.start()
+    writer.stop(timeout_s=5.0)
+    stats = writer.stats()
+    assert stats["failed_rows"] == 2
+    assert stats["written_rows"] == 0